@@ -5,15 +5,20 @@ Chạy: uvicorn api_server:app --reload --port 8000
 
 import os
 import sys
+import threading
 import uuid
 import time
 from typing import Any, Dict, List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
+from app.prefork import MODEL_PRELOAD, process_memory
+from app.warmup import MODEL_WARMUP
+
 # ============================
 # BIẾN TRẠNG THÁI MODELS
 # ============================
@@ -23,6 +28,13 @@ _models_error: Optional[str] = None
 _reset_conversation = None
 _run_chat_pipeline = None
 
+# Scheduler nhắc uống thuốc trong process:
+#   - "inprocess" (mặc định): min-heap thời điểm nhắc, chỉ thức dậy khi có reminder đến hạn
+#   - "external": không chạy scheduler, dùng medicine_reminder_scheduler.py gọi /check định kỳ
+REMINDER_SCHEDULER = os.environ.get("REMINDER_SCHEDULER", "inprocess").strip().lower()
+_reminder_scheduler = None
+_reminder_dispatcher = None
+
 
 def _parse_allowed_origins(value: Optional[str]) -> List[str]:
     if not value:
@@ -49,134 +61,228 @@ app.add_middleware(
 # ============================
 # LOAD MODELS KHI SERVER KHỞI ĐỘNG
 # ============================
+# Load ở thread nền: uvicorn mở port ngay (/health trả lời trong vài giây), /ready báo tiến độ
+# từng bước, /api/chat trả 503 cho tới khi xong. MODEL_LOAD_BACKGROUND=0 → chặn startup như cũ.
+MODEL_LOAD_BACKGROUND = os.environ.get("MODEL_LOAD_BACKGROUND", "1") == "1"
+
+_LOAD_STEPS = [
+    ("firestore", "Đang khởi tạo Firestore"),
+    ("import_modules", "Đang import các module cơ bản"),
+    ("intent", "Đang load Intent Classifier (PhoBERT)"),
+    ("rag", "Đang load RAG Retriever (FAISS + SentenceTransformer)"),
+    ("gemini", "Đang kiểm tra Gemini API"),
+    ("pipeline", "Đang khởi tạo chatbot pipeline"),
+    ("warmup", "Đang warm-up pipeline (không gọi Gemini)"),
+]
+_load_progress: Dict[str, Any] = {}
+_load_thread: Optional[threading.Thread] = None
+_models_preloaded = False  # models load sẵn trong master gunicorn (MODEL_PRELOAD=1)
+
+
+def _reset_load_progress() -> None:
+    _load_progress.clear()
+    _load_progress.update({
+        "step": None,
+        "completed": 0,
+        "total": len(_LOAD_STEPS),
+        "step_times": {},
+        "started_at": time.time(),
+        "finished_at": None,
+        "warmup": None,
+    })
+
+
+def _begin_step(name: str) -> float:
+    index = [step for step, _ in _LOAD_STEPS].index(name)
+    _load_progress["step"] = name
+    print(f"[{index}/{len(_LOAD_STEPS) - 1}] {_LOAD_STEPS[index][1]}...")
+    return time.time()
+
+
+def _end_step(name: str, step_start: float) -> float:
+    duration = time.time() - step_start
+    _load_progress["step_times"][name] = round(duration, 2)
+    _load_progress["completed"] += 1
+    return duration
+
+
 @app.on_event("startup")
 async def load_models():
-    """Load tất cả models khi server khởi động - từng bước để tránh quá tải"""
-    global _models_ready, _models_loading, _models_error
-    global _reset_conversation, _run_chat_pipeline
-    
-    if _models_ready:
+    """Bắt đầu load models (thread nền, hoặc chặn startup nếu MODEL_LOAD_BACKGROUND=0)"""
+    global _models_loading, _models_error, _load_thread
+
+    if _models_preloaded:
+        # Models có sẵn từ master; torch/tokenizer cache là state riêng của process → warm-up trong worker
+        if MODEL_WARMUP:
+            threading.Thread(
+                target=_warmup, args=(_run_chat_pipeline, _reset_conversation), name="model-warmup", daemon=True
+            ).start()
         return
-    
+
+    if _models_ready or _models_loading:
+        return
+
     _models_loading = True
     _models_error = None
-    
+    _reset_load_progress()
+
+    if not MODEL_LOAD_BACKGROUND:
+        await run_in_threadpool(_load_models_sync)
+        return
+
+    # Thread daemon (không dùng executor của event loop) để tắt server giữa chừng không phải chờ load xong
+    _load_thread = threading.Thread(target=_load_models_sync, name="model-loader", daemon=True)
+    _load_thread.start()
+    print("🚀 Server đã mở port, models đang load ở nền (xem tiến độ tại /ready)")
+
+
+def preload_models():
+    """Load models trong master gunicorn trước khi fork worker (MODEL_PRELOAD=1, xem app/prefork.py)"""
+    global _models_loading, _models_preloaded
+    from app.prefork import freeze_before_fork, prepare_master
+
+    prepare_master()
+    _models_loading = True
+    _reset_load_progress()
+    _load_models_sync(warmup=False, preload_indexes=True)
+    _models_preloaded = _models_ready
+    freeze_before_fork()
+
+
+def _warmup(run_chat_pipeline, reset_conversation) -> Dict[str, Any]:
+    """Warm-up mỗi intent vài câu (Gemini thay bằng câu trả lời cố định), tiến độ ghi vào /ready"""
+    from app.warmup import load_warmup_inputs, run_warmup
+
+    def on_input(done: int, total: int) -> None:
+        _load_progress["warmup"] = {"done": done, "total": total}
+
+    # Lỗi ở đây trả về trong kết quả (không raise): warm-up chỉ để tăng tốc, không chặn /ready
+    summary = run_warmup(run_chat_pipeline, reset_conversation, load_warmup_inputs(), on_input)
+    _load_progress["warmup"] = {
+        "done": summary["inputs"], "total": summary["inputs"], "errors": summary["errors"],
+    }
+    print(f"🔥 Warm-up {summary['inputs']} câu, {summary['errors']} lỗi ({summary['seconds']:.2f}s)")
+    return summary
+
+
+def _load_models_sync(warmup: bool = True, preload_indexes: bool = False):
+    """Load tất cả models - từng bước để tránh quá tải"""
+    global _models_ready, _models_loading, _models_error
+    global _reset_conversation, _run_chat_pipeline
+
     print("\n" + "="*60)
-    print("🚀 ĐANG KHỞI ĐỘNG SERVER VÀ LOAD MODELS...")
+    print("🚀 ĐANG LOAD MODELS...")
     print("="*60 + "\n")
-    
+
     start_time = time.time()
-    step_times = {}
-    
+
     try:
         # Bước 0: Khởi tạo Firestore (nếu có)
-        print("[0/6] Đang khởi tạo Firestore...")
-        step_start = time.time()
+        step_start = _begin_step("firestore")
         try:
             from firestore_service import initialize_firestore
             initialize_firestore()
-            step_times["firestore"] = time.time() - step_start
-            print(f"      ✅ Firestore đã sẵn sàng ({step_times['firestore']:.2f}s)\n")
+            print(f"      ✅ Firestore đã sẵn sàng ({_end_step('firestore', step_start):.2f}s)\n")
         except Exception as e:
             # Frontend đã lưu trực tiếp vào Firestore
-            step_times["firestore"] = time.time() - step_start
-            print(f"      ⏱️  Thời gian: {step_times['firestore']:.2f}s\n")
-        
+            print(f"      ⏱️  Thời gian: {_end_step('firestore', step_start):.2f}s\n")
+
         # Bước 1: Import các module cơ bản (không load models)
-        print("[1/6] Đang import các module cơ bản...")
-        step_start = time.time()
+        step_start = _begin_step("import_modules")
         from app.response_layer import need_more_info, build_clarification_question
         from app.symptom_extractor import extract_symptoms
         from app.risk_estimator import estimate_risk
-        step_times["import_modules"] = time.time() - step_start
-        print(f"      ✅ Hoàn thành ({step_times['import_modules']:.2f}s)\n")
-        
+        print(f"      ✅ Hoàn thành ({_end_step('import_modules', step_start):.2f}s)\n")
+
         # Bước 2: Load Intent Classifier (PhoBERT) - thường nhẹ nhất
-        print("[2/6] Đang load Intent Classifier (PhoBERT)...")
+        step_start = _begin_step("intent")
         print("      ⏳ Có thể mất 30-60 giây...")
-        step_start = time.time()
         try:
-            from intent.intent_classifier import IntentClassifier
-            intent_model_path = r"D:\CHAT BOT TTCS\model\intent_model"
-            intent_classifier = IntentClassifier(intent_model_path)
-            step_times["intent"] = time.time() - step_start
-            print(f"      ✅ Intent Classifier đã load ({step_times['intent']:.2f}s)\n")
+            # INTENT_BACKEND=shared_sbert → SBERT + intent head (encoder dùng chung với RAG)
+            from chatbot import create_intent_classifier
+            intent_classifier = create_intent_classifier()
+            print(f"      ✅ Intent Classifier đã load ({_end_step('intent', step_start):.2f}s)\n")
         except Exception as e:
             raise Exception(f"Lỗi khi load Intent Classifier: {str(e)}")
-        
+
         # Bước 3: Load RAG Retriever (FAISS + SentenceTransformer)
-        print("[3/6] Đang load RAG Retriever (FAISS + SentenceTransformer)...")
+        step_start = _begin_step("rag")
         print("      ⏳ Có thể mất 1-2 phút...")
-        step_start = time.time()
         try:
-            from rag.retriever import Retriever
-            rag_path = r"D:\CHAT BOT TTCS\rag"
-            retriever = Retriever(rag_path)
-            step_times["rag"] = time.time() - step_start
-            print(f"      ✅ RAG Retriever đã load ({step_times['rag']:.2f}s)\n")
+            from chatbot import create_retriever
+            retriever = create_retriever(intent_classifier)
+            if preload_indexes:
+                # Trước khi fork: load hết index ngay để các worker dùng chung, không lazy-load riêng
+                loaded = retriever.preload_all()
+                print(f"      📦 Đã load index của {len(loaded)} intent")
+            print(f"      ✅ RAG Retriever đã load ({_end_step('rag', step_start):.2f}s)\n")
         except Exception as e:
             raise Exception(f"Lỗi khi load RAG Retriever: {str(e)}")
-        
+
         # Bước 4: Kiểm tra Gemini API (không cần load model)
-        print("[4/6] Đang kiểm tra Gemini API...")
+        step_start = _begin_step("gemini")
         print("      ⚡ Sử dụng Gemini API - nhanh và không cần load model nặng")
-        step_start = time.time()
         try:
             from generator.gemini_generator import _get_model
             model = _get_model()  # Test connection
-            step_times["gemini"] = time.time() - step_start
-            print(f"      ✅ Gemini API đã sẵn sàng ({step_times['gemini']:.2f}s)\n")
+            print(f"      ✅ Gemini API đã sẵn sàng ({_end_step('gemini', step_start):.2f}s)\n")
         except Exception as e:
             print(f"      ⚠️  Cảnh báo: {str(e)}")
             print("      Hệ thống vẫn sẽ hoạt động nhưng có thể gặp lỗi khi generate")
-            step_times["gemini"] = time.time() - step_start
-            print(f"      ⏱️  Thời gian: {step_times['gemini']:.2f}s\n")
-        
-        # Bước 5: Gán models vào chatbot module và test
-        print("[5/6] Đang khởi tạo chatbot pipeline và kiểm tra...")
-        step_start = time.time()
+            print(f"      ⏱️  Thời gian: {_end_step('gemini', step_start):.2f}s\n")
+
+        # Bước 5: Gán models vào chatbot module
+        step_start = _begin_step("pipeline")
         try:
             # Import chatbot module
             import chatbot
-            
+
             # Gán models đã load vào chatbot module (tránh load lại)
             chatbot.intent_classifier = intent_classifier
             chatbot.retriever = retriever
             chatbot._models_initialized = True
-            
+
             # Import functions
             from chatbot import reset_conversation, run_chat_pipeline
-            _reset_conversation = reset_conversation
-            _run_chat_pipeline = run_chat_pipeline
-            
-            # Test với câu đơn giản
-            print("      ⏳ Đang test pipeline...")
-            test_response = run_chat_pipeline("xin chào", session_id="startup_test")
-            step_times["pipeline"] = time.time() - step_start
-            print(f"      ✅ Pipeline hoạt động tốt ({step_times['pipeline']:.2f}s)\n")
+            print(f"      ✅ Pipeline đã khởi tạo ({_end_step('pipeline', step_start):.2f}s)\n")
         except Exception as e:
             raise Exception(f"Lỗi khi khởi tạo pipeline: {str(e)}")
-        
+
+        # Bước 6: Warm-up mỗi intent vài câu (Gemini thay bằng câu trả lời cố định)
+        step_start = _begin_step("warmup")
+        if not warmup:
+            # Preload trong master: không chạy inference trước khi fork (thread pool torch/OpenMP)
+            print(f"      ⏭️  Để sau: warm-up trong từng worker ({_end_step('warmup', step_start):.2f}s)\n")
+        elif MODEL_WARMUP:
+            _warmup(run_chat_pipeline, reset_conversation)
+            print(f"      ✅ Warm-up xong ({_end_step('warmup', step_start):.2f}s)\n")
+        else:
+            print(f"      ⏭️  Bỏ qua (MODEL_WARMUP=0) ({_end_step('warmup', step_start):.2f}s)\n")
+
         elapsed = time.time() - start_time
-        
+
+        _reset_conversation = reset_conversation
+        _run_chat_pipeline = run_chat_pipeline
+        _load_progress["step"] = None
+        _load_progress["finished_at"] = time.time()
         _models_ready = True
         _models_loading = False
-        
+
         print("\n" + "="*60)
         print("✅ TẤT CẢ MODELS ĐÃ SẴN SÀNG!")
         print(f"⏱️  Tổng thời gian: {elapsed:.2f} giây ({elapsed/60:.1f} phút)")
         print("\n📊 Chi tiết:")
-        for step, duration in step_times.items():
+        for step, duration in _load_progress["step_times"].items():
             print(f"   - {step}: {duration:.2f}s")
         print("="*60 + "\n")
-        
+
     except MemoryError as e:
-        _models_loading = False
-        _models_ready = False
         _models_error = f"Không đủ RAM: {str(e)}"
-        
+        _models_ready = False
+        _models_loading = False
+
         elapsed = time.time() - start_time
-        
+
         print("\n" + "="*60)
         print("❌ LỖI: KHÔNG ĐỦ BỘ NHỚ!")
         print(f"   {_models_error}")
@@ -186,27 +292,90 @@ async def load_models():
         print("   - Sử dụng GPU nếu có")
         print("   - Giảm batch size hoặc sử dụng model nhẹ hơn")
         print("="*60 + "\n")
-        
+
         import traceback
         traceback.print_exc()
-        
+
     except Exception as e:
-        _models_loading = False
-        _models_ready = False
         _models_error = str(e)
-        
+        _models_ready = False
+        _models_loading = False
+
         elapsed = time.time() - start_time
-        
+
         print("\n" + "="*60)
         print("❌ LỖI KHI LOAD MODELS!")
         print(f"   Chi tiết: {_models_error}")
         print(f"⏱️  Thời gian trước khi lỗi: {elapsed:.2f} giây")
         print("="*60 + "\n")
-        
+
         import traceback
         traceback.print_exc()
 
 
+@app.on_event("startup")
+async def start_reminder_scheduler():
+    """Đọc reminder active và chạy scheduler nhắc uống thuốc trong process (đồng bộ lại định kỳ với Firestore)"""
+    global _reminder_scheduler
+    if REMINDER_SCHEDULER != "inprocess" or _reminder_scheduler is not None:
+        return
+    try:
+        from reminders.scheduler import ReminderScheduler
+        from reminders.store import FirestoreReminderStore, MemoryReminderStore
+
+        db = None
+        try:
+            from firestore_service import get_db
+            db = get_db()
+        except Exception:
+            pass
+        if db:
+            store = FirestoreReminderStore(db)
+        else:
+            if not hasattr(app.state, 'medicine_reminders'):
+                app.state.medicine_reminders = {}
+            store = MemoryReminderStore(app.state.medicine_reminders)
+
+        scheduler = ReminderScheduler(store, _get_reminder_dispatcher())
+        count = await run_in_threadpool(scheduler.load)
+        scheduler.start()
+        _reminder_scheduler = scheduler
+        print(f"⏰ Reminder scheduler đã chạy ({count} reminder active, store={type(store).__name__})")
+    except Exception as e:
+        print(f"⚠️ Không khởi động được reminder scheduler: {e}")
+
+
+@app.on_event("shutdown")
+async def stop_reminder_scheduler():
+    if _reminder_scheduler is not None:
+        await _reminder_scheduler.stop()
+    if _reminder_dispatcher is not None:
+        _reminder_dispatcher.close()
+
+
+@app.on_event("startup")
+async def start_firestore_cache_listeners():
+    """Bật snapshot listener xóa cache profile/reminder khi Firestore đổi (tắt bằng FIRESTORE_CACHE_LISTENERS=0)"""
+    if os.environ.get("FIRESTORE_CACHE_LISTENERS", "1") != "1":
+        return
+    try:
+        from firestore_service import start_cache_listeners
+        await run_in_threadpool(start_cache_listeners)
+    except Exception as e:
+        print(f"⚠️ Không bật được cache listener Firestore: {e}")
+
+
+@app.on_event("shutdown")
+def flush_chat_writes():
+    """Ghi nốt các message/session chat còn trong hàng đợi write-behind"""
+    try:
+        from firestore_service import shutdown_chat_writer, stop_cache_listeners
+        shutdown_chat_writer()
+        stop_cache_listeners()
+    except Exception as e:
+        print(f"⚠️ Không flush được hàng đợi ghi chat: {e}")
+
+
 # ============================
 # REQUEST/RESPONSE MODELS
 # ============================
@@ -273,27 +442,77 @@ async def healthcheck():
 
 @app.get("/ready")
 async def ready_check():
-    """Kiểm tra xem models đã load xong chưa"""
+    """Kiểm tra xem models đã load xong chưa (kèm tiến độ từng bước khi đang load)"""
+    progress = _load_progress_snapshot()
     if _models_ready:
         return {
             "ready": True,
             "status": "Models đã sẵn sàng",
-            "error": None
+            "error": None,
+            "progress": progress
         }
     elif _models_loading:
         return {
             "ready": False,
             "status": "Models đang tải, vui lòng đợi...",
-            "error": None
+            "error": None,
+            "progress": progress
         }
     else:
         return {
             "ready": False,
             "status": "Models chưa sẵn sàng",
-            "error": _models_error or "Chưa khởi động"
+            "error": _models_error or "Chưa khởi động",
+            "progress": progress
         }
 
 
+def _load_progress_snapshot() -> Optional[Dict[str, Any]]:
+    if not _load_progress:
+        return None
+    end = _load_progress["finished_at"] or time.time()
+    return {
+        "step": _load_progress["step"],
+        "completed": _load_progress["completed"],
+        "total": _load_progress["total"],
+        "elapsed": round(end - _load_progress["started_at"], 2),
+        "step_times": dict(_load_progress["step_times"]),
+        "warmup": _load_progress["warmup"],
+    }
+
+
+@app.get("/api/stats")
+async def runtime_stats():
+    """Thống kê cache/prompt trong process (hit/miss cache Gemini, kích thước prompt, cache RAG)"""
+    from generator.gemini_generator import get_coalescing_stats, get_instruction_cache_stats
+    from generator.prompt_builder import get_prompt_stats
+
+    stats: Dict[str, Any] = {
+        "gemini_instruction_cache": get_instruction_cache_stats(),
+        "gemini_coalescing": get_coalescing_stats(),
+        "prompt_sizes": get_prompt_stats(),
+    }
+    if _reminder_scheduler is not None:
+        stats["reminder_scheduler"] = _reminder_scheduler.stats()
+    exercise_suggestion = sys.modules.get("generator.exercise_suggestion")
+    if exercise_suggestion is not None and exercise_suggestion._cache is not None:
+        stats["exercise_suggestion_cache"] = exercise_suggestion._cache.stats()
+    firestore_service = sys.modules.get("firestore_service")
+    if firestore_service is not None:
+        stats["firestore_cache"] = firestore_service.get_cache_stats()
+        if firestore_service._chat_writer is not None:
+            stats["chat_write_behind"] = firestore_service._chat_writer.stats()
+    stats["memory"] = process_memory()
+    inference_client = sys.modules.get("inference.client")
+    if inference_client is not None and inference_client._clients:
+        stats["inference_service"] = [client.stats() for client in inference_client._clients.values()]
+    if _models_ready:
+        import chatbot
+        if chatbot.retriever is not None:
+            stats["rag_result_cache"] = chatbot.retriever.cache_stats()
+    return stats
+
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(payload: ChatRequest):
     if not _models_ready:
@@ -321,7 +540,11 @@ async def chat(payload: ChatRequest):
     try:
         session_id = payload.session_id or str(uuid.uuid4())
         user_id = payload.user_id  # Lấy user_id từ payload
-        response = _run_chat_pipeline(payload.message, session_id=session_id, user_id=user_id)
+        # Chạy pipeline (blocking: model + Gemini) trong threadpool để không chặn event loop;
+        # các request giống nhau đến cùng lúc nhờ vậy mới gộp được lời gọi Gemini
+        response = await run_in_threadpool(
+            _run_chat_pipeline, payload.message, session_id=session_id, user_id=user_id
+        )
         response["session_id"] = session_id
         
         # KHÔNG lưu vào Firestore ở backend vì frontend đã lưu
@@ -352,144 +575,19 @@ class ExerciseSuggestionRequest(BaseModel):
 async def generate_exercise_suggestion(request: ExerciseSuggestionRequest):
     """
     Tạo gợi ý tập luyện bằng Gemini dựa trên health profile
+    (cache theo nhóm tuổi / giới tính / mức vận động / nhóm BMI, chỉ gọi Gemini khi miss)
     """
     try:
-        from generator.gemini_generator import generate_answer
-        
-        tuoi = request.tuoi
-        chieuCao = request.chieuCao
-        canNang = request.canNang
-        mucVanDong = request.mucVanDong
-        gioiTinh = request.gioiTinh
-        bmi = request.bmi
-        bmiCategory = request.bmiCategory
-        
-        # Chuyển đổi labels
-        muc_van_dong_labels = {'it': 'Ít', 'vua': 'Vừa', 'nhieu': 'Nhiều'}
-        gioi_tinh_labels = {'nam': 'Nam', 'nu': 'Nữ', 'khac': 'Khác'}
-        muc_van_dong_label = muc_van_dong_labels.get(mucVanDong, 'Ít')
-        gioi_tinh_label = gioi_tinh_labels.get(gioiTinh, 'Khác')
-        
-        # Xác định độ tuổi
-        is_elderly = tuoi >= 50
-        is_young = tuoi < 30
-        
-        # Tạo prompt chi tiết cho Gemini
-        prompt = f"""Dựa vào thông tin sức khỏe sau, hãy tạo một kế hoạch tập luyện CHI TIẾT, RỘNG và PHÙ HỢP:
-
-THÔNG TIN SỨC KHỎE:
-- Tuổi: {tuoi} tuổi
-- Giới tính: {gioi_tinh_label}
-- Chiều cao: {chieuCao} cm
-- Cân nặng: {canNang} kg
-- BMI: {bmi:.1f} ({bmiCategory})
-- Mức vận động hiện tại: {muc_van_dong_label}
-
-YÊU CẦU:
-Hãy tạo gợi ý tập luyện CHI TIẾT và RỘNG với format JSON sau (CHỈ trả về JSON, không có text thêm):
-{{
-  "title": "Tiêu đề kế hoạch tập luyện (ví dụ: Kế hoạch tập luyện tăng cơ và sức khỏe)",
-  "exercises": ["Bài tập 1 chi tiết", "Bài tập 2 chi tiết", "Bài tập 3 chi tiết", "Bài tập 4 chi tiết", "Bài tập 5 chi tiết"],
-  "frequency": "Tần suất tập luyện cụ thể (ví dụ: 3-4 lần/tuần, mỗi ngày cách nhau)",
-  "duration": "Thời gian mỗi buổi cụ thể (ví dụ: 30-40 phút/buổi, bao gồm khởi động và thư giãn)",
-  "notes": "Lưu ý và khuyến nghị chi tiết, bao gồm cả chế độ dinh dưỡng và nghỉ ngơi"
-}}
-
-LƯU Ý QUAN TRỌNG:
-- Gợi ý phải AN TOÀN, phù hợp với tuổi tác ({tuoi} tuổi) và giới tính ({gioi_tinh_label})
-- Nếu BMI thấp (hơi gầy): tập trung vào tăng cơ, tăng sức khỏe, dinh dưỡng giàu protein
-- Nếu BMI cao (thừa cân): tập trung vào giảm cân an toàn, cardio, kết hợp dinh dưỡng
-- Nếu mức vận động hiện tại là "Ít": bắt đầu từ từ, nhẹ nhàng, tăng dần
-- Nếu mức vận động là "Nhiều": có thể gợi ý cường độ cao hơn, đa dạng hơn
-- Người lớn tuổi (>=50): ưu tiên bài tập nhẹ nhàng, an toàn, tránh chấn thương
-- Người trẻ (<30): có thể gợi ý cường độ cao hơn, đa dạng hơn
-- Không được chẩn đoán bệnh, không gợi ý thuốc
-- Chỉ đưa ra lời khuyên tập luyện và lối sống lành mạnh
-- Hãy đưa ra NHIỀU bài tập đa dạng (ít nhất 5-6 bài), không chỉ 4 bài cơ bản
-- Bao gồm cả gợi ý về khởi động, thư giãn, và chế độ dinh dưỡng kèm theo
-
-Hãy tạo gợi ý tập luyện PHÙ HỢP, CHI TIẾT và RỘNG."""
-        
-        system_instruction = """Bạn là chuyên gia thể dục và sức khỏe chuyên nghiệp. Nhiệm vụ của bạn là tạo kế hoạch tập luyện an toàn, phù hợp, chi tiết và rộng dựa trên thông tin sức khỏe của người dùng. Luôn ưu tiên an toàn và phù hợp với từng cá nhân. Hãy đưa ra nhiều gợi ý đa dạng, không chỉ giới hạn ở 4-5 bài tập cơ bản."""
-        
-        # Gọi Gemini để generate
-        response_text = generate_answer(prompt, system_instruction)
-        
-        # Parse JSON từ response
-        import json
-        import re
-        
-        # Tìm JSON trong response (có thể có text thêm)
-        # Thử nhiều cách parse JSON
-        json_match = re.search(r'\{[\s\S]*\}', response_text)
-        if json_match:
-            json_str = json_match.group(0)
-            try:
-                suggestion = json.loads(json_str)
-            except json.JSONDecodeError as e:
-                # Thử fix một số lỗi JSON phổ biến
-                json_str = json_str.replace("'", '"')  # Thay single quote bằng double quote
-                json_str = re.sub(r'(\w+):', r'"\1":', json_str)  # Thêm quotes cho keys
-                try:
-                    suggestion = json.loads(json_str)
-                except:
-                    # Không thể parse JSON
-                    raise ValueError("Không thể parse JSON từ response")
-            
-            # Validate và đảm bảo đầy đủ fields
-            exercises = suggestion.get("exercises", [])
-            if not isinstance(exercises, list):
-                exercises = []
-            
-            # Đảm bảo tất cả exercises là strings
-            exercises_clean = []
-            for i, ex in enumerate(exercises):
-                if isinstance(ex, str):
-                    ex_clean = ex.strip()
-                    if ex_clean and len(ex_clean) > 0:
-                        exercises_clean.append(ex_clean)
-                elif isinstance(ex, dict):
-                    # Nếu là object, lấy text, name, title, hoặc description
-                    ex_text = ex.get("text") or ex.get("name") or ex.get("title") or ex.get("description") or ex.get("content")
-                    if ex_text:
-                        ex_clean = str(ex_text).strip()
-                        if ex_clean and len(ex_clean) > 0:
-                            exercises_clean.append(ex_clean)
-                    else:
-                        # Nếu không có field text, lấy giá trị đầu tiên
-                        values = [v for v in ex.values() if v]
-                        if values:
-                            ex_clean = str(values[0]).strip()
-                            if ex_clean and len(ex_clean) > 0:
-                                exercises_clean.append(ex_clean)
-                elif ex is not None:
-                    # Nếu là number hoặc type khác, convert sang string
-                    ex_clean = str(ex).strip()
-                    if ex_clean and len(ex_clean) > 0 and ex_clean.lower() not in ['null', 'none', 'undefined']:
-                        exercises_clean.append(ex_clean)
-            
-            # Lọc bỏ empty strings và duplicates
-            exercises_clean = list(dict.fromkeys([ex for ex in exercises_clean if ex and len(ex) > 0]))
-            
-            # Nếu không có exercises hợp lệ, dùng fallback
-            if len(exercises_clean) == 0:
-                # Không có exercises hợp lệ từ Gemini, dùng fallback
-                exercises_clean = ["Đi bộ 30 phút mỗi ngày", "Tập thể dục nhẹ nhàng", "Yoga hoặc stretching", "Đạp xe hoặc bơi lội"]
-            
-            result = {
-                "title": str(suggestion.get("title", "Kế hoạch tập luyện")).strip(),
-                "exercises": exercises_clean,
-                "frequency": str(suggestion.get("frequency", "3-4 lần/tuần")).strip(),
-                "duration": str(suggestion.get("duration", "30-40 phút/buổi")).strip(),
-                "notes": str(suggestion.get("notes", "Hãy bắt đầu từ từ và tăng dần cường độ.")).strip()
-            }
-            
-            print(f"✅ Gemini đã tạo {len(exercises_clean)} bài tập: {exercises_clean[:3]}...")
-            return result
-        else:
-            # Nếu không parse được JSON, trả về fallback
-            # Không tìm thấy JSON trong response
-            raise ValueError("Không thể parse JSON từ response")
+        from generator.exercise_suggestion import get_exercise_suggestion
+        
+        result = await run_in_threadpool(
+            get_exercise_suggestion,
+            request.tuoi,
+            request.gioiTinh,
+            request.mucVanDong,
+            request.bmi,
+        )
+        return result
             
     except Exception as e:
         print(f"❌ Lỗi khi generate exercise suggestion: {e}")
@@ -500,12 +598,9 @@ Hãy tạo gợi ý tập luyện PHÙ HỢP, CHI TIẾT và RỘNG."""
 
 @app.post("/api/chat/reset")
 async def reset(payload: ResetRequest):
-    if not _reset_conversation:
-        raise HTTPException(
-            status_code=503,
-            detail="Models chưa sẵn sàng"
-        )
-    _reset_conversation(payload.session_id)
+    # Chỉ xoá state hội thoại → không cần chờ models (import chatbot không load/import torch, faiss)
+    from chatbot import reset_conversation
+    reset_conversation(payload.session_id)
     return {"session_id": payload.session_id, "status": "reset"}
 
 
@@ -516,21 +611,30 @@ async def reset(payload: ResetRequest):
 async def create_reminder(reminder: MedicineReminderRequest):
     """Tạo lịch nhắc nhở uống thuốc mới"""
     try:
-        # Parse time
-        time_parts = reminder.time.split(":")
-        hour = int(time_parts[0])
-        minute = int(time_parts[1]) if len(time_parts) > 1 else 0
+        from reminders.recurrence import next_fire_time
         
         # Tạo reminder ID
         reminder_id = str(uuid.uuid4())
         
-        # Tính toán next reminder time
-        now = datetime.now()
-        reminder_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if reminder.repeat_type not in ("daily", "weekly", "once"):
+            raise HTTPException(status_code=400, detail="repeat_type phải là daily, weekly hoặc once")
+        if reminder.weekday is not None and not 0 <= reminder.weekday <= 6:
+            raise HTTPException(status_code=400, detail="weekday phải từ 0 (thứ 2) đến 6 (chủ nhật)")
         
-        # Nếu thời gian đã qua trong ngày hôm nay, set cho ngày mai
-        if reminder_time < now:
-            reminder_time += timedelta(days=1)
+        # Lần nhắc đầu tiên theo time/repeat_type/weekday/start_date/end_date
+        try:
+            reminder_time = next_fire_time({
+                "time": reminder.time,
+                "repeat_type": reminder.repeat_type,
+                "weekday": reminder.weekday,
+                "start_date": reminder.start_date,
+                "end_date": reminder.end_date,
+            }, datetime.now())
+        except ValueError as e:
+            # Giờ nhắc sai định dạng → lỗi của request, không lưu reminder scheduler không tính được
+            raise HTTPException(status_code=400, detail=str(e))
+        if reminder_time is None:
+            raise HTTPException(status_code=400, detail="Không còn lần nhắc nào trong khoảng start_date - end_date")
         
         reminder_data = {
             "id": reminder_id,
@@ -561,8 +665,14 @@ async def create_reminder(reminder: MedicineReminderRequest):
                 app.state.medicine_reminders = {}
             app.state.medicine_reminders[reminder_id] = reminder_data
         
+        # Đưa vào lịch của scheduler trong process
+        if _reminder_scheduler is not None:
+            _reminder_scheduler.schedule({**reminder_data, "next_fire_ts": reminder_time.timestamp()})
+        
         return MedicineReminderResponse(**reminder_data)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -574,7 +684,7 @@ async def get_reminders(user_id: str):
         # Ưu tiên lấy từ Firestore
         try:
             from firestore_service import get_medicine_reminders
-            reminders = get_medicine_reminders(user_id)
+            reminders = await run_in_threadpool(get_medicine_reminders, user_id)
             if reminders:
                 # Convert Firestore format sang response format
                 result = []
@@ -617,6 +727,8 @@ async def get_reminders(user_id: str):
 @app.delete("/api/medicine-reminders/{reminder_id}")
 async def delete_reminder(reminder_id: str):
     """Xóa lịch nhắc nhở"""
+    if _reminder_scheduler is not None:
+        _reminder_scheduler.unschedule(reminder_id)
     try:
         # Ưu tiên xóa từ Firestore
         try:
@@ -644,100 +756,42 @@ async def check_and_send_reminders():
         now = datetime.now()
         sent_count = 0
         
-        # Ưu tiên lấy từ Firestore
+        # Scheduler trong process đang chạy → gộp các reminder đến hạn trong Firestore (range query, gồm cả
+        # reminder web app ghi thẳng vào Firestore) vào heap rồi gửi; nhiều worker/replica cùng gọi vẫn an toàn
+        # vì mỗi lần nhắc được claim trước khi gửi
+        if _reminder_scheduler is not None:
+            now_ts = now.timestamp()
+            await _reminder_scheduler.sync(now_ts, lookahead=0)
+            sent_count = await _reminder_scheduler.run_due(now_ts)
+            return {"sent": sent_count, "checked_at": now.isoformat()}
+        
+        from reminders.scheduler import ReminderScheduler
+        from reminders.store import FirestoreReminderStore, MemoryReminderStore
+        
+        # Ưu tiên lấy từ Firestore, fallback: lấy từ memory
+        store = None
         try:
             from firestore_service import get_db
-            from firebase_admin import firestore as firestore_admin
-            
             db = get_db()
             if db:
-                # Lấy tất cả reminders đang active
-                reminders_ref = db.collection("medicineReminders")
-                query = reminders_ref.where("isActive", "==", True)
-                docs = query.stream()
-                
-                for doc_snapshot in docs:
-                    reminder = doc_snapshot.to_dict()
-                    reminder["id"] = doc_snapshot.id
-                    
-                    # Convert Firestore format
-                    next_reminder_time = reminder.get("nextReminderTime")
-                    if not next_reminder_time:
-                        continue
-                    
-                    # Convert Firestore Timestamp sang datetime
-                    if hasattr(next_reminder_time, 'timestamp'):
-                        next_time = datetime.fromtimestamp(next_reminder_time.timestamp())
-                    else:
-                        continue
-                    
-                    # Kiểm tra xem đã đến giờ chưa (trong vòng 5 phút)
-                    time_diff = (now - next_time).total_seconds()
-                    if 0 <= time_diff <= 300:  # 5 phút
-                        # Convert reminder về format cũ để gửi notification
-                        reminder_dict = {
-                            "medicine_name": reminder.get("medicineName"),
-                            "user_email": reminder.get("userEmail"),
-                            "time": reminder.get("time"),
-                            "notes": reminder.get("notes"),
-                        }
-                        
-                        # Gửi thông báo
-                        await send_reminder_notification(reminder_dict)
-                        
-                        # Cập nhật next reminder time trong Firestore
-                        repeat_type = reminder.get("repeatType", "daily")
-                        if repeat_type == "daily":
-                            next_time += timedelta(days=1)
-                        elif repeat_type == "weekly":
-                            next_time += timedelta(days=7)
-                        else:  # once
-                            doc_snapshot.reference.update({"isActive": False})
-                            continue
-                        
-                        doc_snapshot.reference.update({
-                            "nextReminderTime": firestore_admin.Timestamp.from_datetime(next_time),
-                            "lastSent": firestore_admin.SERVER_TIMESTAMP
-                        })
-                        sent_count += 1
-                
-                return {"sent": sent_count, "checked_at": now.isoformat()}
+                store = FirestoreReminderStore(db)
         except Exception:
             pass
+        if store is None:
+            if not hasattr(app.state, 'medicine_reminders'):
+                return {"sent": 0}
+            store = MemoryReminderStore(app.state.medicine_reminders)
         
-        # Fallback: lấy từ memory
-        if not hasattr(app.state, 'medicine_reminders'):
-            return {"sent": 0}
+        # Chỉ đọc các reminder có nextReminderTime ≤ now (range query, phân trang): reminder trong
+        # 5 phút vừa qua được gửi, reminder lỡ lâu hơn chỉ được dời sang lần kế tiếp
+        now_ts = now.timestamp()
+        due = await run_in_threadpool(store.load_due, None, now_ts)
         
-        for reminder_id, reminder in app.state.medicine_reminders.items():
-            if not reminder.get("is_active", True):
-                continue
-            
-            # Parse next reminder time
-            next_time_str = reminder.get("next_reminder_time")
-            if not next_time_str:
-                continue
-            
-            next_time = datetime.fromisoformat(next_time_str)
-            
-            # Kiểm tra xem đã đến giờ chưa (trong vòng 5 phút)
-            time_diff = (now - next_time).total_seconds()
-            if 0 <= time_diff <= 300:  # 5 phút
-                # Gửi thông báo
-                await send_reminder_notification(reminder)
-                
-                # Cập nhật next reminder time
-                if reminder["repeat_type"] == "daily":
-                    next_time += timedelta(days=1)
-                elif reminder["repeat_type"] == "weekly":
-                    next_time += timedelta(days=7)
-                else:  # once
-                    reminder["is_active"] = False
-                    continue
-                
-                reminder["next_reminder_time"] = next_time.isoformat()
-                reminder["last_sent"] = now.isoformat()
-                sent_count += 1
+        # Gửi + tính lần nhắc tiếp theo bằng cùng logic với scheduler trong process
+        batch = ReminderScheduler(store, _get_reminder_dispatcher())
+        for reminder in due:
+            batch.schedule(reminder)
+        sent_count = await batch.run_due(now_ts)
         
         return {"sent": sent_count, "checked_at": now.isoformat()}
         
@@ -745,32 +799,18 @@ async def check_and_send_reminders():
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def send_reminder_notification(reminder: Dict[str, Any]):
-    """Gửi thông báo nhắc nhở (web notification hoặc email)"""
-    try:
-        message = f"🔔 Nhắc nhở: Đã đến giờ uống thuốc {reminder['medicine_name']} ({reminder['time']})"
-        if reminder.get('notes'):
-            message += f"\nGhi chú: {reminder['notes']}"
-        
-        # Gửi email qua Firebase Functions
-        try:
-            import requests
-            firebase_function_url = "https://us-central1-giadienweb.cloudfunctions.net/sendMedicineReminder"
-            requests.post(
-                firebase_function_url,
-                json={
-                    "email": reminder['user_email'],
-                    "medicine_name": reminder['medicine_name'],
-                    "time": reminder['time'],
-                    "message": message
-                },
-                timeout=10
-            )
-        except Exception:
-            pass
-        
-    except Exception:
-        pass
+def _get_reminder_dispatcher():
+    """Dispatcher gửi thông báo nhắc nhở dùng chung (connection pool + giới hạn song song)"""
+    global _reminder_dispatcher
+    if _reminder_dispatcher is None:
+        from reminders.dispatcher import ReminderDispatcher
+        _reminder_dispatcher = ReminderDispatcher()
+    return _reminder_dispatcher
+
+
+# MODEL_PRELOAD=1: load ngay khi import — gunicorn (preload_app) import api_server trong master trước khi fork
+if MODEL_PRELOAD and __name__ != "__main__":
+    preload_models()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+# app/prefork.py
+# Chạy nhiều worker dùng chung models (gunicorn preload_app, xem gunicorn.conf.py):
+#   master load PhoBERT/SBERT + toàn bộ FAISS index 1 lần rồi fork → các worker đọc chung các trang
+#   bộ nhớ đó (copy-on-write, models chỉ đọc nên gần như không bị copy).
+# uvicorn --workers dùng spawn (không fork) nên không chia sẻ được, mỗi worker tự load như cũ.
+
+import gc
+import os
+from typing import Any, Dict, Optional
+
+# 1 = api_server load models ngay khi được import (trong master gunicorn, trước khi fork)
+MODEL_PRELOAD = os.environ.get("MODEL_PRELOAD", "0") == "1"
+# Số thread torch mỗi worker; 0 = chia đều số CPU cho các worker (WEB_CONCURRENCY)
+TORCH_THREADS_PER_WORKER = int(os.environ.get("TORCH_THREADS_PER_WORKER", "0"))
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "2"))
+
+
+def torch_threads_per_worker(workers: int = WEB_CONCURRENCY) -> int:
+    if TORCH_THREADS_PER_WORKER > 0:
+        return TORCH_THREADS_PER_WORKER
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _set_torch_threads(threads: int) -> None:
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+def prepare_master() -> None:
+    """
+    Trước khi load models trong master: torch 1 thread. Master không được khởi tạo thread pool
+    OpenMP (fork sau khi pool đã chạy → worker có thể treo ở lần inference đầu tiên).
+    """
+    _set_torch_threads(1)
+
+
+def freeze_before_fork() -> None:
+    """Sau khi load xong: dọn rác rồi gc.freeze() để GC của worker không ghi vào trang của object đã load."""
+    gc.collect()
+    gc.freeze()
+
+
+def configure_worker(workers: int = WEB_CONCURRENCY) -> int:
+    """Gọi trong worker ngay sau fork (post_fork): chia CPU cho torch, tránh N worker x N thread."""
+    threads = torch_threads_per_worker(workers)
+    _set_torch_threads(threads)
+    return threads
+
+
+def process_memory(pid: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Bộ nhớ của 1 process (MB) theo /proc/<pid>/smaps_rollup (Linux):
+      - rss: tổng trang đang dùng (tính cả trang chung → cộng RSS các worker sẽ bị đếm trùng)
+      - pss: RSS chia đều phần dùng chung cho các process → cộng PSS các worker = RAM thật
+      - shared / private: trang dùng chung với process khác / chỉ riêng process này
+    """
+    path = f"/proc/{pid or 'self'}/smaps_rollup"
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared",
+              "Private_Clean": "private", "Private_Dirty": "private"}
+    result: Dict[str, Any] = {"pid": pid or os.getpid()}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                key = fields.get(name)
+                if key:
+                    result[key] = result.get(key, 0.0) + int(value.split()[0]) / 1024  # kB → MB
+    except OSError:
+        return result
+    for key in ("rss", "pss", "shared", "private"):
+        result[key] = round(result.get(key, 0.0), 1)
+    return result
@@ -1,58 +1,60 @@
 # app/response_layer.py
 # file này để xây dựng prompt và các hàm liên quan đến logic tầng phản hồi
-def need_more_info(user_input: str, intent: str):
+# Từ khóa triệu chứng cơ bản: có 1 trong các từ này thì câu ngắn vẫn đủ rõ
+SYMPTOM_KEYWORDS = ["đau", "sốt", "ho", "mệt", "buồn nôn", "chóng mặt", "khó thở", "lo", "căng thẳng"]
+
+# Từ khóa giúp xác định câu rõ ràng theo intent
+CLEAR_SIGNS = {
+    "bao_dau_dau": ["trán", "thái dương", "sau gáy", "đau âm ỉ", "nhói", "2 ngày", "nhiều ngày", "đau đầu"],
+    "bao_dau_bung": ["bên phải", "bên trái", "âm ỉ", "dữ dội", "quặn", "sau ăn", "trên rốn", "dưới rốn", "đau bụng"],
+    "bao_sot": ["38", "39", "nhiệt độ", "ho", "rát", "lạnh run", "sốt"],
+    "bao_ho": ["đờm", "khò khè", "khan", "nhiều ngày", "từng cơn", "ho"],
+    "bao_met_moi": ["chóng mặt", "khó thở", "mệt kéo dài", "mệt", "mỏi"],
+    "lo_lang_stress": ["khó ngủ", "căng thẳng", "áp lực", "lo nhiều", "lo lắng"],
+    "tu_van_dinh_duong": ["ăn gì", "uống gì", "nên ăn", "dinh dưỡng", "thực phẩm"],
+    "tu_van_tap_luyen": ["bài tập", "thể dục", "tập luyện", "vận động"],
+}
+
+
+def need_more_info(user_input: str, intent: str, flags: dict | None = None):
     """
     Quyết định có cần hỏi thêm triệu chứng không.
     CHỈ trả True khi thực sự KHÔNG RÕ triệu chứng (rất mơ hồ).
     KHÔNG hỏi mặc định.
+
+    Nếu đã có `flags` từ classify_context() của cùng câu thì dùng lại,
+    không lowercase/quét lại text.
     """
+    if flags is None:
+        flags = context_classifier.classify(user_input)
+    return _need_more_info_from_flags(flags, intent)
+
+
+def _need_more_info_from_flags(flags: dict, intent: str) -> bool:
+    word_count = flags["word_count"]
+    has_symptom_keyword = flags["has_symptom_keyword"]
 
-    text = user_input.lower().strip()
-    words = text.split()
-    
     # 1) Nếu intent là "other" → không hỏi, để Gemini tự xử lý
     if intent == "other" or intent == "unknown":
         return False
-    
+
     # 2) Nếu câu quá ngắn (<= 2 từ) VÀ không có từ khóa triệu chứng → có thể mơ hồ
     # Nhưng nếu có từ khóa triệu chứng thì vẫn OK
-    if len(words) <= 2:
-        # Kiểm tra xem có từ khóa triệu chứng cơ bản không
-        symptom_keywords = ["đau", "sốt", "ho", "mệt", "buồn nôn", "chóng mặt", "khó thở", "lo", "căng thẳng"]
-        has_symptom_keyword = any(kw in text for kw in symptom_keywords)
-        if not has_symptom_keyword:
-            return True  # Câu quá ngắn và không có từ khóa triệu chứng
-    
-    # 3) Từ khóa giúp xác định câu rõ ràng theo intent
-    CLEAR_SIGNS = {
-        "bao_dau_dau": ["trán", "thái dương", "sau gáy", "đau âm ỉ", "nhói", "2 ngày", "nhiều ngày", "đau đầu"],
-        "bao_dau_bung": ["bên phải", "bên trái", "âm ỉ", "dữ dội", "quặn", "sau ăn", "trên rốn", "dưới rốn", "đau bụng"],
-        "bao_sot": ["38", "39", "nhiệt độ", "ho", "rát", "lạnh run", "sốt"],
-        "bao_ho": ["đờm", "khò khè", "khan", "nhiều ngày", "từng cơn", "ho"],
-        "bao_met_moi": ["chóng mặt", "khó thở", "mệt kéo dài", "mệt", "mỏi"],
-        "lo_lang_stress": ["khó ngủ", "căng thẳng", "áp lực", "lo nhiều", "lo lắng"],
-        "tu_van_dinh_duong": ["ăn gì", "uống gì", "nên ăn", "dinh dưỡng", "thực phẩm"],
-        "tu_van_tap_luyen": ["bài tập", "thể dục", "tập luyện", "vận động"],
-    }
+    if word_count <= 2 and not has_symptom_keyword:
+        return True  # Câu quá ngắn và không có từ khóa triệu chứng
 
-    # Intent có từ khóa rõ → không cần hỏi thêm
-    if intent in CLEAR_SIGNS:
-        for kw in CLEAR_SIGNS[intent]:
-            if kw in text:
-                return False  # Đã rõ ràng, không cần hỏi
+    # 3) Intent có từ khóa rõ → không cần hỏi thêm
+    if intent in flags["clear_sign_intents"]:
+        return False  # Đã rõ ràng, không cần hỏi
 
     # 4) Nếu câu có độ dài hợp lý (>= 5 từ) → coi như đủ thông tin, không hỏi
-    if len(words) >= 5:
+    if word_count >= 5:
         return False
-    
-    # 5) Chỉ hỏi khi câu rất ngắn (3-4 từ) VÀ không có từ khóa rõ ràng
-    # Nhưng nếu có từ khóa triệu chứng cơ bản thì vẫn OK
-    symptom_keywords = ["đau", "sốt", "ho", "mệt", "buồn nôn", "chóng mặt", "khó thở", "lo", "căng thẳng"]
-    has_symptom_keyword = any(kw in text for kw in symptom_keywords)
-    
+
+    # 5) Câu ngắn (3-4 từ) nhưng có từ khóa triệu chứng cơ bản thì vẫn OK
     if has_symptom_keyword:
         return False  # Có từ khóa triệu chứng, đủ để trả lời
-    
+
     # 6) Chỉ hỏi khi thực sự mơ hồ (câu ngắn và không có từ khóa)
     return True
 
@@ -172,78 +174,157 @@ def get_rag_gate_thresholds(intent_category: str) -> tuple[float, float]:
     else:  # no_rag
         return (1.0, 1.0)  # Luôn không dùng RAG
 
+# ============================
+# CONTEXT CLASSIFIER (REGEX BIÊN DỊCH SẴN)
+# ============================
+# Mỗi nhóm pattern được gộp thành 1 regex duy nhất và biên dịch 1 lần khi import,
+# thay vì gọi re.search lần lượt cho từng pattern ở mỗi message.
+
+# Follow-up keywords (tiếp diễn, nói tiếp về chủ đề cũ) - match theo ranh giới từ
+FOLLOW_UP_PATTERNS = [
+    r'\bvẫn\b', r'\bvẫn thế\b', r'\bvẫn như thế\b',
+    r'\bnhư trước\b', r'\bnhư hôm qua\b', r'\bnhư lúc trước\b',
+    r'\bcòn\b', r'\bcòn bị\b', r'\bcòn thấy\b',
+    r'\bkèm\b', r'\bkèm theo\b', r'\bthêm\b',
+    r'\bhôm nay\b', r'\bsau đó\b',
+    r'\bđỡ hơn\b', r'\bđỡ rồi\b', r'\bnặng hơn\b', r'\btệ hơn\b',
+    r'\btăng lên\b', r'\bgiảm đi\b', r'\bgiảm xuống\b',
+    # Follow-up về tập luyện
+    r'\btập xong\b', r'\bsau khi tập\b', r'\bkhi tập\b', r'\bsau tập\b',
+    r'\btập nặng\b', r'\btập nhẹ\b', r'\btập luyện xong\b',
+    r'\bchạy xong\b', r'\bsau khi chạy\b', r'\bkhi chạy\b',
+    # Follow-up về ăn uống
+    r'\bsau khi ăn\b', r'\bkhi ăn\b', r'\bsau ăn\b', r'\băn xong\b',
+    r'\buống xong\b', r'\bsau khi uống\b',
+    # Follow-up chung
+    r'\bsau khi\b', r'\btrước khi\b', r'\bkhi\b.*\bxong\b'
+]
+
+# Topic shift keywords (đổi chủ đề rõ ràng)
+# Lưu ý: "ngoài ra" chỉ là topic shift nếu đi kèm các cụm rõ như "cho hỏi/nhân tiện/câu hỏi khác...".
+# Các cụm đó đều đã nằm trong danh sách dưới đây nên "ngoài ra" không cần pattern riêng.
+TOPIC_SHIFT_PATTERNS = [
+    r'\bcho hỏi\b', r'\bcho mình hỏi\b', r'\bcho tôi hỏi\b',
+    r'\bnhân tiện\b',
+    r'\bđổi chủ đề\b', r'\bvấn đề khác\b', r'\bcâu hỏi khác\b',
+    r'\bmuốn hỏi về\b', r'\bhỏi thêm về\b', r'\bxin tư vấn\b',
+    r'\bchuyển sang\b', r'\bđổi sang\b',
+    r'\btư vấn dinh dưỡng\b', r'\btư vấn tập luyện\b'
+]
+
+# Xác nhận chuyển chủ đề (True)
+SWITCH_CONFIRM_PATTERNS = [
+    r'\bchuyển\b', r'\bđổi\b', r'\bđổi sang\b', r'\bchuyển sang\b',
+    r'\bđúng\b', r'\bđúng rồi\b', r'\bđúng vậy\b',
+    r'\bcó\b', r'\bcó đúng\b', r'\bphải\b', r'\bphải rồi\b',
+    r'\bchủ đề mới\b', r'\bchủ đề khác\b'
+]
+
+# Từ chối chuyển chủ đề (False)
+SWITCH_REJECT_PATTERNS = [
+    r'\bkhông\b', r'\bkhông đúng\b', r'\bkhông phải\b',
+    r'\bvẫn\b', r'\bvẫn giữ\b', r'\bgiữ\b', r'\bgiữ nguyên\b',
+    r'\btiếp tục\b', r'\btiếp\b', r'\bvề\b', r'\bvề chủ đề cũ\b',
+    r'\bchủ đề cũ\b', r'\bchủ đề trước\b'
+]
+
+
+def _compile_any(patterns: list[str]) -> "re.Pattern[str]":
+    """Gộp danh sách pattern thành 1 regex: match nếu BẤT KỲ pattern nào match."""
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+
+def _compile_keywords(keywords: list[str]) -> "re.Pattern[str]":
+    """Regex cho từ khóa dạng substring (giống `kw in text`)."""
+    return re.compile("|".join(re.escape(kw) for kw in keywords))
+
+
+class ContextClassifier:
+    """
+    Phân loại ngữ cảnh của 1 câu chỉ với 1 lần lowercase và 1 regex cho mỗi nhóm.
+
+    classify() trả về dict gồm:
+    - follow_up: bool                    (is_follow_up)
+    - topic_shift: bool                  (is_topic_shift)
+    - switch_confirm: True/False/None    (parse_switch_confirm)
+    - word_count, has_symptom_keyword, clear_sign_intents: dữ liệu cho need_more_info
+    - need_more_info: bool | None        (None nếu không truyền intent)
+    """
+
+    def __init__(self):
+        self._follow_up_re = _compile_any(FOLLOW_UP_PATTERNS)
+        self._topic_shift_re = _compile_any(TOPIC_SHIFT_PATTERNS)
+        self._confirm_re = _compile_any(SWITCH_CONFIRM_PATTERNS)
+        self._reject_re = _compile_any(SWITCH_REJECT_PATTERNS)
+        self._symptom_keyword_re = _compile_keywords(SYMPTOM_KEYWORDS)
+        self._clear_sign_res = {
+            intent: _compile_keywords(keywords) for intent, keywords in CLEAR_SIGNS.items()
+        }
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return (text or "").lower().strip()
+
+    def match_follow_up(self, text_lower: str) -> bool:
+        return self._follow_up_re.search(text_lower) is not None
+
+    def match_topic_shift(self, text_lower: str) -> bool:
+        return self._topic_shift_re.search(text_lower) is not None
+
+    def match_switch_confirm(self, text_lower: str) -> bool | None:
+        # Confirm được ưu tiên trước reject (giữ đúng thứ tự kiểm tra cũ)
+        if self._confirm_re.search(text_lower):
+            return True
+        if self._reject_re.search(text_lower):
+            return False
+        return None
+
+    def classify(self, text: str, intent: str | None = None) -> dict:
+        return self.classify_normalized(self.normalize(text), intent)
+
+    def classify_normalized(self, text_lower: str, intent: str | None = None) -> dict:
+        """Giống classify() nhưng text đã được lowercase + strip sẵn."""
+        flags = {
+            "follow_up": self.match_follow_up(text_lower),
+            "topic_shift": self.match_topic_shift(text_lower),
+            "switch_confirm": self.match_switch_confirm(text_lower),
+            "word_count": len(text_lower.split()),
+            "has_symptom_keyword": self._symptom_keyword_re.search(text_lower) is not None,
+            "clear_sign_intents": frozenset(
+                name for name, pattern in self._clear_sign_res.items() if pattern.search(text_lower)
+            ),
+        }
+        flags["need_more_info"] = _need_more_info_from_flags(flags, intent) if intent is not None else None
+        return flags
+
+
+# Instance dùng chung (regex đã biên dịch, không có state nên thread-safe)
+context_classifier = ContextClassifier()
+
+
+# hàm lấy toàn bộ context flags của 1 câu trong 1 lần gọi
+def classify_context(text: str, intent: str | None = None) -> dict:
+    """
+    Trả về tất cả context flags (follow_up, topic_shift, switch_confirm, need_more_info...)
+    của câu người dùng. Dùng 1 lần mỗi lượt thay cho việc gọi từng hàm riêng lẻ.
+    """
+    return context_classifier.classify(text, intent)
+
+
 # hàm nhận diện follow-up keywords 
 def is_follow_up(text: str) -> bool:
     """
     Nhận diện follow-up keywords (tiếp diễn, nói tiếp về chủ đề cũ).
     Match theo ranh giới từ để tránh substring.
     """
-    text_lower = text.lower().strip()
-    
-    # Follow-up keywords với ranh giới từ
-    follow_up_patterns = [
-        r'\bvẫn\b', r'\bvẫn thế\b', r'\bvẫn như thế\b',
-        r'\bnhư trước\b', r'\bnhư hôm qua\b', r'\bnhư lúc trước\b',
-        r'\bcòn\b', r'\bcòn bị\b', r'\bcòn thấy\b',
-        r'\bkèm\b', r'\bkèm theo\b', r'\bthêm\b',
-        r'\bhôm nay\b', r'\bsau đó\b',
-        r'\bđỡ hơn\b', r'\bđỡ rồi\b', r'\bnặng hơn\b', r'\btệ hơn\b',
-        r'\btăng lên\b', r'\bgiảm đi\b', r'\bgiảm xuống\b',
-        # Follow-up về tập luyện
-        r'\btập xong\b', r'\bsau khi tập\b', r'\bkhi tập\b', r'\bsau tập\b',
-        r'\btập nặng\b', r'\btập nhẹ\b', r'\btập luyện xong\b',
-        r'\bchạy xong\b', r'\bsau khi chạy\b', r'\bkhi chạy\b',
-        # Follow-up về ăn uống
-        r'\bsau khi ăn\b', r'\bkhi ăn\b', r'\bsau ăn\b', r'\băn xong\b',
-        r'\buống xong\b', r'\bsau khi uống\b',
-        # Follow-up chung
-        r'\bsau khi\b', r'\btrước khi\b', r'\bkhi\b.*\bxong\b'
-    ]
-    
-    # Kiểm tra match theo pattern (ranh giới từ)
-    for pattern in follow_up_patterns:
-        if re.search(pattern, text_lower):
-            return True
-    
-    return False
+    return context_classifier.match_follow_up(ContextClassifier.normalize(text))
 
 # hàm nhận diện đổi chủ đề rõ ràng
 def is_topic_shift(text: str) -> bool:
     """
     Nhận diện đổi chủ đề rõ ràng.
     """
-    text_lower = text.lower().strip()
-    
-    # Topic shift keywords
-    topic_shift_patterns = [
-        r'\bcho hỏi\b', r'\bcho mình hỏi\b', r'\bcho tôi hỏi\b',
-        r'\bnhân tiện\b',
-        r'\bđổi chủ đề\b', r'\bvấn đề khác\b', r'\bcâu hỏi khác\b',
-        r'\bmuốn hỏi về\b', r'\bhỏi thêm về\b', r'\bxin tư vấn\b',
-        r'\bchuyển sang\b', r'\bđổi sang\b',
-        r'\btư vấn dinh dưỡng\b', r'\btư vấn tập luyện\b'
-    ]
-    
-    # Kiểm tra match theo pattern
-    for pattern in topic_shift_patterns:
-        if re.search(pattern, text_lower):
-            return True
-    
-    # Xử lý đặc biệt: "ngoài ra" chỉ là topic shift nếu đi kèm các cụm rõ
-    if re.search(r'\bngoài ra\b', text_lower):
-        # Phải có các cụm rõ như "cho hỏi/nhân tiện/câu hỏi khác..."
-        clear_shift_with_ngoai_ra = [
-            r'\bcho hỏi\b', r'\bcho mình hỏi\b',
-            r'\bnhân tiện\b',
-            r'\bcâu hỏi khác\b', r'\bvấn đề khác\b'
-        ]
-        for pattern in clear_shift_with_ngoai_ra:
-            if re.search(pattern, text_lower):
-                return True
-        # Nếu chỉ có "ngoài ra" mà không có cụm rõ → không phải topic shift
-        return False
-    
-    return False
+    return context_classifier.match_topic_shift(ContextClassifier.normalize(text))
 
 # hàm phân tích câu trả lời xác nhận đổi chủ đề
 def parse_switch_confirm(text: str) -> bool | None:
@@ -255,33 +336,4 @@ def parse_switch_confirm(text: str) -> bool | None:
         False: Giữ chủ đề cũ
         None: Không rõ → cần hỏi lại
     """
-    text_lower = text.lower().strip()
-    
-    # Xác nhận chuyển (True)
-    confirm_patterns = [
-        r'\bchuyển\b', r'\bđổi\b', r'\bđổi sang\b', r'\bchuyển sang\b',
-        r'\bđúng\b', r'\bđúng rồi\b', r'\bđúng vậy\b',
-        r'\bcó\b', r'\bcó đúng\b', r'\bphải\b', r'\bphải rồi\b',
-        r'\bchủ đề mới\b', r'\bchủ đề khác\b'
-    ]
-    
-    # Từ chối chuyển (False)
-    reject_patterns = [
-        r'\bkhông\b', r'\bkhông đúng\b', r'\bkhông phải\b',
-        r'\bvẫn\b', r'\bvẫn giữ\b', r'\bgiữ\b', r'\bgiữ nguyên\b',
-        r'\btiếp tục\b', r'\btiếp\b', r'\bvề\b', r'\bvề chủ đề cũ\b',
-        r'\bchủ đề cũ\b', r'\bchủ đề trước\b'
-    ]
-    
-    # Kiểm tra confirm
-    for pattern in confirm_patterns:
-        if re.search(pattern, text_lower):
-            return True
-    
-    # Kiểm tra reject
-    for pattern in reject_patterns:
-        if re.search(pattern, text_lower):
-            return False
-    
-    # Không rõ
-    return None
\ No newline at end of file
+    return context_classifier.match_switch_confirm(ContextClassifier.normalize(text))
@@ -0,0 +1,23 @@
+# app/settings.py
+# Đường dẫn model / index / dữ liệu dùng chung cho chatbot, retriever, inference service và các script.
+# Mặc định tính từ thư mục gốc project (không phụ thuộc máy), ghi đè bằng biến môi trường khi deploy.
+# Module này chỉ dùng thư viện chuẩn: import được ngay, không kéo theo torch/faiss/transformers.
+
+import os
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DATA_DIR = os.environ.get("DATA_DIR") or os.path.join(BASE_DIR, "data")
+MODEL_DIR = os.environ.get("MODEL_DIR") or os.path.join(BASE_DIR, "model")
+# PhoBERT intent (train/train.py → OUTPUT_DIR)
+INTENT_MODEL_PATH = os.environ.get("INTENT_MODEL_PATH") or os.path.join(MODEL_DIR, "intent_model")
+# Intent head cho INTENT_BACKEND=shared_sbert (train/train.py → SHARED_HEAD_OUTPUT)
+SHARED_INTENT_HEAD_PATH = (
+    os.environ.get("SHARED_INTENT_HEAD_PATH") or os.path.join(MODEL_DIR, "intent_head_shared_sbert.pt")
+)
+# FAISS index + documents theo intent (build_faiss.py ghi vào đây)
+EMBEDDINGS_DIR = os.environ.get("EMBEDDINGS_DIR") or os.path.join(BASE_DIR, "embeddings")
+RAG_PATH = os.path.join(BASE_DIR, "rag")
+
+# Model embedding: dùng chung một encoder cho build index và truy vấn để tránh lệch không gian vector
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "keepitreal/vietnamese-sbert")
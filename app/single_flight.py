@@ -0,0 +1,71 @@
+# app/single_flight.py
+# Gộp các lời gọi giống hệt nhau đang chạy đồng thời thành 1 lời gọi (single-flight)
+
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Các thread gọi do(key, fn) với cùng key trong lúc lời gọi đầu tiên chưa xong sẽ chờ và
+    dùng chung kết quả (hoặc exception) của lời gọi đó thay vì gọi fn thêm lần nữa.
+
+    Không cache: khi lời gọi xong, key được giải phóng, lần gọi sau sẽ chạy lại fn.
+    """
+
+    def __init__(self, name: str = "single_flight"):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = Lock()
+        self.executed = 0  # số lời gọi thực sự chạy fn
+        self.shared = 0  # số lời gọi dùng chung kết quả (đã tiết kiệm)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.executed + self.shared
+            return {
+                "name": self.name,
+                "in_flight": len(self._calls),
+                "executed": self.executed,
+                "shared": self.shared,
+                "saved_rate": round(self.shared / total, 4) if total else 0.0,
+            }
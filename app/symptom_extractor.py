@@ -4,8 +4,11 @@ import re
 
 # Hàm trích xuất triệu chứng từ văn bản người dùng để phục vụ đánh giá rủi ro
 def extract_symptoms(text: str):
-    text = (text or "").lower()
+    return extract_symptoms_normalized((text or "").lower())
 
+
+# Giống extract_symptoms nhưng text đã được lowercase sẵn (dùng chung với TurnAnalysis)
+def extract_symptoms_normalized(text: str):
     result = {
         "location": None,
         "duration": None,
@@ -0,0 +1,29 @@
+# app/token_counter.py
+# Ước lượng số token của text (không gọi API) để đặt ngân sách prompt/context
+
+import math
+import os
+
+# Tiếng Việt có dấu với tokenizer của Gemini: trung bình ~3 ký tự / token
+CHARS_PER_TOKEN = float(os.environ.get("PROMPT_CHARS_PER_TOKEN", "3.0"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token của text theo số ký tự."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = " …") -> str:
+    """Cắt text cho vừa max_tokens (ưu tiên cắt ở ranh giới từ), thêm marker nếu bị cắt."""
+    if max_tokens <= 0 or not text:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(0, int(max_tokens * CHARS_PER_TOKEN) - len(marker))
+    cut = text[:max_chars]
+    space = cut.rfind(" ")
+    if space > max_chars // 2:
+        cut = cut[:space]
+    return cut.rstrip() + marker
@@ -0,0 +1,83 @@
+# app/turn_analysis.py
+# Phân tích câu người dùng 1 lần mỗi lượt: chuẩn hóa, context flags, triệu chứng, risk
+
+import copy
+from functools import lru_cache
+
+from app.response_layer import context_classifier, _need_more_info_from_flags
+from app.symptom_extractor import extract_symptoms_normalized
+from app.risk_estimator import estimate_risk
+
+# Số câu (đã chuẩn hóa) giữ lại trong cache phân tích
+TURN_ANALYSIS_CACHE_SIZE = 512
+
+
+class TurnAnalysis:
+    """
+    Kết quả phân tích 1 câu người dùng, tính 1 lần và dùng chung cho mọi bước của pipeline.
+
+    Thay vì need_more_info, is_follow_up, is_topic_shift, extract_symptoms... mỗi hàm tự
+    lowercase và quét lại text, các bước sau chỉ đọc từ object này.
+
+    Object trong cache dùng chung cho các message giống nhau (mọi session); analyze_turn trả bản sao
+    riêng cho từng lượt nên pipeline có thể lưu/sửa symptoms, flags mà không ảnh hưởng session khác.
+    """
+
+    __slots__ = ("normalized_text", "flags", "symptoms", "risk")
+
+    def __init__(self, normalized_text: str):
+        self.normalized_text = normalized_text
+        # follow_up, topic_shift, switch_confirm, has_symptom_keyword, clear_sign_intents...
+        self.flags = context_classifier.classify_normalized(normalized_text)
+        self.symptoms = extract_symptoms_normalized(normalized_text)
+        self.risk = estimate_risk(self.symptoms)
+
+    @property
+    def is_follow_up(self) -> bool:
+        return self.flags["follow_up"]
+
+    @property
+    def is_topic_shift(self) -> bool:
+        return self.flags["topic_shift"]
+
+    @property
+    def switch_confirm(self) -> bool | None:
+        return self.flags["switch_confirm"]
+
+    @property
+    def keyword_hits(self) -> dict:
+        """Tất cả từ khóa bắt được trong câu (để log/debug)."""
+        return {
+            "symptom_keyword": self.flags["has_symptom_keyword"],
+            "clear_sign_intents": sorted(self.flags["clear_sign_intents"]),
+            "location": self.symptoms["location"],
+            "intensity": self.symptoms["intensity"],
+            "extra": list(self.symptoms["extra"]),
+            "danger_signs": list(self.symptoms["danger_signs"]),
+        }
+
+    def need_more_info(self, intent: str) -> bool:
+        return _need_more_info_from_flags(self.flags, intent)
+
+    def copy(self) -> "TurnAnalysis":
+        """Bản sao sâu (không phân tích lại): flags, symptoms không dùng chung với bản cache."""
+        clone = TurnAnalysis.__new__(TurnAnalysis)
+        clone.normalized_text = self.normalized_text
+        clone.flags = copy.deepcopy(self.flags)
+        clone.symptoms = copy.deepcopy(self.symptoms)
+        clone.risk = self.risk
+        return clone
+
+
+@lru_cache(maxsize=TURN_ANALYSIS_CACHE_SIZE)
+def _analyze_normalized(normalized_text: str) -> TurnAnalysis:
+    return TurnAnalysis(normalized_text)
+
+
+# hàm phân tích 1 lượt chat (có cache theo câu đã chuẩn hóa)
+def analyze_turn(text: str) -> TurnAnalysis:
+    """
+    Chuẩn hóa (lowercase + strip) đúng 1 lần rồi phân tích toàn bộ.
+    Các message giống nhau sau chuẩn hóa dùng lại kết quả đã cache (trả về bản sao, xem TurnAnalysis).
+    """
+    return _analyze_normalized(context_classifier.normalize(text)).copy()
@@ -0,0 +1,111 @@
+# app/warmup.py
+# Chạy thử pipeline chat vài câu mẫu (mỗi intent) sau khi load models, trước khi báo /ready:
+# lượt đầu của torch (kernel, allocator), tokenizer và FAISS (page index) tốn hơn hẳn các lượt sau.
+# Trong lúc warm-up, Gemini được thay bằng câu trả lời cố định và không đọc lịch sử Firestore
+# → không gọi ra ngoài, không tốn quota.
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "1") == "1"
+WARMUP_INPUTS_FILE = os.environ.get("WARMUP_INPUTS_FILE", "")
+
+# Câu mẫu theo intent (tên intent = tên file trong data/); ghi đè bằng WARMUP_INPUTS_FILE
+DEFAULT_WARMUP_INPUTS: Dict[str, List[str]] = {
+    "chao_hoi": ["xin chào"],
+    "bao_dau_dau": ["tôi bị đau đầu từ sáng đến giờ"],
+    "bao_dau_bung": ["tôi đau bụng âm ỉ sau khi ăn"],
+    "bao_ho": ["tôi bị ho khan mấy ngày nay"],
+    "bao_sot": ["tôi bị sốt 38 độ từ hôm qua"],
+    "bao_met_moi": ["dạo này tôi hay mệt mỏi, uể oải"],
+    "lo_lang_stress": ["tôi hay lo lắng và khó ngủ vì căng thẳng"],
+    "tu_van_dinh_duong": ["nên ăn gì để tăng cơ"],
+    "tu_van_tap_luyen": ["người mới nên tập thể dục thế nào"],
+}
+
+WARMUP_ANSWER = "Đây là câu trả lời warm-up (không gọi Gemini)."
+
+_local = threading.local()
+
+
+@contextmanager
+def warming_up():
+    """Trong khối này (chỉ thread hiện tại): generator trả WARMUP_ANSWER, không đọc lịch sử Firestore."""
+    previous = getattr(_local, "active", False)
+    _local.active = True
+    try:
+        yield
+    finally:
+        _local.active = previous
+
+
+def is_warming_up() -> bool:
+    return getattr(_local, "active", False)
+
+
+def load_warmup_inputs(path: str = WARMUP_INPUTS_FILE) -> Dict[str, List[str]]:
+    """File JSON dạng {"intent": ["câu 1", ...]}; không có/lỗi → DEFAULT_WARMUP_INPUTS."""
+    if not path:
+        return DEFAULT_WARMUP_INPUTS
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        inputs = {str(intent): [str(text) for text in texts if str(text).strip()] for intent, texts in data.items()}
+        return {intent: texts for intent, texts in inputs.items() if texts} or DEFAULT_WARMUP_INPUTS
+    except Exception as e:
+        print(f"⚠️ Không đọc được {path}: {e}, dùng câu warm-up mặc định")
+        return DEFAULT_WARMUP_INPUTS
+
+
+def run_warmup(
+    run_pipeline: Callable[..., Dict[str, Any]],
+    reset: Optional[Callable[[str], None]] = None,
+    inputs: Optional[Dict[str, List[str]]] = None,
+    on_input: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Chạy từng câu mẫu qua pipeline (session riêng, xóa sau khi chạy).
+
+    on_input(đã chạy, tổng) để báo tiến độ. Trả về thời gian từng câu và intent model dự đoán
+    (lệch với intent của câu mẫu thì chỉ log, không coi là lỗi).
+    """
+    inputs = inputs if inputs is not None else load_warmup_inputs()
+    total = sum(len(texts) for texts in inputs.values())
+    results: List[Dict[str, Any]] = []
+    start = time.time()
+    with warming_up():
+        for intent, texts in inputs.items():
+            for i, text in enumerate(texts):
+                session_id = f"warmup-{intent}-{i}"
+                t0 = time.time()
+                try:
+                    response = run_pipeline(text, session_id=session_id)
+                    predicted = response.get("intent")
+                    error = None
+                except Exception as e:
+                    predicted, error = None, str(e)
+                    print(f"⚠️ Warm-up lỗi với câu '{text}': {e}")
+                finally:
+                    if reset is not None:
+                        reset(session_id)
+                results.append({
+                    "intent": intent,
+                    "predicted": predicted,
+                    "ms": round((time.time() - t0) * 1000, 1),
+                    "error": error,
+                })
+                if on_input is not None:
+                    on_input(len(results), total)
+    mismatched = [r for r in results if r["error"] is None and r["predicted"] != r["intent"]]
+    if mismatched:
+        print(f"ℹ️ Warm-up: {len(mismatched)}/{total} câu mẫu được phân loại khác intent ghi trong file")
+    return {
+        "inputs": total,
+        "seconds": round(time.time() - start, 2),
+        "errors": sum(1 for r in results if r["error"]),
+        "results": results,
+    }
@@ -0,0 +1,316 @@
+# app/write_behind.py
+# Ghi chat (messages, chatSessions) xuống Firestore kiểu write-behind: caller chỉ đưa vào hàng đợi,
+# 1 thread nền gom nhiều session lại commit bằng WriteBatch mỗi FLUSH_INTERVAL_MS hoặc khi đủ MAX_BATCH ghi.
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+CHAT_WRITE_FLUSH_MS = int(os.environ.get("CHAT_WRITE_FLUSH_MS", "200"))
+CHAT_WRITE_MAX_BATCH = int(os.environ.get("CHAT_WRITE_MAX_BATCH", "200"))
+CHAT_WRITE_MAX_PENDING = int(os.environ.get("CHAT_WRITE_MAX_PENDING", "5000"))
+CHAT_WRITE_RETRIES = int(os.environ.get("CHAT_WRITE_RETRIES", "3"))
+
+_FIRESTORE_MAX_BATCH = 500  # giới hạn thao tác của 1 WriteBatch
+_MAX_SESSION_DOCS = 10000  # số id document chatSessions nhớ lại (quá thì xóa, tra lại khi cần)
+
+
+def _is_not_found(error: Exception) -> bool:
+    """NotFound của google.api_core (firebase_admin) hoặc của firestore_memory."""
+    return type(error).__name__ == "NotFound"
+
+
+class _Write:
+    __slots__ = ("kind", "key", "data", "on_create", "attempts")
+
+    def __init__(self, kind: str, key: Any, data: Dict[str, Any], on_create: Optional[Dict[str, Any]] = None):
+        self.kind = kind  # "message" | "session"
+        self.key = key  # message: document id; session: (user_id, session_id)
+        self.data = data
+        self.on_create = on_create or {}  # field chỉ ghi khi tạo document mới (createdAt)
+        self.attempts = 0
+
+
+class FirestoreWriteBehind:
+    """
+    Hàng đợi ghi chat có giới hạn.
+
+    - enqueue_message: cấp id document ngay (không round-trip), ghi sau
+    - enqueue_session: gộp các lần cập nhật cùng session trong hàng đợi thành 1 lần ghi;
+      id document chatSessions (frontend tạo bằng add → id ngẫu nhiên) được tra 1 lần rồi nhớ lại
+    - hàng đợi đầy (max_pending) → caller tự flush đồng bộ (backpressure, không mất dữ liệu)
+    - commit lô lỗi → ghi lại từng cái để tách ghi lỗi (vd chatSessions đã bị xóa → tra lại/tạo mới),
+      chỉ các ghi vẫn lỗi được đưa lại đầu hàng đợi, retry với backoff; quá `retries` lần thì bỏ và log
+    - stop() flush hết trước khi tắt
+    """
+
+    def __init__(
+        self,
+        get_db: Callable[[], Any],
+        flush_interval_ms: int = CHAT_WRITE_FLUSH_MS,
+        max_batch: int = CHAT_WRITE_MAX_BATCH,
+        max_pending: int = CHAT_WRITE_MAX_PENDING,
+        retries: int = CHAT_WRITE_RETRIES,
+    ):
+        self.get_db = get_db
+        self.flush_interval = max(1, flush_interval_ms) / 1000.0
+        self.max_batch = max(1, min(max_batch, _FIRESTORE_MAX_BATCH))
+        self.max_pending = max(self.max_batch, max_pending)
+        self.retries = max(0, retries)
+
+        self._queue: Deque[_Write] = deque()
+        self._sessions: Dict[Tuple[str, str], _Write] = {}  # session đang chờ trong hàng đợi
+        self._session_docs: Dict[Tuple[str, str], str] = {}  # (user_id, session_id) -> id document
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._failures = 0  # số lần commit lỗi liên tiếp (tính backoff)
+        self._retry_at = 0.0
+
+        self.written = 0
+        self.commits = 0
+        self.failed_commits = 0
+        self.dropped = 0
+        self.inline_flushes = 0
+
+    # ========================
+    # ENQUEUE
+    # ========================
+    def enqueue_message(self, message_data: Dict[str, Any]) -> Optional[str]:
+        db = self.get_db()
+        if db is None:
+            return None
+        message_id = db.collection("messages").document().id  # id sinh phía client
+        self._put(_Write("message", message_id, message_data))
+        return message_id
+
+    def enqueue_session(
+        self,
+        user_id: str,
+        session_id: str,
+        session_data: Dict[str, Any],
+        on_create: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        key = (user_id, session_id)
+        with self._cond:
+            pending = self._sessions.get(key)
+            if pending is not None:
+                pending.data.update(session_data)
+                return
+        self._put(_Write("session", key, dict(session_data), on_create))
+
+    def _put(self, write: _Write) -> None:
+        while True:
+            with self._cond:
+                if len(self._queue) < self.max_pending:
+                    self._queue.append(write)
+                    if write.kind == "session":
+                        self._sessions[write.key] = write
+                    if len(self._queue) >= self.max_batch:
+                        self._cond.notify()
+                    return
+            # Hàng đợi đầy (Firestore chậm/lỗi kéo dài) → caller chịu độ trễ thay vì tăng bộ nhớ
+            self.inline_flushes += 1
+            if not self.flush_once():
+                time.sleep(self.flush_interval)
+
+    # ========================
+    # FLUSH
+    # ========================
+    def _take_batch(self):
+        with self._cond:
+            batch = []
+            while self._queue and len(batch) < self.max_batch:
+                write = self._queue.popleft()
+                if write.kind == "session":
+                    self._sessions.pop(write.key, None)
+                batch.append(write)
+            return batch
+
+    def _requeue(self, batch) -> None:
+        """Đưa lại đầu hàng đợi (giữ thứ tự); bỏ các ghi đã thử quá số lần (caller tăng attempts)."""
+        with self._cond:
+            for write in reversed(batch):
+                if write.attempts > self.retries:
+                    self.dropped += 1
+                    continue
+                if write.kind == "session":
+                    newer = self._sessions.get(write.key)
+                    if newer is not None:
+                        # Đã có cập nhật mới hơn cho session này: gộp vào bản mới
+                        newer.data = {**write.data, **newer.data}
+                        continue
+                    self._sessions[write.key] = write
+                self._queue.appendleft(write)
+
+    def _resolve_session(self, db, key: Tuple[str, str]) -> Optional[str]:
+        """Id document chatSessions hiện có của (user_id, session_id), None nếu chưa có."""
+        doc_id = self._session_docs.get(key)
+        if doc_id is None:
+            user_id, session_id = key
+            docs = (
+                db.collection("chatSessions")
+                .where("sessionId", "==", session_id)
+                .where("userId", "==", user_id)
+                .limit(1)
+                .get()
+            )
+            if docs:
+                doc_id = docs[0].id
+                if len(self._session_docs) >= _MAX_SESSION_DOCS:
+                    self._session_docs.clear()
+                self._session_docs[key] = doc_id
+        return doc_id
+
+    def _commit(self, db, writes) -> None:
+        """Commit writes trong 1 WriteBatch (nguyên tử: lỗi → exception, không ghi gì)."""
+        created: Dict[Tuple[str, str], Any] = {}
+        write_batch = db.batch()
+        for write in writes:
+            if write.kind == "message":
+                write_batch.set(db.collection("messages").document(write.key), write.data)
+                continue
+            doc_id = self._resolve_session(db, write.key)
+            if doc_id is not None:
+                write_batch.update(db.collection("chatSessions").document(doc_id), write.data)
+            elif write.key in created:
+                # Session mới xuất hiện 2 lần trong cùng lô → ghi tiếp vào document vừa tạo
+                write_batch.set(created[write.key], write.data, merge=True)
+            else:
+                ref = db.collection("chatSessions").document()
+                write_batch.set(ref, {**write.data, **write.on_create})
+                created[write.key] = ref
+        write_batch.commit()
+        if len(self._session_docs) + len(created) > _MAX_SESSION_DOCS:
+            self._session_docs.clear()
+        for key, ref in created.items():
+            self._session_docs[key] = ref.id
+        self.commits += 1
+        self.written += len(writes)
+
+    def _commit_write(self, db, write: _Write) -> None:
+        try:
+            self._commit(db, [write])
+        except Exception as e:
+            if write.kind != "session" or not _is_not_found(e) or self._session_docs.pop(write.key, None) is None:
+                raise
+            # Document chatSessions đã bị xóa → id nhớ lại đã cũ: tra lại (hoặc tạo mới) rồi ghi lại
+            self._commit(db, [write])
+
+    def _commit_each(self, db, batch):
+        """
+        Commit từng ghi của lô vừa lỗi → 1 ghi lỗi không kéo theo cả lô.
+        Trả về (các ghi cần đưa lại hàng đợi, lỗi cuối cùng).
+        """
+        retry = []
+        error = None
+        succeeded = 0
+        for i, write in enumerate(batch):
+            try:
+                self._commit_write(db, write)
+                succeeded += 1
+            except Exception as e:
+                error = e
+                write.attempts += 1
+                retry.append(write)
+                if not succeeded and len(retry) >= 2:
+                    # 2 ghi đầu đều lỗi → nhiều khả năng Firestore lỗi chung: phần còn lại để lần sau, không tính lượt thử
+                    retry.extend(batch[i + 1:])
+                    break
+        return retry, error
+
+    def flush_once(self) -> bool:
+        """Commit 1 lô. Trả về False nếu còn ghi lỗi (đã đưa lại hàng đợi)."""
+        with self._flush_lock:
+            batch = self._take_batch()
+            if not batch:
+                return True
+            db = None
+            try:
+                db = self.get_db()
+                if db is None:
+                    raise RuntimeError("Firestore chưa sẵn sàng")
+                self._commit(db, batch)
+            except Exception as e:
+                self.failed_commits += 1
+                if db is None or (len(batch) == 1 and not _is_not_found(e)):
+                    failed, error = batch, e
+                    for write in failed:
+                        write.attempts += 1
+                else:
+                    failed, error = self._commit_each(db, batch)
+                if failed:
+                    self._failures += 1
+                    self._requeue(failed)
+                    self._retry_at = time.time() + self.flush_interval * (2 ** min(self._failures, 6))
+                    print(f"⚠️ [write-behind] {len(failed)}/{len(batch)} ghi thất bại, sẽ thử lại: {error}")
+                    return False
+            self._failures = 0
+            return True
+
+    def flush(self) -> bool:
+        """Commit toàn bộ hàng đợi hiện tại (dừng ở lần commit lỗi đầu tiên)."""
+        while self.pending():
+            if not self.flush_once():
+                return False
+        return True
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    # ========================
+    # THREAD NỀN
+    # ========================
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                backoff = self._retry_at - time.time()
+                if backoff > 0 or len(self._queue) < self.max_batch:
+                    # Chờ hết chu kỳ flush (hoặc hết backoff sau lỗi), dậy sớm khi đủ 1 lô
+                    self._cond.wait(max(backoff, self.flush_interval))
+                if self._stopping:
+                    return
+            if time.time() < self._retry_at:
+                continue
+            # Commit 1 lô; còn đủ lô đầy thì commit tiếp ngay
+            while self.pending() and self.flush_once() and self.pending() >= self.max_batch:
+                pass
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="chat-write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Dừng thread nền và flush phần còn lại (retry tới khi hết hàng đợi hoặc hết timeout)."""
+        if self._thread is not None:
+            with self._cond:
+                self._stopping = True
+                self._cond.notify()
+            self._thread.join(timeout)
+            self._thread = None
+        deadline = time.time() + timeout
+        while self.pending() and time.time() < deadline:
+            if not self.flush():
+                time.sleep(min(self.flush_interval, max(0.0, deadline - time.time())))
+        if self.pending():
+            print(f"⚠️ [write-behind] Bỏ {self.pending()} ghi chưa commit khi tắt")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending(),
+            "written": self.written,
+            "commits": self.commits,
+            "failed_commits": self.failed_commits,
+            "dropped": self.dropped,
+            "inline_flushes": self.inline_flushes,
+            "avg_batch": round(self.written / self.commits, 1) if self.commits else 0.0,
+        }
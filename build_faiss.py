@@ -5,12 +5,12 @@ import pickle
 import faiss
 from sentence_transformers import SentenceTransformer
 
+from app.settings import DATA_DIR, EMBEDDING_MODEL, EMBEDDINGS_DIR
+
 # ================================
 # 1) PATH
 # ================================
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, "data")
-EMB_DIR = os.path.join(BASE_DIR, "embeddings")
+EMB_DIR = EMBEDDINGS_DIR
 
 os.makedirs(EMB_DIR, exist_ok=True)
 
@@ -31,7 +31,7 @@ INTENT_FILES = {
 # 2) LOAD EMBEDDER
 # ================================
 print("🧠 Loading embedding model (Vietnamese-SBERT)...")
-embedder = SentenceTransformer("keepitreal/vietnamese-sbert")
+embedder = SentenceTransformer(EMBEDDING_MODEL)
 
 # ================================
 # 3) NORMALIZER
@@ -1,21 +1,13 @@
 # chatbot.py
 
+import os
+from concurrent.futures import Future, ThreadPoolExecutor # chạy retrieval song song với intent
 from threading import Lock # để thread-safe
-from typing import Any, Dict, Optional # typing
-from intent.intent_classifier import IntentClassifier # lớp phân loại intent
-from rag.retriever import Retriever # lớp retriever RAG
-from generator.gemini_generator import generate_medical_answer  # hàm generate answer từ Gemini
+from typing import TYPE_CHECKING, Any, Dict, Optional # typing
+from rag.context_selector import select_context, format_context # chọn đoạn RAG đa dạng (MMR) cho prompt
 from app.response_layer import (
-    #hỏi thêm thông tin
-    need_more_info, 
     # xây dựng câu hỏi làm rõ
     build_clarification_question,
-    # kiểm tra có phải follow-up không
-    is_follow_up,
-    # kiểm tra có phải đổi chủ đề không
-    is_topic_shift,
-    # phân tích câu trả lời xác nhận đổi chủ đề
-    parse_switch_confirm,
     # lấy label intent
     get_intent_label,
     # lấy category intent
@@ -23,8 +15,14 @@ from app.response_layer import (
     # lâý ngưỡng gate RAG
     get_rag_gate_thresholds
 )
-from app.symptom_extractor import extract_symptoms
-from app.risk_estimator import estimate_risk
+from app.warmup import is_warming_up  # warm-up lúc khởi động: không gọi Firestore/Gemini
+from app.turn_analysis import analyze_turn  # phân tích câu 1 lần/lượt (flags, triệu chứng, risk)
+from inference.protocol import INFERENCE_ADDRESS  # intent + embedding ở inference service riêng (rỗng = trong process)
+from app.settings import INTENT_MODEL_PATH, RAG_PATH, SHARED_INTENT_HEAD_PATH  # đường dẫn model/index (env ghi đè)
+
+if TYPE_CHECKING:
+    from intent.intent_classifier import IntentClassifier # lớp phân loại intent
+    from rag.retriever import Retriever # lớp retriever RAG
 
 # ============================
 # KHỞI TẠO CÁC MODEL (LAZY LOADING)
@@ -34,19 +32,144 @@ from app.risk_estimator import estimate_risk
 #   - Tiết kiệm memory nếu chỉ import chatbot nhưng không dùng chat
 #   - Tải models khi cần (lần đầu gọi run_chat_pipeline)
 #   - Sử dụng _models_lock để thread-safe
+#   - torch/transformers/faiss/sentence_transformers và Gemini SDK chỉ import khi load models/generate:
+#     reset_conversation, scheduler nhắc thuốc và các script import chatbot không tốn thời gian import đó
+
+intent_model_path = INTENT_MODEL_PATH
+shared_intent_head_path = SHARED_INTENT_HEAD_PATH
+rag_path = RAG_PATH
 
-intent_model_path = r"D:\CHAT BOT TTCS\model\intent_model"
-rag_path = r"D:\CHAT BOT TTCS\rag"
+# Kiến trúc model intent:
+#   - "phobert" (mặc định): PhoBERT riêng cho intent + vietnamese-sbert riêng cho RAG (2 forward pass/lượt)
+#   - "shared_sbert": 1 encoder vietnamese-sbert cho cả intent head và RAG (1 forward pass, 1 model trong RAM)
+INTENT_BACKEND = os.environ.get("INTENT_BACKEND", "phobert").strip().lower()
 
 # Không load models ngay khi import - sẽ load khi cần
-intent_classifier: Optional[IntentClassifier] = None
-retriever: Optional[Retriever] = None
+intent_classifier: Optional["IntentClassifier"] = None
+retriever: Optional["Retriever"] = None
 _models_initialized = False
 _models_lock = Lock()
 
 conversation_states: Dict[str, Dict[str, Any]] = {}
 conversation_lock = Lock()
 
+# ============================
+# SPECULATIVE RETRIEVAL
+# ============================
+# Embedding câu truy vấn (SBERT) không phụ thuộc intent → chạy song song với PhoBERT predict_topk.
+#   - "off":    tắt, encode tuần tự như cũ
+#   - "encode": chỉ encode câu truy vấn song song (mặc định)
+#   - "search": encode + search top-k trong tất cả intent indexes, gate chọn lại kết quả sau
+# Kết quả speculative bị hủy/bỏ qua ở các nhánh return sớm (safety, pending confirm) và nhánh không search.
+# Pool speculative dùng chung mọi lượt: lúc cần kết quả mà task vẫn còn xếp hàng thì hủy và encode tuần tự.
+SPECULATIVE_RETRIEVAL = os.environ.get("SPECULATIVE_RETRIEVAL", "encode").strip().lower()
+
+# ============================
+# CHỌN CONTEXT RAG (MMR)
+# ============================
+# HIGH gate lấy RAG_CANDIDATE_K ứng viên, sau đó MMR chọn các đoạn liên quan nhưng không trùng nhau
+# trong giới hạn số đoạn + ngân sách token của từng mode
+RAG_CANDIDATE_K = int(os.environ.get("RAG_CANDIDATE_K", "8"))
+RAG_CONTEXT_LIMITS = {
+    # mode: (số đoạn tối đa, ngân sách token cho context)
+    "strong": (5, int(os.environ.get("RAG_STRONG_TOKEN_BUDGET", "900"))),
+    "soft": (2, int(os.environ.get("RAG_SOFT_TOKEN_BUDGET", "400"))),
+}
+RAG_MMR_LAMBDA = float(os.environ.get("RAG_MMR_LAMBDA", "0.7"))
+RAG_DEDUP_THRESHOLD = float(os.environ.get("RAG_DEDUP_THRESHOLD", "0.95"))
+
+SPECULATIVE_SEARCH_K = RAG_CANDIDATE_K  # = k lớn nhất mà gate dùng (HIGH gate)
+_speculative_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="speculative-rag")
+
+
+def _start_speculative_retrieval(query: str) -> Optional[Future]:
+    """Bắt đầu encode (và search nếu bật) câu truy vấn trong thread riêng."""
+    if SPECULATIVE_RETRIEVAL not in ("encode", "search") or retriever is None:
+        return None
+    k = SPECULATIVE_SEARCH_K if SPECULATIVE_RETRIEVAL == "search" else 0
+    return _speculative_executor.submit(retriever.prefetch, query, k)
+
+
+def _collect_speculative(future: Optional[Future]) -> Optional[Dict[str, Any]]:
+    """Chờ kết quả speculative; lỗi thì trả None để search tuần tự như cũ."""
+    if future is None:
+        return None
+    if future.cancel():
+        # Chưa chạy (pool đang bận encode của các lượt/session khác) → encode ngay trên thread request,
+        # không xếp hàng sau các lượt khác làm dài thêm đường găng
+        return None
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"⚠️ Speculative retrieval lỗi, search tuần tự: {e}")
+        return None
+
+
+def _discard_speculative(future: Optional[Future]) -> None:
+    """Hủy speculative nếu chưa chạy; nếu đang chạy thì bỏ qua kết quả."""
+    if future is not None:
+        future.cancel()
+
+
+def _build_rag_context(docs, rag_mode: str):
+    """Chọn đoạn cho context theo mode (strong/soft) bằng MMR, trả về (context, các doc đã chọn)."""
+    max_docs, token_budget = RAG_CONTEXT_LIMITS[rag_mode]
+    vectors = None
+    try:
+        vectors = retriever.doc_vectors(docs)
+    except Exception as e:
+        # Không lấy được vector → vẫn chọn theo thứ tự + ngân sách token
+        print(f"⚠️ Không lấy được vector đoạn RAG, bỏ qua MMR: {e}")
+    selected = select_context(
+        docs,
+        vectors,
+        max_docs=max_docs,
+        token_budget=token_budget,
+        mmr_lambda=RAG_MMR_LAMBDA,
+        dedup_threshold=RAG_DEDUP_THRESHOLD,
+    )
+    return format_context(selected), selected
+
+
+# Field nội bộ của kết quả retriever (để lấy lại vector khi chọn context), không trả ra API
+_INTERNAL_SOURCE_FIELDS = ("intent", "doc_index")
+
+
+def _public_sources(docs):
+    """Bản sao các doc RAG cho response["sources"]: chỉ text, cosine, confidence như trước."""
+    return [{k: v for k, v in doc.items() if k not in _INTERNAL_SOURCE_FIELDS} for doc in docs]
+
+# Hàm tạo intent classifier: qua inference service nếu có INFERENCE_ADDRESS, không thì load trong process
+def create_intent_classifier():
+    if INFERENCE_ADDRESS:
+        from inference.client import RemoteIntentClassifier
+        classifier = RemoteIntentClassifier(INFERENCE_ADDRESS)
+        info = classifier.client.wait_until_ready()  # service có thể vẫn đang load models
+        print(f"🔌 Dùng inference service {INFERENCE_ADDRESS} (pid {info.get('pid')})")
+        return classifier
+    return create_local_intent_classifier()
+
+
+# Hàm load intent classifier trong process theo INTENT_BACKEND (inference/server.py cũng dùng)
+def create_local_intent_classifier():
+    if INTENT_BACKEND == "shared_sbert":
+        from intent.shared_encoder_classifier import SharedEncoderIntentClassifier
+        return SharedEncoderIntentClassifier(shared_intent_head_path)
+    from intent.intent_classifier import IntentClassifier
+    return IntentClassifier(intent_model_path)
+
+
+# Hàm tạo retriever, dùng chung encoder với intent classifier nếu là shared_sbert
+# (hoặc encoder của inference service nếu có INFERENCE_ADDRESS)
+def create_retriever(classifier=None) -> "Retriever":
+    from rag.retriever import Retriever
+    if INFERENCE_ADDRESS:
+        from inference.client import RemoteEncoder
+        return Retriever(rag_path, embedder=RemoteEncoder(INFERENCE_ADDRESS))
+    shared_embedder = classifier if INTENT_BACKEND == "shared_sbert" else None
+    return Retriever(rag_path, embedder=shared_embedder)
+
+
 # Hàm đảm bảo models đã được load
 def _ensure_models_loaded():
     """Đảm bảo tất cả models đã được tải trước khi dùng
@@ -76,11 +199,11 @@ def _ensure_models_loaded():
         
         # Load Intent Classifier
         if intent_classifier is None:
-            intent_classifier = IntentClassifier(intent_model_path)
+            intent_classifier = create_intent_classifier()
         
         # Load RAG Retriever
         if retriever is None:
-            retriever = Retriever(rag_path)
+            retriever = create_retriever(intent_classifier)
         
         # Gemini API không cần load model, chỉ cần kiểm tra API key
         from generator.gemini_generator import _get_model
@@ -123,7 +246,8 @@ def _get_or_create_state(session_id: str) -> Dict[str, Any]:
         'intent_lock': {'intent': str, 'turns': int} | None,  # Ổn định intent trong N lượt
         'pending_intent': str | None,               # Intent mới chờ xác nhận
         'pending_from_intent': str | None,          # Intent cũ trước khi chuyển
-        'pending_type': str | None                  # Loại pending (intent_switch_confirm)
+        'pending_type': str | None,                 # Loại pending (intent_switch_confirm)
+        'turn_lock': Lock                           # Các lượt của cùng session chạy tuần tự
     }
     """
     with conversation_lock:
@@ -135,7 +259,8 @@ def _get_or_create_state(session_id: str) -> Dict[str, Any]:
                 "intent_lock": None,  # { "intent": str, "turns": int } | None
                 "pending_intent": None,  # Intent mới đang chờ xác nhận
                 "pending_from_intent": None,  # Intent cũ
-                "pending_type": None  # "intent_switch_confirm" | None
+                "pending_type": None,  # "intent_switch_confirm" | None
+                "turn_lock": Lock()  # state bên trên không thread-safe → 1 lượt/session tại 1 thời điểm
             }
         return conversation_states[session_id]
 
@@ -147,6 +272,20 @@ def reset_conversation(session_id: str) -> None:
 
 # Hàm chat chính - xử lý input từ user và trả về response
 def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Optional[str] = None) -> Dict[str, Any]:
+    """Chạy 1 lượt chat (xem _run_chat_turn).
+
+    API chạy pipeline trong threadpool: 2 request cùng session_id có thể đến cùng lúc và cùng sửa
+    conversation_history, last_intent, pending_*, intent_lock... → giữ turn_lock của session suốt lượt.
+    Các session khác nhau vẫn chạy song song.
+    """
+    state = _get_or_create_state(session_id)
+    with state["turn_lock"]:
+        return _run_chat_turn(user_input, session_id, user_id, state)
+
+
+def _run_chat_turn(
+    user_input: str, session_id: str, user_id: Optional[str], state: Dict[str, Any]
+) -> Dict[str, Any]:
     """Hàm chat chính - xử lý input từ user và trả về response
     
     === PIPELINE 14 BƯỚC ===
@@ -160,6 +299,7 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
     BƯỚC 2: INTENT CLASSIFICATION (TOP-2)
     - Dùng PhoBERT để phân loại intent
     - Lấy top-2 intent với confidence
+    - Song song: encode câu truy vấn cho RAG (SPECULATIVE_RETRIEVAL, xem ở trên)
     
     BƯỚC 3: NHẬN DIỆN FOLLOW-UP & TOPIC SHIFT
     - Follow-up: User đang hỏi tiếp về chủ đề cũ
@@ -235,10 +375,9 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
             "sources": [],
             "stage": "validation"
         }
-# Lấy trạng thái hội thoại cho session
-    state = _get_or_create_state(session_id)
-# lấy lịch sử trong firestore nếu chưa có
-    if not state.get("conversation_history"):
+# Trạng thái hội thoại của session (run_chat_pipeline đã lấy và đang giữ turn_lock)
+# lấy lịch sử trong firestore nếu chưa có (warm-up lúc khởi động thì bỏ qua)
+    if not state.get("conversation_history") and not is_warming_up():
         print(f"🗂️ Thử load history từ Firestore | session={session_id} | user_id={user_id}")
         try:
             from firestore_service import load_chat_history
@@ -261,6 +400,10 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
     # Đánh dấu placeholder None để lát nữa ghép reply tương ứng, giữ thứ tự hội thoại chuẩn GPT
     state["conversation_history"] = history_list
     
+    # Phân tích câu 1 lần cho cả lượt: chuẩn hóa, tách từ, context flags, triệu chứng, risk
+    # Các bước sau chỉ đọc từ `analysis`, không quét lại text
+    analysis = analyze_turn(cleaned_input)
+    
     # Khởi tạo response template mới 
     response: Dict[str, Any] = {
         "session_id": session_id,
@@ -303,7 +446,7 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
         print(f"{'='*60}\n")
         
         # Parse câu trả lời xác nhận
-        confirm_result = parse_switch_confirm(cleaned_input)
+        confirm_result = analysis.switch_confirm
         
         if confirm_result is True:
             # Xác nhận chuyển sang chủ đề mới
@@ -360,6 +503,9 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
                 history_list[-1] = (history_list[-1][0], response["reply"])
             return response
     
+    # Speculative: encode câu truy vấn cho RAG song song với PhoBERT (không phụ thuộc intent)
+    speculative = _start_speculative_retrieval(cleaned_input)
+    
     # BƯỚC 2: INTENT CLASSIFICATION - TOP-2
     # Phân loại intent với PhoBERT lấy top-2
     top2 = intent_classifier.predict_topk(cleaned_input, k=2)
@@ -378,12 +524,13 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
     
     # BƯỚC 3: NHẬN DIỆN FOLLOW-UP & TOPIC SHIFT
     #kiểm tra có phải follow-up hay đổi chủ đề rõ ràng không
-    is_follow_up_flag = is_follow_up(cleaned_input)
-    is_topic_shift_flag = is_topic_shift(cleaned_input)
+    is_follow_up_flag = analysis.is_follow_up
+    is_topic_shift_flag = analysis.is_topic_shift
     
     print(f"📌 CONTEXT DETECTION")
     print(f"   is_follow_up: {is_follow_up_flag}")
-    print(f"   is_topic_shift: {is_topic_shift_flag}\n")
+    print(f"   is_topic_shift: {is_topic_shift_flag}")
+    print(f"   keyword_hits: {analysis.keyword_hits}\n")
     
     # BƯỚC 4: TOPIC SHIFT RÕ (Cho phép đổi chủ đề)
     if is_topic_shift_flag and not is_follow_up_flag:
@@ -463,6 +610,7 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
             # Cập nhật conversation history với reply
             if history_list and history_list[-1][1] is None:
                 history_list[-1] = (history_list[-1][0], response["reply"])
+            _discard_speculative(speculative)
             return response
         
         # 6.3) Khác → kiểm tra conf1 để giữ hay đổi
@@ -545,9 +693,9 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
     # ============================
     # BƯỚC 10: SYMPTOM EXTRACTION & RISK
     # ============================
-    # trích xuất các triệu chứng và ước lượng mức độ nguy hiểm trong hàm extract_symptoms của file symptom_extractor.py
-    symptoms = extract_symptoms(cleaned_input)
-    risk = estimate_risk(symptoms)
+    # triệu chứng và mức độ nguy hiểm đã được tính sẵn trong TurnAnalysis (extract_symptoms + estimate_risk)
+    symptoms = analysis.symptoms
+    risk = analysis.risk
     
     # Lưu vào memory
     state["last_intent"] = intent
@@ -575,6 +723,7 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
         )
         # Đánh dấu stage safety để log
         response["stage"] = "safety"
+        _discard_speculative(speculative)
         return response
 
     # ============================
@@ -598,6 +747,7 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
     use_rag = False
     context = ""
     docs = []
+    context_docs = []  # các đoạn thực sự đưa vào context (sau MMR)
     rag_mode = None  # "strong", "soft", hoặc None
     
     # Phân loại intent để xác định ngưỡng
@@ -611,6 +761,7 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
     print(f"   thresholds: STRONG >= {strong_threshold:.2f}, SOFT >= {soft_threshold:.2f}")
     
     # Kiểm tra intent có dùng RAG không
+    # Lượt cần hỏi thêm (BƯỚC 14) vẫn search RAG như trước: response clarification trả kèm sources
     # Case 1: intent_category == no_rag → luôn Gemini
     if intent_category == "no_rag":
         # Intent không dùng RAG → luôn Gemini
@@ -623,9 +774,11 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
         # HIGH: Chắc chắn RAG theo intent 
         print(f"✅ High gate: Intent confidence {intent_conf:.3f} >= 0.92, search RAG theo intent: {rag_intent}")
         try:
-            # Lấy tối đa 5 documents (sẽ chọn số lượng sau dựa trên confidence)
-            docs = retriever.search_by_intent(rag_intent, cleaned_input, k=5)
-            response["sources"] = docs
+            # Lấy RAG_CANDIDATE_K ứng viên (MMR chọn số đoạn dùng sau dựa trên confidence)
+            docs = retriever.search_by_intent(
+                rag_intent, cleaned_input, k=RAG_CANDIDATE_K, prefetched=_collect_speculative(speculative)
+            )
+            response["sources"] = _public_sources(docs)
         #nếu có lỗi khi search theo intent thì fallback về search all intents
             if docs:
                 rag_confidence = docs[0].get("confidence", 0.0)
@@ -635,25 +788,17 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
                 # HIGH gate + doc strong: dùng STRONG RAG (tối đa 5 đoạn)
                 if rag_confidence >= strong_threshold:
                     # STRONG RAG: dùng nhiều hơn (tối đa 5 đoạn) cho câu trả lời giàu nội dung
-                    num_docs = min(5, len(docs))
-                    context_parts = []
-                    for i, d in enumerate(docs[:num_docs], start=1):
-                        context_parts.append(f"[ĐOẠN {i}]\n" + d.get("text", ""))
-                    context = "\n\n".join(context_parts)
+                    context, context_docs = _build_rag_context(docs, "strong")
                     use_rag = True
                     rag_mode = "strong"
-                    print(f"✅ STRONG RAG: {rag_confidence:.3f} >= {strong_threshold:.2f} → dùng {num_docs} đoạn")
+                    print(f"✅ STRONG RAG: {rag_confidence:.3f} >= {strong_threshold:.2f} → dùng {len(context_docs)}/{len(docs)} đoạn")
                 # HIGH gate + doc medium: dùng SOFT RAG (1-2 đoạn tham khảo)
                 elif rag_confidence >= soft_threshold:
                     # SOFT RAG: 1-2 đoạn, chỉ tham khảo nhẹ
-                    num_docs = min(2, len(docs))
-                    context_parts = []
-                    for i, d in enumerate(docs[:num_docs], start=1):
-                        context_parts.append(f"[ĐOẠN {i}]\n" + d.get("text", ""))
-                    context = "\n\n".join(context_parts)
+                    context, context_docs = _build_rag_context(docs, "soft")
                     use_rag = True
                     rag_mode = "soft"
-                    print(f"🟡 SOFT RAG: {rag_confidence:.3f} >= {soft_threshold:.2f} → dùng {num_docs} đoạn (chỉ tham khảo)")
+                    print(f"🟡 SOFT RAG: {rag_confidence:.3f} >= {soft_threshold:.2f} → dùng {len(context_docs)} đoạn (chỉ tham khảo)")
                 # HIGH gate + doc thấp: bỏ RAG
                 else:
                     # NO RAG: Confidence quá thấp
@@ -670,29 +815,23 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
         except Exception as e:
             print(f"⚠️ Lỗi khi search RAG theo intent: {e}, fallback về search thông thường")
             try:
-                docs = retriever.search_all_intents(cleaned_input, k=5)
-                response["sources"] = docs
+                docs = retriever.search_all_intents(
+                    cleaned_input, k=RAG_CANDIDATE_K, prefetched=_collect_speculative(speculative)
+                )
+                response["sources"] = _public_sources(docs)
                 # Kiểm tra docs trả về
                 if docs:
                     rag_confidence = docs[0].get("confidence", 0.0)
                     # Fallback doc strong → STRONG RAG
                     if rag_confidence >= strong_threshold:
                         # STRONG RAG fallback: tối đa 5 đoạn
-                        num_docs = min(5, len(docs))
-                        context_parts = []
-                        for i, d in enumerate(docs[:num_docs], start=1):
-                            context_parts.append(f"[ĐOẠN {i}]\n" + d.get("text", ""))
-                        context = "\n\n".join(context_parts)
+                        context, context_docs = _build_rag_context(docs, "strong")
                         use_rag = True
                         rag_mode = "strong"
                     # Fallback doc medium → SOFT RAG
                     elif rag_confidence >= soft_threshold:
                         # SOFT RAG fallback: 1-2 đoạn
-                        num_docs = min(2, len(docs))
-                        context_parts = []
-                        for i, d in enumerate(docs[:num_docs], start=1):
-                            context_parts.append(f"[ĐOẠN {i}]\n" + d.get("text", ""))
-                        context = "\n\n".join(context_parts)
+                        context, context_docs = _build_rag_context(docs, "soft")
                         use_rag = True
                         rag_mode = "soft"
                     # Fallback doc thấp → bỏ RAG
@@ -714,20 +853,18 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
             # Chỉ cho phép global search khi user vẫn bám intent cũ → giảm nguy cơ lôi nhầm tài liệu intent khác
             # Intent không đổi → có thể RAG global
             try:
-                docs = retriever.search_all_intents(cleaned_input, k=3)
-                response["sources"] = docs
+                docs = retriever.search_all_intents(
+                    cleaned_input, k=3, prefetched=_collect_speculative(speculative)
+                )
+                response["sources"] = _public_sources(docs)
                 if docs:
                     rag_confidence = docs[0].get("confidence", 0.0)
                     if rag_confidence >= soft_threshold:
                         # Chỉ dùng SOFT RAG khi mid gate, lấy 1-2 đoạn
-                        num_docs = min(2, len(docs))
-                        context_parts = []
-                        for i, d in enumerate(docs[:num_docs], start=1):
-                            context_parts.append(f"[ĐOẠN {i}]\n" + d.get("text", ""))
-                        context = "\n\n".join(context_parts)
+                        context, context_docs = _build_rag_context(docs, "soft")
                         use_rag = True
                         rag_mode = "soft"
-                        print(f"🟡 Mid gate: SOFT RAG global với confidence {rag_confidence:.3f} ({num_docs} đoạn)")
+                        print(f"🟡 Mid gate: SOFT RAG global với confidence {rag_confidence:.3f} ({len(context_docs)} đoạn)")
                     else:
                         use_rag = False
                         context = ""
@@ -750,8 +887,14 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
         context = ""
         use_rag = False
     
+    if use_rag and context_docs:
+        # Nguồn trả về client = các đoạn thực sự nằm trong context
+        response["sources"] = _public_sources(context_docs)
+    
     print(f"   rag_mode: {rag_mode}")
     print(f"   use_rag: {use_rag}\n")
+    # Nhánh không search (no_rag, low gate, mid gate đổi intent) → bỏ kết quả speculative
+    _discard_speculative(speculative)
 
 
     # GHI CHÚ PHÂN TẦNG TRẢ LỜI
@@ -837,7 +980,7 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
     pending_intent_after = state.get("pending_intent")
     
     # 6) CLARIFICATION LAYER — chỉ hỏi khi thực sự không rõ triệu chứng
-    if need_more_info(cleaned_input, intent):
+    if analysis.need_more_info(intent):
         question = build_clarification_question(intent)
         response["reply"] = (
             "💬 Để hiểu rõ hơn và trả lời chính xác, bạn cho mình biết thêm nhé:\n"
@@ -908,6 +1051,7 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
         return response
     
     # Generate answer với RAG hoặc Gemini
+    from generator.gemini_generator import generate_medical_answer  # import SDK Gemini ở lượt đầu, không phải lúc import
     if use_rag and context:
         # Dùng RAG với context
         rag_confidence = docs[0].get("confidence", 0.0) if docs else 0.0
@@ -918,11 +1062,10 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
         print(f"👉 User question: {cleaned_input}")
         print("👉 RAG context (đã ghép):")
         print(context)
-        if docs:
-            # Hiển thị đúng số lượng docs được dùng (dựa vào rag_mode)
-            num_display = 5 if rag_mode == "strong" else 2 if rag_mode == "soft" else len(docs)
-            print(f"👉 RAG raw docs (top {num_display}):")
-            for i, d in enumerate(docs[:num_display], 1):
+        if context_docs:
+            # Hiển thị đúng các docs được dùng (sau MMR)
+            print(f"👉 RAG docs đã chọn ({len(context_docs)}/{len(docs)}):")
+            for i, d in enumerate(context_docs, 1):
                 text_preview = (d.get('text', '') or '')
                 print(f"   [{i}] conf={d.get('confidence', 0.0):.3f} | text={text_preview[:300]}...")
         print(f"{'='*60}\n")
@@ -934,7 +1077,9 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
             intent=intent,
             conversation_history=conversation_history,
             is_follow_up=is_follow_up_flag,
-            use_rag_priority=True  # Ưu tiên sử dụng RAG context
+            use_rag_priority=True,  # Ưu tiên sử dụng RAG context
+            stage=response["stage"],  # thống kê kích thước prompt theo stage
+            coalesce=conversation_history is None  # chưa có lịch sử → prompt không phụ thuộc state, gộp request trùng
         )
         # Log full answer từ Gemini để kiểm tra cắt nội dung
         print(f"\n{'='*60}")
@@ -960,7 +1105,9 @@ def run_chat_pipeline(user_input: str, session_id: str = "default", user_id: Opt
             intent=intent,
             conversation_history=conversation_history,
             is_follow_up=is_follow_up_flag,
-            use_rag_priority=False  # Không ưu tiên RAG, để Gemini tự do
+            use_rag_priority=False,  # Không ưu tiên RAG, để Gemini tự do
+            stage=response["stage"],  # thống kê kích thước prompt theo stage
+            coalesce=conversation_history is None  # chưa có lịch sử → prompt không phụ thuộc state, gộp request trùng
         )
         print(f"\n{'='*60}")
         print("🧾 GEMINI DEBUG - ANSWER (NO RAG)")
@@ -0,0 +1,561 @@
+"""
+Firestore giả lập trong bộ nhớ (FIRESTORE_BACKEND=memory) để chạy/benchmark offline các đường
+lịch sử chat, quét reminder, ghi theo lô mà không cần project Firebase thật.
+
+Hỗ trợ đúng phần API client google-cloud-firestore mà project dùng:
+    - collection / collection_group / document (kể cả subcollection), add / set(merge) / update / delete
+    - where (==, !=, <, <=, >, >=, in, not-in, array_contains), order_by, limit, start_after, select, stream/get
+    - batch() (WriteBatch), transaction() + transactional (optimistic concurrency, retry khi xung đột)
+    - SERVER_TIMESTAMP, on_snapshot (listener đơn giản, gọi đồng bộ sau mỗi lần ghi)
+
+Độ trễ giả lập: mỗi RPC chờ latency_ms (+ ngẫu nhiên tới jitter_ms), mỗi document đọc/ghi chờ
+thêm per_doc_ms → so sánh được chi phí đọc toàn bộ vs truy vấn có limit.
+Dùng module này thay cho `firebase_admin.firestore` (cùng tên SERVER_TIMESTAMP, Query, client,
+transactional). Không kiểm tra composite index, không giới hạn 500 thao tác/batch.
+"""
+
+import copy
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+FIRESTORE_MEMORY_LATENCY_MS = float(os.environ.get("FIRESTORE_MEMORY_LATENCY_MS", "0"))
+FIRESTORE_MEMORY_JITTER_MS = float(os.environ.get("FIRESTORE_MEMORY_JITTER_MS", "0"))
+FIRESTORE_MEMORY_PER_DOC_MS = float(os.environ.get("FIRESTORE_MEMORY_PER_DOC_MS", "0"))
+
+
+class _Sentinel:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+DELETE_FIELD = _Sentinel("DELETE_FIELD")
+
+
+def _is_server_timestamp(value: Any) -> bool:
+    """SERVER_TIMESTAMP của module này hoặc của google-cloud-firestore (khi set_db client giả lập)."""
+    if value is SERVER_TIMESTAMP:
+        return True
+    return type(value).__name__ == "Sentinel" and "server timestamp" in str(getattr(value, "description", "")).lower()
+
+
+class NotFound(Exception):
+    """Document không tồn tại (update/transaction trên document thiếu)."""
+
+
+class Aborted(Exception):
+    """Transaction xung đột với lần ghi khác (sẽ được transactional retry)."""
+
+
+class Query:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+    def __init__(self, client: "MemoryFirestore", path: str, group: bool = False):
+        self._client = client
+        self._path = path  # path collection, hoặc collection id nếu group
+        self._group = group
+        self._filters: List[Tuple[str, str, Any]] = []
+        self._orders: List[Tuple[str, str]] = []
+        self._limit: Optional[int] = None
+        self._start_after: Optional[Dict[str, Any]] = None
+        self._fields: Optional[List[str]] = None
+
+    def _copy(self) -> "Query":
+        query = copy.copy(self)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        return query
+
+    def where(self, field: str, op: str, value: Any) -> "Query":
+        query = self._copy()
+        query._filters.append((field, op, value))
+        return query
+
+    def order_by(self, field: str, direction: str = ASCENDING) -> "Query":
+        query = self._copy()
+        query._orders.append((field, direction))
+        return query
+
+    def limit(self, count: int) -> "Query":
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def start_after(self, snapshot: "DocumentSnapshot") -> "Query":
+        query = self._copy()
+        query._start_after = {"id": snapshot.id, "data": snapshot._data}
+        return query
+
+    def select(self, fields: Iterable[str]) -> "Query":
+        query = self._copy()
+        query._fields = list(fields)
+        return query
+
+    # ========================
+    # THỰC THI
+    # ========================
+    def _matches(self, data: Dict[str, Any]) -> bool:
+        for field, op, value in self._filters:
+            if field not in data:
+                return False
+            if not _compare(data[field], op, value):
+                return False
+        # Firestore bỏ qua document thiếu field dùng để order_by
+        return all(field in data for field, _ in self._orders)
+
+    def _sort_key(self, doc_id: str, data: Dict[str, Any]):
+        return [_Ordered(data.get(field), direction) for field, direction in self._orders] + [
+            _Ordered(doc_id, self._orders[-1][1] if self._orders else self.ASCENDING)
+        ]
+
+    def _run(self) -> List["DocumentSnapshot"]:
+        with self._client._lock:
+            rows = [
+                (path, doc_id, data)
+                for path, doc_id, data in self._client._iter_docs(self._path, self._group)
+                if self._matches(data)
+            ]
+            rows.sort(key=lambda row: self._sort_key(row[1], row[2]))
+            if self._start_after is not None:
+                cursor = self._sort_key(self._start_after["id"], self._start_after["data"])
+                rows = [row for row in rows if self._sort_key(row[1], row[2]) > cursor]
+            if self._limit is not None:
+                rows = rows[: self._limit]
+            snapshots = []
+            for path, doc_id, data in rows:
+                if self._fields is not None:
+                    data = {k: v for k, v in data.items() if k in self._fields}
+                snapshots.append(DocumentSnapshot(DocumentReference(self._client, path), copy.deepcopy(data)))
+        self._client._rpc(reads=len(snapshots))
+        return snapshots
+
+    def stream(self):
+        return iter(self._run())
+
+    def get(self) -> List["DocumentSnapshot"]:
+        return self._run()
+
+    def on_snapshot(self, callback: Callable) -> "_Watch":
+        return self._client._watch(self, callback)
+
+
+class CollectionReference(Query):
+    def __init__(self, client: "MemoryFirestore", path: str):
+        super().__init__(client, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self) -> Optional["DocumentReference"]:
+        if "/" not in self._path:
+            return None
+        return DocumentReference(self._client, self._path.rsplit("/", 1)[0])
+
+    def document(self, doc_id: Optional[str] = None) -> "DocumentReference":
+        return DocumentReference(self._client, f"{self._path}/{doc_id or _auto_id()}")
+
+    def add(self, data: Dict[str, Any]):
+        ref = self.document()
+        ref.set(data)
+        return datetime.now(timezone.utc), ref
+
+
+class DocumentReference:
+    def __init__(self, client: "MemoryFirestore", path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self) -> CollectionReference:
+        return CollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name: str) -> CollectionReference:
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, transaction: Optional["Transaction"] = None) -> "DocumentSnapshot":
+        if transaction is not None:
+            return transaction.get(self)
+        snapshot = self._client._read(self)
+        self._client._rpc(reads=1)
+        return snapshot
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        self._client._commit([("set", self, data, merge)])
+
+    def update(self, data: Dict[str, Any]) -> None:
+        self._client._commit([("update", self, data, True)])
+
+    def delete(self) -> None:
+        self._client._commit([("delete", self, None, False)])
+
+    def on_snapshot(self, callback: Callable) -> "_Watch":
+        return self._client._watch(self, callback)
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+class DocumentSnapshot:
+    def __init__(self, reference: DocumentReference, data: Optional[Dict[str, Any]]):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field: str) -> Any:
+        return (self._data or {}).get(field)
+
+
+class WriteBatch:
+    def __init__(self, client: "MemoryFirestore"):
+        self._client = client
+        self._writes: List[Tuple[str, DocumentReference, Any, bool]] = []
+
+    def set(self, ref: DocumentReference, data: Dict[str, Any], merge: bool = False) -> None:
+        self._writes.append(("set", ref, data, merge))
+
+    def update(self, ref: DocumentReference, data: Dict[str, Any]) -> None:
+        self._writes.append(("update", ref, data, True))
+
+    def delete(self, ref: DocumentReference) -> None:
+        self._writes.append(("delete", ref, None, False))
+
+    def commit(self) -> None:
+        """Ghi nguyên tử cả lô trong 1 RPC."""
+        writes, self._writes = self._writes, []
+        self._client._commit(writes)
+
+
+class Transaction(WriteBatch):
+    def __init__(self, client: "MemoryFirestore"):
+        super().__init__(client)
+        self._read_versions: Dict[str, int] = {}
+
+    def get(self, ref: DocumentReference) -> DocumentSnapshot:
+        return next(self.get_all([ref]))
+
+    def get_all(self, refs: Iterable[DocumentReference]):
+        refs = list(refs)
+        with self._client._lock:
+            snapshots = []
+            for ref in refs:
+                self._read_versions[ref.path] = self._client._versions.get(ref.path, 0)
+                snapshots.append(self._client._read(ref))
+        self._client._rpc(reads=len(snapshots))
+        return iter(snapshots)
+
+    def commit(self) -> None:
+        writes, self._writes = self._writes, []
+        self._client._commit(writes, read_versions=self._read_versions)
+        self._read_versions = {}
+
+    def rollback(self) -> None:
+        self._writes = []
+        self._read_versions = {}
+
+
+def transactional(fn: Callable, max_attempts: int = 5) -> Callable:
+    """Như google.cloud.firestore.transactional: chạy fn(transaction, ...), commit, retry khi xung đột."""
+
+    def wrapper(transaction: Transaction, *args, **kwargs):
+        for attempt in range(max_attempts):
+            try:
+                result = fn(transaction, *args, **kwargs)
+                transaction.commit()
+                return result
+            except Aborted:
+                transaction.rollback()
+                if attempt == max_attempts - 1:
+                    raise
+            except Exception:
+                transaction.rollback()
+                raise
+
+    return wrapper
+
+
+class _Change:
+    def __init__(self, change_type: str, document: DocumentSnapshot):
+        self.type = change_type  # "ADDED" | "MODIFIED" | "REMOVED"
+        self.document = document
+
+
+class _Watch:
+    def __init__(self, client: "MemoryFirestore", target, callback: Callable):
+        self._client = client
+        self.target = target
+        self.callback = callback
+
+    def unsubscribe(self) -> None:
+        self._client._unwatch(self)
+
+
+class MemoryFirestore:
+    """Client Firestore trong bộ nhớ, thread-safe, có độ trễ giả lập và đếm số đọc/ghi/RPC."""
+
+    # Module cung cấp transactional/SERVER_TIMESTAMP/Query cho client này (thay firebase_admin.firestore)
+    firestore_module = sys.modules[__name__]
+
+    def __init__(
+        self,
+        latency_ms: float = FIRESTORE_MEMORY_LATENCY_MS,
+        jitter_ms: float = FIRESTORE_MEMORY_JITTER_MS,
+        per_doc_ms: float = FIRESTORE_MEMORY_PER_DOC_MS,
+        project: str = "memory",
+    ):
+        self.project = project
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.per_doc_ms = per_doc_ms
+        self._collections: Dict[str, Dict[str, Dict[str, Any]]] = {}  # path collection -> {id: data}
+        self._versions: Dict[str, int] = {}  # path document -> version (phát hiện xung đột transaction)
+        self._lock = threading.RLock()
+        self._watches: List[_Watch] = []
+
+        self.rpcs = 0
+        self.reads = 0
+        self.writes = 0
+        self.aborted = 0
+
+    # ========================
+    # API CLIENT
+    # ========================
+    def collection(self, path: str) -> CollectionReference:
+        return CollectionReference(self, path)
+
+    def collection_group(self, collection_id: str) -> Query:
+        return Query(self, collection_id, group=True)
+
+    def document(self, path: str) -> DocumentReference:
+        return DocumentReference(self, path)
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def transaction(self) -> Transaction:
+        return Transaction(self)
+
+    def get_all(self, refs: Iterable[DocumentReference]):
+        refs = list(refs)
+        with self._lock:
+            snapshots = [self._read(ref) for ref in refs]
+        self._rpc(reads=len(snapshots))
+        return iter(snapshots)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            documents = sum(len(docs) for docs in self._collections.values())
+        return {
+            "documents": documents,
+            "rpcs": self.rpcs,
+            "reads": self.reads,
+            "writes": self.writes,
+            "aborted": self.aborted,
+        }
+
+    def reset_stats(self) -> None:
+        self.rpcs = self.reads = self.writes = self.aborted = 0
+
+    # ========================
+    # NỘI BỘ
+    # ========================
+    def _rpc(self, reads: int = 0, writes: int = 0) -> None:
+        """Đếm và giả lập độ trễ 1 round-trip (ngoài lock để các thread chạy song song)."""
+        with self._lock:
+            self.rpcs += 1
+            self.reads += reads
+            self.writes += writes
+        delay = self.latency_ms + random.random() * self.jitter_ms + self.per_doc_ms * (reads + writes)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def _iter_docs(self, path: str, group: bool):
+        if not group:
+            for doc_id, data in self._collections.get(path, {}).items():
+                yield f"{path}/{doc_id}", doc_id, data
+            return
+        for collection_path, docs in self._collections.items():
+            if collection_path.rsplit("/", 1)[-1] == path:
+                for doc_id, data in docs.items():
+                    yield f"{collection_path}/{doc_id}", doc_id, data
+
+    def _read(self, ref: DocumentReference) -> DocumentSnapshot:
+        collection_path, doc_id = ref.path.rsplit("/", 1)
+        data = self._collections.get(collection_path, {}).get(doc_id)
+        return DocumentSnapshot(ref, copy.deepcopy(data) if data is not None else None)
+
+    def _commit(self, writes, read_versions: Optional[Dict[str, int]] = None) -> None:
+        """Áp dụng các ghi nguyên tử (kiểm tra xung đột với read_versions của transaction)."""
+        changes = []
+        with self._lock:
+            if read_versions:
+                for path, version in read_versions.items():
+                    if self._versions.get(path, 0) != version:
+                        self.aborted += 1
+                        raise Aborted(f"Document {path} đã bị thay đổi")
+            now = datetime.now(timezone.utc)
+            staged: Dict[str, Optional[Dict[str, Any]]] = {}
+            for kind, ref, data, merge in writes:
+                collection_path, doc_id = ref.path.rsplit("/", 1)
+                current = staged[ref.path] if ref.path in staged else self._collections.get(collection_path, {}).get(doc_id)
+                if kind == "delete":
+                    staged[ref.path] = None
+                    continue
+                if kind == "update" and current is None:
+                    raise NotFound(f"No document to update: {ref.path}")
+                base = dict(current) if (merge and current is not None) else {}
+                for key, value in data.items():
+                    if value is DELETE_FIELD:
+                        base.pop(key, None)
+                    else:
+                        base[key] = now if _is_server_timestamp(value) else copy.deepcopy(value)
+                staged[ref.path] = base
+            for path, data in staged.items():
+                collection_path, doc_id = path.rsplit("/", 1)
+                docs = self._collections.setdefault(collection_path, {})
+                existed = doc_id in docs
+                if data is None:
+                    docs.pop(doc_id, None)
+                    change_type = "REMOVED"
+                else:
+                    docs[doc_id] = data
+                    change_type = "MODIFIED" if existed else "ADDED"
+                self._versions[path] = self._versions.get(path, 0) + 1
+                changes.append((change_type, path, data))
+            watches = list(self._watches)
+        self._rpc(writes=len(writes))
+        if watches and changes:
+            self._notify(watches, changes)
+
+    def _watch(self, target, callback: Callable) -> _Watch:
+        watch = _Watch(self, target, callback)
+        with self._lock:
+            self._watches.append(watch)
+        # Lần đầu: toàn bộ document hiện có dưới dạng ADDED (giống Firestore)
+        if isinstance(target, DocumentReference):
+            snapshot = self._read(target)
+            docs = [snapshot] if snapshot.exists else []
+        else:
+            docs = target.get()
+        callback(docs, [_Change("ADDED", doc) for doc in docs], datetime.now(timezone.utc))
+        return watch
+
+    def _unwatch(self, watch: _Watch) -> None:
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _notify(self, watches: List[_Watch], changes) -> None:
+        for watch in watches:
+            matched = []
+            for change_type, path, data in changes:
+                ref = DocumentReference(self, path)
+                target = watch.target
+                if isinstance(target, DocumentReference):
+                    hit = target.path == path
+                else:
+                    parent = path.rsplit("/", 1)[0]
+                    in_scope = parent.rsplit("/", 1)[-1] == target._path if target._group else parent == target._path
+                    hit = in_scope and (data is None or target._matches(data))
+                if hit:
+                    matched.append(_Change(change_type, DocumentSnapshot(ref, copy.deepcopy(data))))
+            if matched:
+                watch.callback([change.document for change in matched], matched, datetime.now(timezone.utc))
+
+
+# ========================
+# SO SÁNH GIÁ TRỊ
+# ========================
+def _compare(left: Any, op: str, right: Any) -> bool:
+    try:
+        if op == "==":
+            return left == right
+        if op == "!=":
+            return left != right
+        if op == "<":
+            return left < right
+        if op == "<=":
+            return left <= right
+        if op == ">":
+            return left > right
+        if op == ">=":
+            return left >= right
+        if op == "in":
+            return left in right
+        if op == "not-in":
+            return left not in right
+        if op == "array_contains":
+            return isinstance(left, list) and right in left
+        if op == "array_contains_any":
+            return isinstance(left, list) and any(v in left for v in right)
+    except TypeError:
+        # Khác kiểu (vd. so datetime với số) → Firestore coi như không khớp
+        return False
+    raise ValueError(f"Toán tử where không hỗ trợ: {op}")
+
+
+class _Ordered:
+    """Khóa sắp xếp theo 1 field, đảo chiều với DESCENDING; None (thiếu) đứng đầu."""
+
+    __slots__ = ("value", "descending")
+
+    def __init__(self, value: Any, direction: str):
+        self.value = value
+        self.descending = direction == Query.DESCENDING
+
+    def _lt(self, other: "_Ordered") -> bool:
+        if self.value is None or other.value is None:
+            return self.value is None and other.value is not None
+        try:
+            return self.value < other.value
+        except TypeError:
+            return type(self.value).__name__ < type(other.value).__name__
+
+    def __lt__(self, other: "_Ordered") -> bool:
+        return other._lt(self) if self.descending else self._lt(other)
+
+    def __gt__(self, other: "_Ordered") -> bool:
+        return other < self
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, _Ordered) and not self < other and not other < self
+
+
+_id_counter = itertools.count()
+
+
+def _auto_id() -> str:
+    return f"{random.getrandbits(64):016x}{next(_id_counter):04x}"
+
+
+# Cùng tên với firebase_admin.firestore để firestore_service dùng thay thế trực tiếp
+Client = MemoryFirestore
+
+_default_client: Optional[MemoryFirestore] = None
+_default_lock = threading.Lock()
+
+
+def client() -> MemoryFirestore:
+    """Client dùng chung trong process (như firebase_admin.firestore.client())."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = MemoryFirestore()
+        return _default_client
+
@@ -2,14 +2,38 @@
 Firestore service để lưu conversations và medicine reminders
 """
 import os
+import time
+from threading import Lock
 from typing import Optional, Dict, Any, List
-from datetime import datetime
-import firebase_admin
-from firebase_admin import credentials, firestore
+from datetime import datetime, timezone
+
+from app.ttl_cache import TTLCache
+
+# firebase (mặc định): project giadienweb thật | memory: Firestore giả lập trong bộ nhớ (firestore_memory.py)
+FIRESTORE_BACKEND = os.environ.get("FIRESTORE_BACKEND", "firebase").lower()
+
+if FIRESTORE_BACKEND == "memory":
+    import firestore_memory as firestore
+    firebase_admin = credentials = None
+else:
+    import firebase_admin
+    from firebase_admin import credentials, firestore
 
 # Global Firestore client
 _db: Optional[firestore.Client] = None
 
+# Cache đọc (read-through) cho dữ liệu ít đổi: health profile, danh sách reminder của user
+FIRESTORE_CACHE_SIZE = int(os.environ.get("FIRESTORE_CACHE_SIZE", "2048"))
+FIRESTORE_CACHE_TTL = float(os.environ.get("FIRESTORE_CACHE_TTL", "300"))
+# 1 (mặc định) = nghe thay đổi trên Firestore (snapshot listener) để xóa cache ngay cả khi frontend ghi
+# trực tiếp (profile, reminder). 0 = chỉ xóa khi ghi qua backend → đọc có thể cũ tới FIRESTORE_CACHE_TTL giây
+FIRESTORE_CACHE_LISTENERS = os.environ.get("FIRESTORE_CACHE_LISTENERS", "1") == "1"
+
+_profile_cache = TTLCache(FIRESTORE_CACHE_SIZE, FIRESTORE_CACHE_TTL, name="health_profiles")
+_reminder_list_cache = TTLCache(FIRESTORE_CACHE_SIZE, FIRESTORE_CACHE_TTL, name="medicine_reminder_lists")
+_cache_listeners: List[Any] = []
+_MISSING = object()
+
 
 def initialize_firestore():
     """Khởi tạo Firestore client với project giadienweb"""
@@ -18,6 +42,11 @@ def initialize_firestore():
     if _db is not None:
         return _db
     
+    if FIRESTORE_BACKEND == "memory":
+        _db = firestore.client()
+        print("[firestore] Using in-memory Firestore (FIRESTORE_BACKEND=memory)")
+        return _db
+    
     try:
         # Kiểm tra xem đã initialize chưa
         if not firebase_admin._apps:
@@ -111,10 +140,55 @@ def get_db() -> Optional[firestore.Client]:
     return _db
 
 
+def set_db(client) -> None:
+    """Dùng client cho sẵn (vd. firestore_memory.MemoryFirestore có độ trễ giả lập trong test/benchmark)."""
+    global _db
+    _db = client
+    _profile_cache.clear()
+    _reminder_list_cache.clear()
+
+
 # ============================
 # CONVERSATION OPERATIONS
 # ============================
 
+_chat_writer = None
+_message_clock_lock = Lock()
+_last_message_ns = 0
+
+
+def get_chat_writer():
+    """Hàng đợi write-behind dùng chung cho messages/chatSessions (thread nền khởi động lần đầu dùng)."""
+    global _chat_writer
+    if _chat_writer is None:
+        from app.write_behind import FirestoreWriteBehind
+        _chat_writer = FirestoreWriteBehind(get_db)
+        _chat_writer.start()
+    return _chat_writer
+
+
+def _message_stamp() -> tuple:
+    """
+    (timestamp, seq) cho message mới, tăng dần nghiêm ngặt trong process (cách nhau ít nhất 1µs).
+
+    Không dùng SERVER_TIMESTAMP: write-behind ghi câu hỏi và câu trả lời trong cùng 1 WriteBatch
+    nên cả 2 nhận cùng 1 giá trị → load_chat_history không biết message nào trước.
+    """
+    global _last_message_ns
+    with _message_clock_lock:
+        # Firestore lưu timestamp tới micro giây → bước tối thiểu 1000ns
+        ns = max(time.time_ns(), _last_message_ns + 1000)
+        _last_message_ns = ns
+    timestamp = datetime.fromtimestamp(ns // 10**9, tz=timezone.utc).replace(microsecond=ns // 1000 % 10**6)
+    return timestamp, ns
+
+
+def shutdown_chat_writer(timeout: float = 10.0) -> None:
+    """Flush các ghi chat còn trong hàng đợi (gọi khi tắt server)."""
+    if _chat_writer is not None:
+        _chat_writer.stop(timeout)
+
+
 def save_chat_message(
     user_id: str,
     user_email: str,
@@ -124,23 +198,22 @@ def save_chat_message(
     metadata: Optional[Dict[str, Any]] = None
 ) -> Optional[str]:
     """
-    Lưu một message vào Firestore
+    Lưu một message vào Firestore (write-behind: trả về ngay, ghi theo lô ở thread nền)
     
     Returns:
         Message ID nếu thành công, None nếu lỗi
     """
     try:
-        db = get_db()
-        if db is None:
-            return None
-        
+        # Đóng dấu thời gian lúc enqueue (thứ tự gọi), không phải lúc batch được commit
+        timestamp, seq = _message_stamp()
         message_data = {
             "userId": user_id,
             "userEmail": user_email,
             "sessionId": session_id,
             "text": message_text,
             "role": role,
-            "timestamp": firestore.SERVER_TIMESTAMP,
+            "timestamp": timestamp,
+            "seq": seq,
         }
         
         if role == "assistant":
@@ -149,9 +222,7 @@ def save_chat_message(
         if metadata:
             message_data["metadata"] = metadata
         
-        doc_ref = db.collection("messages").add(message_data)
-        message_id = doc_ref[1].id
-        return message_id
+        return get_chat_writer().enqueue_message(message_data)
         
     except Exception:
         return None
@@ -164,21 +235,15 @@ def save_chat_session(
     title: Optional[str] = None
 ) -> Optional[str]:
     """
-    Lưu hoặc cập nhật chat session vào Firestore
+    Lưu hoặc cập nhật chat session vào Firestore (write-behind: trả về ngay, ghi theo lô ở thread nền)
     
     Returns:
         Session ID nếu thành công, None nếu lỗi
     """
     try:
-        db = get_db()
-        if db is None:
+        if get_db() is None:
             return None
         
-        # Kiểm tra xem session đã tồn tại chưa
-        sessions_ref = db.collection("chatSessions")
-        query = sessions_ref.where("sessionId", "==", session_id).where("userId", "==", user_id).limit(1)
-        docs = query.get()
-        
         session_data = {
             "userId": user_id,
             "userEmail": user_email,
@@ -187,26 +252,82 @@ def save_chat_session(
             "updatedAt": firestore.SERVER_TIMESTAMP,
         }
         
-        if docs:
-            # Cập nhật session hiện có
-            doc_ref = docs[0].reference
-            doc_ref.update(session_data)
-        else:
-            # Tạo session mới
-            session_data["createdAt"] = firestore.SERVER_TIMESTAMP
-            sessions_ref.add(session_data)
-        
+        # Session đã có → update, chưa có → tạo mới kèm createdAt (tra cứu ở thread nền)
+        get_chat_writer().enqueue_session(
+            user_id, session_id, session_data, on_create={"createdAt": firestore.SERVER_TIMESTAMP}
+        )
         return session_id
         
     except Exception:
         return None
 
 
+# Field cần để ghép cặp Q&A (projection, không đọc metadata/userEmail...)
+_HISTORY_FIELDS = ["role", "text", "aiResponse", "timestamp", "seq"]
+
+
+def _message_ts(data: Dict[str, Any]) -> float:
+    """timestamp của message (Firestore Timestamp / datetime) → epoch giây; thiếu/lỗi → 0."""
+    ts = data.get("timestamp")
+    try:
+        ts = ts.to_datetime() if hasattr(ts, "to_datetime") else ts
+        return ts.timestamp() if hasattr(ts, "timestamp") else 0
+    except Exception:
+        return 0
+
+
+def _message_order_key(data: Dict[str, Any]) -> tuple:
+    """
+    Thứ tự message trong session: timestamp, rồi seq (save_chat_message), rồi user trước assistant.
+
+    Message cũ ghi bằng SERVER_TIMESTAMP trong cùng 1 WriteBatch có timestamp bằng nhau
+    (Firestore trả theo id document) → cần khóa phụ để câu hỏi đứng trước câu trả lời.
+    """
+    seq = data.get("seq")
+    role = data.get("role") or ("assistant" if data.get("aiResponse") else "user")
+    return _message_ts(data), seq if isinstance(seq, int) else 0, role != "user"
+
+
+def _pair_messages(messages: List[Dict[str, Any]]) -> List[tuple]:
+    """Ghép cặp (user, bot) từ các message đã sắp theo thời gian tăng dần."""
+    history: List[tuple] = []
+    pending_users: List[str] = []
+    for data in messages:
+        role = data.get("role")
+        # Suy luận role nếu thiếu giống frontend: nếu có aiResponse thì assistant, ngược lại user
+        if not role:
+            role = "assistant" if data.get("aiResponse") else "user"
+
+        # Frontend lưu aiResponse cho assistant, text cho user; ưu tiên text rồi aiResponse
+        text = data.get("text") or data.get("aiResponse")
+        if not text:
+            continue
+
+        if role == "user":
+            pending_users.append(text)
+        elif role == "assistant":
+            user_text = pending_users.pop(0) if pending_users else None
+            history.append((user_text, text))
+    return history
+
+
+def _load_history_legacy(query_obj) -> List[Dict[str, Any]]:
+    """
+    Cách cũ cho dữ liệu cũ không có timestamp (query order_by bỏ qua các document thiếu field):
+    đọc toàn bộ message của session rồi sort trong Python (thiếu timestamp → đứng đầu, giữ thứ tự Firestore).
+    """
+    messages = [doc.to_dict() or {} for doc in query_obj.select(_HISTORY_FIELDS).stream()]
+    return sorted(messages, key=_message_ts)
+
+
 def load_chat_history(user_id: Optional[str], session_id: str, limit: int = 2) -> List[tuple]:
     """Đọc lịch sử chat (user/assistant) từ Firestore và trả về các cặp (user, bot).
 
     - Lọc theo sessionId (và userId nếu có)
-    - Sắp xếp theo timestamp tăng dần
+    - Chỉ đọc vài message mới nhất: order_by timestamp DESC + limit + projection
+      (composite index messages: sessionId, [userId,] timestamp DESC trong AI-Web/firestore.indexes.json)
+      → chi phí O(limit), không phụ thuộc độ dài session
+    - Timestamp bằng nhau (message cũ cùng 1 WriteBatch SERVER_TIMESTAMP) → xếp theo seq, rồi user trước assistant
     - Ghép cặp theo role: ưu tiên user → assistant; nếu thiếu user thì vẫn giữ assistant
     - Trả về tối đa `limit` cặp gần nhất
     """
@@ -222,58 +343,33 @@ def load_chat_history(user_id: Optional[str], session_id: str, limit: int = 2) -
         if user_id:
             query_obj = query_obj.where("userId", "==", user_id)
 
-        # Không order_by trên Firestore (giống frontend): lấy tất cả, sau đó sort trong Python
-        docs = list(query_obj.stream())
-        print(f"[firestore] Loaded {len(docs)} raw docs for session={session_id} user_id={user_id}")
-        if docs:
-            sample = []
-            for d in docs[:5]:
-                data = d.to_dict() or {}
-                sample.append({
-                    "role": data.get("role"),
-                    "text": (data.get("text") or "")[:60],
-                    "aiResponse": (data.get("aiResponse") or "")[:60],
-                    "timestamp": str(data.get("timestamp")),
-                })
-            print(f"[firestore] Sample docs: {sample}")
-        history: List[tuple] = []
-        pending_users: List[str] = []
-
-        # Sort docs giống frontend: theo timestamp tăng dần (nếu thiếu timestamp thì giữ nguyên thứ tự Firestore)
-        def _get_ts(doc):
-            data = doc.to_dict() or {}
-            ts = data.get("timestamp")
-            try:
-                return ts.to_datetime() if hasattr(ts, "to_datetime") else ts
-            except Exception:
-                return ts
-
-        docs = sorted(docs, key=lambda d: (_get_ts(d) or 0))
-
-        for doc in docs:
-            data = doc.to_dict() or {}
-            role = data.get("role")
-            # Suy luận role nếu thiếu giống frontend: nếu có aiResponse thì assistant, ngược lại user
-            if not role:
-                role = "assistant" if data.get("aiResponse") else "user"
-
-            # Frontend lưu aiResponse cho assistant, text cho user; ưu tiên text rồi aiResponse
-            text = data.get("text") or data.get("aiResponse")
-            if not text:
-                continue
-
-            if role == "user":
-                pending_users.append(text)
-            elif role == "assistant":
-                user_text = pending_users.pop(0) if pending_users else None
-                history.append((user_text, text))
-            else:
-                continue
+        # Mỗi cặp 2 message, dư thêm 2 cho message user chưa có trả lời / assistant mất user
+        fetch = limit * 2 + 2
+        recent = (
+            query_obj.order_by("timestamp", direction=firestore.Query.DESCENDING)
+            .limit(fetch)
+            .select(_HISTORY_FIELDS)
+        )
+        try:
+            # Query chỉ order_by timestamp (document thiếu seq vẫn được trả về); tie-break ở đây
+            messages = sorted((doc.to_dict() or {} for doc in recent.stream()), key=_message_order_key)
+            source = "recent"
+        except Exception as e:
+            # Thiếu composite index (chưa deploy firestore.indexes.json) → đọc toàn bộ như cũ
+            print(f"[firestore] Ordered history query failed, fallback full scan: {e}")
+            messages = []
+            source = None
+
+        if not messages:
+            # Session cũ toàn document không có timestamp (hoặc session trống)
+            messages = _load_history_legacy(query_obj)
+            source = "legacy"
+
+        history = _pair_messages(messages)
+        print(f"[firestore] Loaded {len(messages)} docs ({source}) for session={session_id} user_id={user_id}")
 
         # chỉ giữ tối đa `limit` cặp gần nhất
-        if len(history) > limit:
-              history = history[-limit:]
-        return history
+        return history[-limit:] if limit > 0 else []
 
     except Exception:
         return []
@@ -306,7 +402,8 @@ def save_medicine_reminder(reminder_data: Dict[str, Any]) -> Optional[str]:
         if "next_reminder_time" in firestore_data and isinstance(firestore_data["next_reminder_time"], str):
             try:
                 dt = datetime.fromisoformat(firestore_data["next_reminder_time"])
-                firestore_data["nextReminderTime"] = firestore.Timestamp.from_datetime(dt)
+                # datetime có timezone → client Firestore lưu thành Timestamp (giờ local của server)
+                firestore_data["nextReminderTime"] = dt.astimezone()
             except:
                 pass
             del firestore_data["next_reminder_time"]
@@ -315,7 +412,7 @@ def save_medicine_reminder(reminder_data: Dict[str, Any]) -> Optional[str]:
             try:
                 if isinstance(firestore_data["last_sent"], str):
                     dt = datetime.fromisoformat(firestore_data["last_sent"])
-                    firestore_data["lastSent"] = firestore.Timestamp.from_datetime(dt)
+                    firestore_data["lastSent"] = dt.astimezone()
                 else:
                     firestore_data["lastSent"] = firestore.SERVER_TIMESTAMP
             except:
@@ -346,6 +443,7 @@ def save_medicine_reminder(reminder_data: Dict[str, Any]) -> Optional[str]:
             doc_ref = db.collection("medicineReminders").add(firestore_data)
             reminder_id = doc_ref[1].id
         
+        invalidate_reminder_cache(user_id=firestore_data.get("userId"), reminder_id=reminder_id)
         return reminder_id
         
     except Exception:
@@ -353,7 +451,10 @@ def save_medicine_reminder(reminder_data: Dict[str, Any]) -> Optional[str]:
 
 
 def get_medicine_reminders(user_id: str) -> List[Dict[str, Any]]:
-    """Lấy danh sách medicine reminders của user"""
+    """Lấy danh sách medicine reminders của user (cache theo user, xóa khi tạo/xóa reminder)"""
+    cached = _reminder_list_cache.get(user_id, _MISSING)
+    if cached is not _MISSING:
+        return [dict(r) for r in cached]
     try:
         db = get_db()
         if db is None:
@@ -369,7 +470,8 @@ def get_medicine_reminders(user_id: str) -> List[Dict[str, Any]]:
             data["id"] = doc.id
             reminders.append(data)
         
-        return reminders
+        _reminder_list_cache.set(user_id, reminders)
+        return [dict(r) for r in reminders]
         
     except Exception:
         return []
@@ -377,9 +479,12 @@ def get_medicine_reminders(user_id: str) -> List[Dict[str, Any]]:
 
 def get_health_profile(user_id: str) -> Optional[Dict[str, Any]]:
     """
-    Lấy health profile của user từ Firestore
+    Lấy health profile của user từ Firestore (cache theo user, kể cả khi chưa có profile)
     Path: users/{user_id}/healthProfile/profile
     """
+    cached = _profile_cache.get(user_id, _MISSING)
+    if cached is not _MISSING:
+        return dict(cached) if cached is not None else None
     try:
         db = get_db()
         if db is None:
@@ -388,16 +493,18 @@ def get_health_profile(user_id: str) -> Optional[Dict[str, Any]]:
         doc_ref = db.collection('users').document(user_id).collection('healthProfile').document('profile')
         doc = doc_ref.get()
         
+        profile = None
         if doc.exists:
             data = doc.to_dict()
-            return {
+            profile = {
                 'tuoi': data.get('tuoi'),
                 'chieuCao': data.get('chieuCao'),
                 'canNang': data.get('canNang'),
                 'mucVanDong': data.get('mucVanDong'),
                 'gioiTinh': data.get('gioiTinh', 'khac')
             }
-        return None
+        _profile_cache.set(user_id, profile)
+        return dict(profile) if profile is not None else None
     except Exception:
         return None
 
@@ -410,8 +517,75 @@ def delete_medicine_reminder(reminder_id: str) -> bool:
         
         doc_ref = db.collection("medicineReminders").document(reminder_id)
         doc_ref.update({"isActive": False})
+        invalidate_reminder_cache(reminder_id=reminder_id)
         return True
         
     except Exception:
         return False
 
+
+# ============================
+# CACHE
+# ============================
+
+def invalidate_reminder_cache(user_id: Optional[str] = None, reminder_id: Optional[str] = None) -> None:
+    """Xóa danh sách reminder đã cache của user (hoặc của các user đang có reminder_id trong cache)."""
+    if user_id:
+        _reminder_list_cache.invalidate(user_id)
+    if reminder_id:
+        _reminder_list_cache.invalidate_if(
+            lambda _, reminders: any(r.get("id") == reminder_id for r in reminders)
+        )
+
+
+def invalidate_health_profile(user_id: str) -> None:
+    _profile_cache.invalidate(user_id)
+
+
+def start_cache_listeners() -> bool:
+    """
+    Snapshot listener trên medicineReminders và healthProfile: document đổi (kể cả do frontend ghi
+    trực tiếp) → xóa cache của user đó ngay, không chờ TTL. Tắt bằng FIRESTORE_CACHE_LISTENERS=0.
+    Lưu ý: lần nghe đầu tiên Firestore gửi toàn bộ document hiện có (tính phí đọc 1 lần).
+    """
+    if _cache_listeners or not FIRESTORE_CACHE_LISTENERS:
+        return bool(_cache_listeners)
+    db = get_db()
+    if db is None:
+        return False
+
+    def on_reminders(_docs, changes, _read_time):
+        for change in changes:
+            data = change.document.to_dict() or {}
+            invalidate_reminder_cache(user_id=data.get("userId"), reminder_id=change.document.id)
+
+    def on_profiles(_docs, changes, _read_time):
+        for change in changes:
+            # users/{user_id}/healthProfile/profile
+            invalidate_health_profile(change.document.reference.parent.parent.id)
+
+    try:
+        _cache_listeners.append(db.collection("medicineReminders").on_snapshot(on_reminders))
+        _cache_listeners.append(db.collection_group("healthProfile").on_snapshot(on_profiles))
+        print("[firestore] Cache listeners started")
+        return True
+    except Exception as e:
+        print(f"[firestore] Cannot start cache listeners (cached reads may be stale up to {FIRESTORE_CACHE_TTL:.0f}s): {e}")
+        stop_cache_listeners()
+        return False
+
+
+def stop_cache_listeners() -> None:
+    while _cache_listeners:
+        try:
+            _cache_listeners.pop().unsubscribe()
+        except Exception:
+            pass
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    return {
+        "health_profiles": _profile_cache.stats(),
+        "medicine_reminder_lists": _reminder_list_cache.stats(),
+        "listeners": len(_cache_listeners),
+    }
@@ -0,0 +1,374 @@
+"""
+Gợi ý tập luyện theo health profile (endpoint /api/health-profile/exercise-suggestion).
+
+Đầu vào thực chất chỉ có vài giá trị rời rạc → lượng tử hóa profile thành key
+(nhóm tuổi, giới tính, mức vận động, nhóm BMI) và cache câu trả lời của Gemini theo key:
+    - prompt chỉ dùng giá trị đã lượng tử hóa (không có tuổi/chiều cao/cân nặng cụ thể)
+      nên mọi user cùng nhóm dùng chung được 1 gợi ý
+    - hết EXERCISE_CACHE_REFRESH → vẫn trả bản cũ, làm mới ở thread nền;
+      hết EXERCISE_CACHE_TTL → gọi lại Gemini (lỗi thì vẫn trả bản cũ nếu có)
+    - có thể sinh trước toàn bộ nhóm (scripts/pregenerate_exercise_suggestions.py) và nạp từ
+      file EXERCISE_SUGGESTIONS_FILE khi khởi động
+
+Gemini được gọi ở JSON mode với EXERCISE_SCHEMA; response được kiểm tra schema ngay khi đang
+stream (generator/json_stream.py) nên câu trả lời sai format bị ngắt sớm thay vì regex + sửa JSON.
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.single_flight import SingleFlight
+
+EXERCISE_CACHE_TTL = float(os.environ.get("EXERCISE_CACHE_TTL", str(30 * 24 * 3600)))
+EXERCISE_CACHE_REFRESH = float(os.environ.get("EXERCISE_CACHE_REFRESH", str(7 * 24 * 3600)))
+EXERCISE_SUGGESTIONS_FILE = os.environ.get("EXERCISE_SUGGESTIONS_FILE", "")
+
+# Đổi khi sửa prompt → gợi ý đã cache/sinh trước theo prompt cũ bị bỏ qua
+PROMPT_VERSION = 1
+
+ProfileKey = Tuple[str, str, str, str]  # (nhóm tuổi, giới tính, mức vận động, nhóm BMI)
+
+# (tuổi nhỏ nhất, tuổi lớn nhất, nhãn); ranh giới 30 và 50 khớp quy tắc "người trẻ"/"người lớn tuổi" trong prompt
+AGE_BANDS = [
+    (0, 17, "duoi 18"),
+    (18, 29, "18-29"),
+    (30, 39, "30-39"),
+    (40, 49, "40-49"),
+    (50, 59, "50-59"),
+    (60, 69, "60-69"),
+    (70, 200, "tu 70"),
+]
+AGE_BAND_LABELS = {
+    "duoi 18": "dưới 18 tuổi",
+    "18-29": "18-29 tuổi",
+    "30-39": "30-39 tuổi",
+    "40-49": "40-49 tuổi",
+    "50-59": "50-59 tuổi",
+    "60-69": "60-69 tuổi",
+    "tu 70": "từ 70 tuổi trở lên",
+}
+MUC_VAN_DONG_LABELS = {"it": "Ít", "vua": "Vừa", "nhieu": "Nhiều"}
+GIOI_TINH_LABELS = {"nam": "Nam", "nu": "Nữ", "khac": "Khác"}
+# Cùng ngưỡng với calculateBMI ở frontend (health-profile.service.ts)
+BMI_CATEGORIES = [
+    (18.5, "hơi gầy", "dưới 18.5"),
+    (25.0, "cân đối", "18.5-24.9"),
+    (30.0, "hơi thừa cân", "25-29.9"),
+    (float("inf"), "thừa cân nhiều", "từ 30"),
+]
+
+SYSTEM_INSTRUCTION = """Bạn là chuyên gia thể dục và sức khỏe chuyên nghiệp. Nhiệm vụ của bạn là tạo kế hoạch tập luyện an toàn, phù hợp, chi tiết và rộng dựa trên thông tin sức khỏe của người dùng. Luôn ưu tiên an toàn và phù hợp với từng cá nhân. Hãy đưa ra nhiều gợi ý đa dạng, không chỉ giới hạn ở 4-5 bài tập cơ bản."""
+
+# response_schema cho JSON mode của Gemini (cũng dùng để kiểm tra khi stream)
+EXERCISE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "exercises": {"type": "array", "items": {"type": "string"}},
+        "frequency": {"type": "string"},
+        "duration": {"type": "string"},
+        "notes": {"type": "string"},
+    },
+    "required": ["title", "exercises", "frequency", "duration", "notes"],
+}
+
+FALLBACK_EXERCISES = ["Đi bộ 30 phút mỗi ngày", "Tập thể dục nhẹ nhàng", "Yoga hoặc stretching", "Đạp xe hoặc bơi lội"]
+
+
+# ========================
+# LƯỢNG TỬ HÓA PROFILE
+# ========================
+def age_band(tuoi: int) -> str:
+    for low, high, label in AGE_BANDS:
+        if low <= tuoi <= high:
+            return label
+    return AGE_BANDS[0][2] if tuoi < 0 else AGE_BANDS[-1][2]
+
+
+def bmi_category(bmi: float) -> str:
+    for upper, label, _ in BMI_CATEGORIES:
+        if bmi < upper:
+            return label
+    return BMI_CATEGORIES[-1][1]
+
+
+def quantize_profile(tuoi: int, gioiTinh: str, mucVanDong: str, bmi: float) -> ProfileKey:
+    """Profile → key cache. Giá trị lạ được đưa về mặc định giống nhãn cũ (Khác / Ít)."""
+    gioi_tinh = gioiTinh if gioiTinh in GIOI_TINH_LABELS else "khac"
+    muc_van_dong = mucVanDong if mucVanDong in MUC_VAN_DONG_LABELS else "it"
+    return (age_band(tuoi), gioi_tinh, muc_van_dong, bmi_category(bmi))
+
+
+def all_profile_keys() -> List[ProfileKey]:
+    """Mọi nhóm profile (để sinh trước)."""
+    return list(itertools.product(
+        [label for _, _, label in AGE_BANDS],
+        list(GIOI_TINH_LABELS),
+        list(MUC_VAN_DONG_LABELS),
+        [label for _, label, _ in BMI_CATEGORIES],
+    ))
+
+
+def key_to_str(key: ProfileKey) -> str:
+    return "|".join(key)
+
+
+def build_exercise_prompt(key: ProfileKey) -> str:
+    age, gioi_tinh, muc_van_dong, bmi_cat = key
+    tuoi_label = AGE_BAND_LABELS[age]
+    gioi_tinh_label = GIOI_TINH_LABELS[gioi_tinh]
+    muc_van_dong_label = MUC_VAN_DONG_LABELS[muc_van_dong]
+    bmi_range = next(bmi_range for _, label, bmi_range in BMI_CATEGORIES if label == bmi_cat)
+
+    return f"""Dựa vào thông tin sức khỏe sau, hãy tạo một kế hoạch tập luyện CHI TIẾT, RỘNG và PHÙ HỢP:
+
+THÔNG TIN SỨC KHỎE:
+- Độ tuổi: {tuoi_label}
+- Giới tính: {gioi_tinh_label}
+- BMI: {bmi_cat} (BMI {bmi_range})
+- Mức vận động hiện tại: {muc_van_dong_label}
+
+YÊU CẦU:
+Hãy tạo gợi ý tập luyện CHI TIẾT và RỘNG với format JSON sau (CHỈ trả về JSON, không có text thêm):
+{{
+  "title": "Tiêu đề kế hoạch tập luyện (ví dụ: Kế hoạch tập luyện tăng cơ và sức khỏe)",
+  "exercises": ["Bài tập 1 chi tiết", "Bài tập 2 chi tiết", "Bài tập 3 chi tiết", "Bài tập 4 chi tiết", "Bài tập 5 chi tiết"],
+  "frequency": "Tần suất tập luyện cụ thể (ví dụ: 3-4 lần/tuần, mỗi ngày cách nhau)",
+  "duration": "Thời gian mỗi buổi cụ thể (ví dụ: 30-40 phút/buổi, bao gồm khởi động và thư giãn)",
+  "notes": "Lưu ý và khuyến nghị chi tiết, bao gồm cả chế độ dinh dưỡng và nghỉ ngơi"
+}}
+
+LƯU Ý QUAN TRỌNG:
+- Gợi ý phải AN TOÀN, phù hợp với độ tuổi ({tuoi_label}) và giới tính ({gioi_tinh_label})
+- Nếu BMI thấp (hơi gầy): tập trung vào tăng cơ, tăng sức khỏe, dinh dưỡng giàu protein
+- Nếu BMI cao (thừa cân): tập trung vào giảm cân an toàn, cardio, kết hợp dinh dưỡng
+- Nếu mức vận động hiện tại là "Ít": bắt đầu từ từ, nhẹ nhàng, tăng dần
+- Nếu mức vận động là "Nhiều": có thể gợi ý cường độ cao hơn, đa dạng hơn
+- Người lớn tuổi (>=50): ưu tiên bài tập nhẹ nhàng, an toàn, tránh chấn thương
+- Người trẻ (<30): có thể gợi ý cường độ cao hơn, đa dạng hơn
+- Không được chẩn đoán bệnh, không gợi ý thuốc
+- Chỉ đưa ra lời khuyên tập luyện và lối sống lành mạnh
+- Hãy đưa ra NHIỀU bài tập đa dạng (ít nhất 5-6 bài), không chỉ 4 bài cơ bản
+- Bao gồm cả gợi ý về khởi động, thư giãn, và chế độ dinh dưỡng kèm theo
+
+Hãy tạo gợi ý tập luyện PHÙ HỢP, CHI TIẾT và RỘNG."""
+
+
+# ========================
+# CHUẨN HÓA RESPONSE
+# ========================
+def _clean_exercise(ex: Any) -> Optional[str]:
+    if isinstance(ex, str):
+        return ex.strip() or None
+    if isinstance(ex, dict):
+        # Nếu là object, lấy text, name, title, hoặc description; không có thì lấy giá trị đầu tiên
+        ex_text = ex.get("text") or ex.get("name") or ex.get("title") or ex.get("description") or ex.get("content")
+        if not ex_text:
+            values = [v for v in ex.values() if v]
+            ex_text = values[0] if values else None
+        return (str(ex_text).strip() or None) if ex_text else None
+    if ex is not None:
+        ex_clean = str(ex).strip()
+        if ex_clean and ex_clean.lower() not in ["null", "none", "undefined"]:
+            return ex_clean
+    return None
+
+
+def normalize_suggestion(suggestion: Dict[str, Any]) -> Dict[str, Any]:
+    """Chuẩn hóa object gợi ý: lọc bài tập rỗng/trùng, điền giá trị mặc định."""
+    exercises = suggestion.get("exercises", [])
+    if not isinstance(exercises, list):
+        exercises = []
+    # Lọc bỏ empty strings và duplicates
+    exercises_clean = list(dict.fromkeys(ex for ex in map(_clean_exercise, exercises) if ex))
+    if not exercises_clean:
+        exercises_clean = list(FALLBACK_EXERCISES)
+
+    return {
+        "title": str(suggestion.get("title", "Kế hoạch tập luyện")).strip(),
+        "exercises": exercises_clean,
+        "frequency": str(suggestion.get("frequency", "3-4 lần/tuần")).strip(),
+        "duration": str(suggestion.get("duration", "30-40 phút/buổi")).strip(),
+        "notes": str(suggestion.get("notes", "Hãy bắt đầu từ từ và tăng dần cường độ.")).strip(),
+    }
+
+
+def generate_suggestion(key: ProfileKey) -> Dict[str, Any]:
+    """Gọi Gemini cho 1 nhóm profile (lỗi/không parse được → ValueError, không cache)."""
+    from generator.gemini_generator import generate_json
+
+    suggestion = normalize_suggestion(
+        generate_json(build_exercise_prompt(key), EXERCISE_SCHEMA, SYSTEM_INSTRUCTION, coalesce=True)
+    )
+    print(f"✅ Gemini đã tạo {len(suggestion['exercises'])} bài tập cho nhóm {key_to_str(key)}")
+    return suggestion
+
+
+# ========================
+# CACHE
+# ========================
+class ExerciseSuggestionCache:
+    """
+    Cache gợi ý theo ProfileKey (số key hữu hạn, ~250 → dict, không cần LRU).
+
+    - refresh_after: quá hạn mềm → trả bản cũ + làm mới ở thread nền
+    - ttl: quá hạn cứng → sinh lại đồng bộ (lỗi thì trả bản cũ nếu có)
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[ProfileKey], Dict[str, Any]] = generate_suggestion,
+        ttl: float = EXERCISE_CACHE_TTL,
+        refresh_after: float = EXERCISE_CACHE_REFRESH,
+    ):
+        self.generate = generate
+        self.ttl = ttl
+        self.refresh_after = min(refresh_after, ttl)
+        self._entries: Dict[ProfileKey, Tuple[float, Dict[str, Any]]] = {}  # key -> (generated_at, suggestion)
+        self._lock = threading.Lock()
+        self._inflight = SingleFlight("exercise_suggestions")
+        self._refreshing = set()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def get(self, key: ProfileKey) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            age = now - entry[0]
+            if age < self.refresh_after:
+                self.hits += 1
+                return dict(entry[1])
+            if age < self.ttl:
+                self.stale_hits += 1
+                self._refresh_in_background(key)
+                return dict(entry[1])
+
+        self.misses += 1
+        try:
+            return dict(self._inflight.do(key, lambda: self._generate_and_store(key)))
+        except Exception:
+            if entry is not None:
+                # Gemini lỗi → bản đã hết hạn vẫn tốt hơn không có gì
+                return dict(entry[1])
+            raise
+
+    def _generate_and_store(self, key: ProfileKey) -> Dict[str, Any]:
+        try:
+            suggestion = self.generate(key)
+        except Exception:
+            self.errors += 1
+            raise
+        with self._lock:
+            self._entries[key] = (time.time(), suggestion)
+        return suggestion
+
+    def _refresh_in_background(self, key: ProfileKey) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self._inflight.do(key, lambda: self._generate_and_store(key))
+                self.refreshes += 1
+            except Exception as e:
+                print(f"⚠️ Không làm mới được gợi ý tập luyện {key_to_str(key)}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name="exercise-refresh", daemon=True).start()
+
+    def needs_generation(self, key: ProfileKey) -> bool:
+        """Chưa có hoặc đã quá hạn mềm (dùng khi sinh trước)."""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is None or time.time() - entry[0] >= self.refresh_after
+
+    def refresh(self, key: ProfileKey) -> Dict[str, Any]:
+        return self._generate_and_store(key)
+
+    # ========================
+    # FILE (sinh trước offline)
+    # ========================
+    def load(self, path: str) -> int:
+        """Nạp gợi ý đã sinh trước. Bỏ qua nếu file theo prompt cũ. Trả về số key đã nạp."""
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("prompt_version") != PROMPT_VERSION:
+            print(f"⚠️ {path} sinh theo prompt cũ, bỏ qua")
+            return 0
+        valid = set(all_profile_keys())
+        loaded = 0
+        with self._lock:
+            for key_str, entry in data.get("suggestions", {}).items():
+                key = tuple(key_str.split("|"))
+                if key in valid:
+                    self._entries[key] = (float(entry["generated_at"]), entry["suggestion"])
+                    loaded += 1
+        return loaded
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            suggestions = {
+                key_to_str(key): {"generated_at": generated_at, "suggestion": suggestion}
+                for key, (generated_at, suggestion) in sorted(self._entries.items())
+            }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"prompt_version": PROMPT_VERSION, "suggestions": suggestions}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "size": size,
+            "buckets": len(AGE_BANDS) * len(GIOI_TINH_LABELS) * len(MUC_VAN_DONG_LABELS) * len(BMI_CATEGORIES),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "hit_rate": round((self.hits + self.stale_hits) / total, 4) if total else 0.0,
+        }
+
+
+_cache: Optional[ExerciseSuggestionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_exercise_cache() -> ExerciseSuggestionCache:
+    """Cache dùng chung trong process (nạp EXERCISE_SUGGESTIONS_FILE lần đầu dùng)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExerciseSuggestionCache()
+            try:
+                loaded = _cache.load(EXERCISE_SUGGESTIONS_FILE)
+                if loaded:
+                    print(f"✅ Nạp {loaded} gợi ý tập luyện sinh trước từ {EXERCISE_SUGGESTIONS_FILE}")
+            except Exception as e:
+                print(f"⚠️ Không đọc được {EXERCISE_SUGGESTIONS_FILE}: {e}")
+        return _cache
+
+
+def get_exercise_suggestion(tuoi: int, gioiTinh: str, mucVanDong: str, bmi: float) -> Dict[str, Any]:
+    return get_exercise_cache().get(quantize_profile(tuoi, gioiTinh, mucVanDong, bmi))
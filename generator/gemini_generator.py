@@ -4,14 +4,30 @@ Nhanh hơn và không cần load model nặng
 """
 
 import os
+import hashlib
+import json
 import google.generativeai as genai
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Any, Dict, Optional
+from generator.prompt_builder import (
+    PROMPT_CONTEXT_TOKENS,
+    PROMPT_HISTORY_TOKENS,
+    PROMPT_QUESTION_TOKENS,
+    PromptSection,
+    build_prompt,
+    format_prompt_metrics,
+)
+from generator.instruction_cache import SystemInstructionCache, is_cache_unavailable
+from generator.json_stream import JSONSchemaError, StreamingJSONValidator
+from app.single_flight import SingleFlight
+from app.warmup import WARMUP_ANSWER, is_warming_up
 
 # API Key - có thể set qua biến môi trường GEMINI_API_KEY
 
 load_dotenv()
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+# Số lần thử lại khi JSON mode trả về JSON sai schema
+GEMINI_JSON_RETRIES = int(os.environ.get("GEMINI_JSON_RETRIES", "1"))
 
 # Khởi tạo Gemini client
 try:
@@ -59,17 +75,58 @@ def _get_model():
             raise
 
 
-def generate_answer(prompt: str, system_instruction: Optional[str] = None) -> str:
+# Cache system instruction cố định (explicit context caching của Gemini)
+_instruction_cache = SystemInstructionCache()
+# Gộp các request giống hệt nhau đang chạy đồng thời (vd cả lớp cùng hỏi "ăn gì để tăng cơ")
+_inflight_calls = SingleFlight(name="gemini_requests")
+
+
+def get_instruction_cache_stats():
+    """Hit/miss của cache system instruction và số token đọc từ cache."""
+    return _instruction_cache.stats()
+
+
+def get_coalescing_stats():
+    """Số lời gọi Gemini thực sự chạy và số lời gọi đã dùng chung kết quả."""
+    return _inflight_calls.stats()
+
+
+def generate_answer(
+    prompt: str,
+    system_instruction: Optional[str] = None,
+    coalesce: bool = False
+) -> str:
     """
     Sinh câu trả lời từ Gemini API
     
     Args:
         prompt: Câu hỏi hoặc prompt cần xử lý
         system_instruction: Hướng dẫn hệ thống (optional)
+        coalesce: Gộp các request giống hệt nhau (cùng model + instruction + prompt) đang chạy
+                  đồng thời thành 1 lời gọi Gemini. Chỉ bật cho prompt không phụ thuộc state
+                  (gợi ý bài tập, lượt đầu chưa có lịch sử)
     
     Returns:
         Câu trả lời từ Gemini
     """
+    if is_warming_up():
+        # Warm-up lúc khởi động (app/warmup.py): chạy hết pipeline nhưng không gọi Gemini
+        return WARMUP_ANSWER
+    if coalesce:
+        key = _prompt_key(prompt, system_instruction)
+        return _inflight_calls.do(key, lambda: _generate_answer(prompt, system_instruction))
+    return _generate_answer(prompt, system_instruction)
+
+
+def _prompt_key(prompt: str, system_instruction: Optional[str]) -> str:
+    """Hash của toàn bộ request (model + system instruction + prompt)."""
+    model_name = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+    payload = "\x00".join([model_name, system_instruction or "", prompt])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _generate_answer(prompt: str, system_instruction: Optional[str] = None) -> str:
+    """Gọi Gemini 1 lần (không gộp request)."""
     try:
         model = _get_model()
         
@@ -81,16 +138,34 @@ def generate_answer(prompt: str, system_instruction: Optional[str] = None) -> st
             max_output_tokens=2048 ,  #  số từ , dấu tối đa trong câu trả lời
         )
         
-        # Nếu có system instruction, thêm vào prompt
-        full_prompt = prompt
+        # Có system instruction → dùng model đã gắn sẵn instruction (cached content trên Gemini),
+        # không gửi lại nguyên văn instruction trong mỗi request
         if system_instruction:
-            full_prompt = f"{system_instruction}\n\n{prompt}"
-        
-        # Gọi API
-        response = model.generate_content(
-            full_prompt,
-            generation_config=generation_config
-        )
+            model_name = model.model_name
+            cached_model = _instruction_cache.get_model(model_name, system_instruction)
+            try:
+                response = cached_model.generate_content(
+                    prompt,
+                    generation_config=generation_config
+                )
+            except Exception as e:
+                # Chỉ khi cached content đã bị xóa/hết hạn phía server mới tạo lại 1 lần;
+                # lỗi quota/5xx thì không gọi thêm (và không tạo cache mới)
+                if not is_cache_unavailable(e):
+                    raise
+                print(f"⚠️ Cached instruction không còn trên Gemini: {e}, tạo lại")
+                _instruction_cache.invalidate(model_name, system_instruction, cached_model)
+                response = _instruction_cache.get_model(model_name, system_instruction).generate_content(
+                    prompt,
+                    generation_config=generation_config
+                )
+            _instruction_cache.record_usage(response)
+        else:
+            # Gọi API
+            response = model.generate_content(
+                prompt,
+                generation_config=generation_config
+            )
         
         # Lấy text từ response (xử lý nhiều format)
         if hasattr(response, 'text'):
@@ -131,6 +206,84 @@ def generate_answer(prompt: str, system_instruction: Optional[str] = None) -> st
         else:
             return f"⚠️ Lỗi khi xử lý: {error_msg[:100]}"
 
+
+def generate_json(
+    prompt: str,
+    schema: Dict[str, Any],
+    system_instruction: Optional[str] = None,
+    coalesce: bool = False,
+    retries: int = GEMINI_JSON_RETRIES,
+) -> Dict[str, Any]:
+    """
+    Sinh 1 object JSON theo schema (JSON mode của Gemini: response_mime_type + response_schema).
+
+    Response được stream qua StreamingJSONValidator: sai schema → ngắt stream ngay và thử lại
+    (tối đa `retries` lần), không đợi model sinh hết rồi mới parse.
+
+    Raises:
+        ValueError: Gemini lỗi hoặc vẫn sai schema sau khi đã thử lại
+    """
+    if coalesce:
+        key = _prompt_key(prompt, system_instruction) + ":json:" + json.dumps(schema, sort_keys=True)
+        return _inflight_calls.do(key, lambda: _generate_json(prompt, schema, system_instruction, retries))
+    return _generate_json(prompt, schema, system_instruction, retries)
+
+
+def _json_generation_config(schema: Dict[str, Any]):
+    options = dict(temperature=0.7, top_p=0.9, top_k=40, max_output_tokens=2048)
+    try:
+        return genai.types.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=schema,
+            **options,
+        )
+    except TypeError:
+        # SDK cũ chưa có JSON mode → vẫn stream + kiểm tra schema, dựa vào prompt để ra JSON
+        return genai.types.GenerationConfig(**options)
+
+
+def _generate_json(
+    prompt: str,
+    schema: Dict[str, Any],
+    system_instruction: Optional[str],
+    retries: int,
+) -> Dict[str, Any]:
+    try:
+        model = _get_model()
+        generation_config = _json_generation_config(schema)
+    except Exception as e:
+        raise ValueError(f"Không khởi tạo được Gemini: {e}") from e
+
+    last_error: Optional[Exception] = None
+    for attempt in range(max(0, retries) + 1):
+        validator = StreamingJSONValidator(schema)
+        target = model
+        try:
+            if system_instruction:
+                target = _instruction_cache.get_model(model.model_name, system_instruction)
+            response = target.generate_content(prompt, generation_config=generation_config, stream=True)
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue  # chunk không có text (vd chunk cuối chỉ có finish_reason)
+                validator.feed(text)
+            if system_instruction:
+                _instruction_cache.record_usage(response)
+            return validator.close()
+        except JSONSchemaError as e:
+            # Thoát vòng for → không đọc tiếp stream, phần còn lại của câu trả lời không được sinh ra
+            last_error = e
+            print(f"⚠️ Gemini trả JSON sai schema (lần {attempt + 1}, sau {len(validator.text)} ký tự): {e}")
+        except Exception as e:
+            last_error = e
+            print(f"❌ Lỗi khi gọi Gemini API (JSON mode): {e}")
+            if not (system_instruction and is_cache_unavailable(e)):
+                break  # quota/5xx: thử lại chỉ tốn thêm request
+            # Cached content bị xóa/hết hạn phía server → tạo lại rồi thử lần nữa
+            _instruction_cache.invalidate(model.model_name, system_instruction, target)
+    raise ValueError(f"Gemini không trả về JSON hợp lệ: {last_error}")
+
 # hàm tạo câu trả lời y tế với prompt tinh chỉnh
 def generate_medical_answer(
     context: str,  
@@ -138,7 +291,9 @@ def generate_medical_answer(
     intent: Optional[str] = None,
     conversation_history: Optional[str] = None,
     is_follow_up: bool = False,
-    use_rag_priority: bool = False
+    use_rag_priority: bool = False,
+    stage: Optional[str] = None,
+    coalesce: bool = False
 ) -> str:
     """
     Tạo câu trả lời y tế tối ưu với prompt được tinh chỉnh
@@ -150,6 +305,8 @@ def generate_medical_answer(
         conversation_history: Lịch sử cuộc trò chuyện trước đó (optional)
         is_follow_up: Có phải câu trả lời tiếp theo không (optional)
         use_rag_priority: Nếu True, ưu tiên sử dụng thông tin từ RAG (mức cao)
+        stage: Stage của pipeline (rag_high_confidence, gemini_fallback, ...) để thống kê kích thước prompt
+        coalesce: Gộp với request giống hệt đang chạy (chỉ dùng khi prompt không có lịch sử hội thoại)
     
     Returns:
         Câu trả lời y tế an toàn và chính xác
@@ -221,66 +378,103 @@ QUY TẮC QUAN TRỌNG:
 9. Luôn khuyến khích người dùng đi khám bác sĩ khi cần thiết hoặc triệu chứng nghiêm trọng
 10. QUAN TRỌNG: Nếu đây là câu trả lời tiếp theo trong cuộc trò chuyện, KHÔNG chào hỏi lại, trả lời trực tiếp và liền mạch với ngữ cảnh trước đó"""
     
-    # Xây dựng prompt với ngữ cảnh
-    prompt_parts = []
+    # Xây dựng prompt với ngữ cảnh (mỗi phần có ngân sách token riêng, xem generator/prompt_builder.py)
+    rule = "=" * 60
+    sections = []
     
     # Thêm lịch sử cuộc trò chuyện nếu có (format rõ ràng để Gemini hiểu ngữ cảnh)
+    # Vượt ngân sách → bỏ các lượt cũ nhất trước (giữ phần cuối)
     if conversation_history:
-        prompt_parts.append("=" * 60)
-        prompt_parts.append("LỊCH SỬ CUỘC TRÒ CHUYỆN TRƯỚC ĐÓ:")
-        prompt_parts.append("=" * 60)
-        prompt_parts.append(conversation_history)
-        prompt_parts.append("=" * 60)
-        prompt_parts.append("")  # Dòng trống để phân tách
+        sections.append(PromptSection(
+            "history",
+            conversation_history,
+            header="\n".join([rule, "LỊCH SỬ CUỘC TRÒ CHUYỆN TRƯỚC ĐÓ:", rule]),
+            footer=rule + "\n",  # Dòng trống để phân tách
+            max_tokens=PROMPT_HISTORY_TOKENS,
+            priority=0,
+            keep="tail",
+        ))
     
     # Thêm thông tin y tế (TÁCH BẠCH với user input)
+    # Vượt ngân sách → bỏ các [ĐOẠN] cuối (ít liên quan nhất) trước
     if use_rag_priority:
-        prompt_parts.append("=" * 60)
-        prompt_parts.append("KIẾN THỨC Y TẾ THAM KHẢO (RAG KNOWLEDGE):")
-        prompt_parts.append("=" * 60)
-        prompt_parts.append("⚠️ QUAN TRỌNG: Đây là KIẾN THỨC Y TẾ THAM KHẢO từ database, KHÔNG phải bệnh sử của người dùng.")
-        prompt_parts.append("Chỉ dùng để GIẢI THÍCH và HƯỚNG DẪN. KHÔNG được gán các triệu chứng/nhận định trong kiến thức này cho người dùng.")
-        prompt_parts.append("=" * 60)
-        prompt_parts.append(context)
-        prompt_parts.append("=" * 60)
-        prompt_parts.append("")
+        sections.append(PromptSection(
+            "context",
+            context,
+            header="\n".join([
+                rule,
+                "KIẾN THỨC Y TẾ THAM KHẢO (RAG KNOWLEDGE):",
+                rule,
+                "⚠️ QUAN TRỌNG: Đây là KIẾN THỨC Y TẾ THAM KHẢO từ database, KHÔNG phải bệnh sử của người dùng.",
+                "Chỉ dùng để GIẢI THÍCH và HƯỚNG DẪN. KHÔNG được gán các triệu chứng/nhận định trong kiến thức này cho người dùng.",
+                rule,
+            ]),
+            footer=rule + "\n",
+            max_tokens=PROMPT_CONTEXT_TOKENS,
+            priority=1,
+            separator="\n\n",
+        ))
     else:
         if context and context.strip() and context != "Không tìm thấy thông tin cụ thể trong database.":
-            prompt_parts.append("=" * 60)
-            prompt_parts.append("KIẾN THỨC Y TẾ THAM KHẢO (RAG KNOWLEDGE):")
-            prompt_parts.append("=" * 60)
-            prompt_parts.append("⚠️ QUAN TRỌNG: Đây là KIẾN THỨC Y TẾ THAM KHẢO, KHÔNG phải bệnh sử của người dùng.")
-            prompt_parts.append("=" * 60)
-            prompt_parts.append(context)
-            prompt_parts.append("=" * 60)
-            prompt_parts.append("")
+            sections.append(PromptSection(
+                "context",
+                context,
+                header="\n".join([
+                    rule,
+                    "KIẾN THỨC Y TẾ THAM KHẢO (RAG KNOWLEDGE):",
+                    rule,
+                    "⚠️ QUAN TRỌNG: Đây là KIẾN THỨC Y TẾ THAM KHẢO, KHÔNG phải bệnh sử của người dùng.",
+                    rule,
+                ]),
+                footer=rule + "\n",
+                max_tokens=PROMPT_CONTEXT_TOKENS,
+                priority=1,
+                separator="\n\n",
+            ))
         else:
-            prompt_parts.append("Không tìm thấy thông tin cụ thể trong database. Hãy trả lời dựa trên kiến thức y tế chung.\n")
+            sections.append(PromptSection(
+                "context",
+                "Không tìm thấy thông tin cụ thể trong database. Hãy trả lời dựa trên kiến thức y tế chung.\n",
+            ))
     
     # Thêm câu hỏi hiện tại (USER FACTS - chỉ những gì user nói trực tiếp)
-    prompt_parts.append("=" * 60)
     if is_follow_up:
-        prompt_parts.append("THÔNG TIN TỪ NGƯỜI DÙNG (USER FACTS - CHỈ NHỮNG GÌ HỌ NÓI TRỰC TIẾP):")
-        prompt_parts.append("=" * 60)
-        prompt_parts.append("⚠️ QUAN TRỌNG: CHỈ sử dụng những gì người dùng nói trong phần này. KHÔNG tự suy ra thêm.")
-        prompt_parts.append("=" * 60)
-        prompt_parts.append(user_question)
-        prompt_parts.append("=" * 60)
-        prompt_parts.append("")
-        prompt_parts.append("⚠️ Đây là câu hỏi tiếp theo trong cuộc trò chuyện. Hãy trả lời TRỰC TIẾP và LIỀN MẠCH với ngữ cảnh trước đó. KHÔNG chào hỏi lại, KHÔNG lặp lại câu hỏi đã hỏi, KHÔNG giới thiệu lại bản thân.")
-        prompt_parts.append("")
+        sections.append(PromptSection(
+            "question",
+            user_question,
+            header="\n".join([
+                rule,
+                "THÔNG TIN TỪ NGƯỜI DÙNG (USER FACTS - CHỈ NHỮNG GÌ HỌ NÓI TRỰC TIẾP):",
+                rule,
+                "⚠️ QUAN TRỌNG: CHỈ sử dụng những gì người dùng nói trong phần này. KHÔNG tự suy ra thêm.",
+                rule,
+            ]),
+            footer="\n".join([
+                rule,
+                "",
+                "⚠️ Đây là câu hỏi tiếp theo trong cuộc trò chuyện. Hãy trả lời TRỰC TIẾP và LIỀN MẠCH với ngữ cảnh trước đó. KHÔNG chào hỏi lại, KHÔNG lặp lại câu hỏi đã hỏi, KHÔNG giới thiệu lại bản thân.",
+                "",
+            ]),
+            max_tokens=PROMPT_QUESTION_TOKENS,
+        ))
     else:
-        prompt_parts.append("THÔNG TIN TỪ NGƯỜI DÙNG (USER FACTS - CHỈ NHỮNG GÌ HỌ NÓI TRỰC TIẾP):")
-        prompt_parts.append("=" * 60)
-        prompt_parts.append("⚠️ QUAN TRỌNG: CHỈ sử dụng những gì người dùng nói trong phần này. KHÔNG tự suy ra thêm triệu chứng hoặc nguyên nhân.")
-        prompt_parts.append("=" * 60)
-        prompt_parts.append(user_question)
-        prompt_parts.append("=" * 60)
-        prompt_parts.append("")
+        sections.append(PromptSection(
+            "question",
+            user_question,
+            header="\n".join([
+                rule,
+                "THÔNG TIN TỪ NGƯỜI DÙNG (USER FACTS - CHỈ NHỮNG GÌ HỌ NÓI TRỰC TIẾP):",
+                rule,
+                "⚠️ QUAN TRỌNG: CHỈ sử dụng những gì người dùng nói trong phần này. KHÔNG tự suy ra thêm triệu chứng hoặc nguyên nhân.",
+                rule,
+            ]),
+            footer=rule + "\n",
+            max_tokens=PROMPT_QUESTION_TOKENS,
+        ))
     
     # Thêm hướng dẫn trả lời (tự nhiên, chi tiết, TUYỆT ĐỐI không gán RAG cho user)
     if use_rag_priority:
-        prompt_parts.append("""Hãy trả lời một cách TỰ NHIÊN, CHÍNH XÁC và CHI TIẾT (Chất lượng cao):
+        answer_instruction = """Hãy trả lời một cách TỰ NHIÊN, CHÍNH XÁC và CHI TIẾT (Chất lượng cao):
 
 🔒 NGUYÊN TẮC BẮT BUỘC:
 
@@ -308,9 +502,9 @@ QUY TẮC QUAN TRỌNG:
    - ❌ Dùng markdown formatting (**, *, #)
    - ❌ Thêm thông tin không liên quan
 
-Trả lời:""")
+Trả lời:"""
     else:
-        prompt_parts.append("""Hãy trả lời một cách TỰ NHIÊN, CHÍNH XÁC và CHI TIẾT (Chất lượng cao):
+        answer_instruction = """Hãy trả lời một cách TỰ NHIÊN, CHÍNH XÁC và CHI TIẾT (Chất lượng cao):
 - Trả lời dựa trên kiến thức y tế chung, CHI TIẾT và ĐẦY ĐỦ (5-10 câu)
 - Giải thích rõ ràng về nguyên nhân, triệu chứng, cách xử lý, và lời khuyên khi phù hợp
 - CHỈ trả lời những gì liên quan trực tiếp đến câu hỏi của người dùng, nhưng có thể giải thích thêm nếu hữu ích
@@ -328,11 +522,14 @@ Trả lời:""")
 - Kết thúc bằng lời khuyên đi khám bác sĩ nếu triệu chứng nghiêm trọng hoặc kéo dài
 - Nếu là câu trả lời tiếp theo, trả lời trực tiếp, không chào hỏi lại
 
-Trả lời:""")
+Trả lời:"""
     
-    prompt = "\n".join(prompt_parts)
+    sections.append(PromptSection("instructions", answer_instruction))
+    
+    prompt, metrics = build_prompt(sections, system_instruction=system_instruction, stage=stage)
+    print(format_prompt_metrics(metrics))
     # dùng prompt để gọi Gemini trả về câu trả lời
-    return generate_answer(prompt, system_instruction=system_instruction)
+    return generate_answer(prompt, system_instruction=system_instruction, coalesce=coalesce)
 
 # Hàm tạo câu trả lời chào hỏi tự nhiên
 def generate_greeting(user_greeting: str) -> str:
@@ -346,6 +543,7 @@ Giới thiệu bạn là trợ lý y tế và sẵn sàng hỗ trợ.
 
 Trả lời:"""
     
+    # Instruction 1 câu: dưới mức token tối thiểu → _instruction_cache không tạo cached content cho nó
     system_instruction = "Bạn là trợ lý y tế thân thiện, chuyên nghiệp. Trả lời ngắn gọn, tự nhiên."
     
     return generate_answer(prompt, system_instruction=system_instruction)
@@ -0,0 +1,195 @@
+"""
+Cache system instruction cố định của Gemini (explicit context caching).
+
+generate_medical_answer chỉ dùng 2 system instruction lớn, không đổi giữa các lượt (RAG-priority và
+Gemini tự do). Thay vì gửi lại nguyên văn mỗi request, module này đăng ký mỗi instruction 1 lần
+bằng genai.caching.CachedContent rồi gọi model qua handle (GenerativeModel.from_cached_content)
+→ giảm input token tính phí và time-to-first-token.
+
+Cached content phải dài tối thiểu một số token tùy model (1024 với Flash, 4096 với 2.5 Pro): instruction
+ngắn hơn (ước lượng bằng app.token_counter) không gọi CachedContent.create (chắc chắn bị từ chối, tốn
+thêm 1 round-trip). Instruction hiện tại (~620-780 token) và lời chào đều dưới mức này → explicit caching
+chỉ có hiệu lực khi instruction đủ dài. Khi không cache được (quá ngắn, tạo thất bại do model không hỗ
+trợ, thiếu quyền, ...) instruction đó dùng GenerativeModel(system_instruction=...) tạo 1 lần và dùng lại:
+prefix vẫn cố định nên Gemini vẫn áp dụng implicit caching được.
+"""
+
+import datetime
+import hashlib
+import os
+import time
+from threading import Lock
+from typing import Any, Dict, Optional
+
+import google.generativeai as genai
+
+from app.single_flight import SingleFlight
+from app.token_counter import estimate_tokens
+
+# Bật/tắt explicit context caching (0 = chỉ dùng model có system_instruction)
+GEMINI_CONTEXT_CACHE = os.environ.get("GEMINI_CONTEXT_CACHE", "1").strip().lower() not in ("0", "false", "off")
+GEMINI_CONTEXT_CACHE_TTL = int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", "3600"))  # giây
+# Số token tối thiểu để tạo cached content; 0 = theo model (min_cache_tokens)
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "0"))
+# Làm mới cached content trước khi hết hạn một khoảng này để tránh gọi vào handle vừa hết hạn
+_REFRESH_MARGIN = 60
+
+
+def is_cache_unavailable(error: Exception) -> bool:
+    """
+    Lỗi do cached content không còn trên server (bị xóa/hết hạn), khác lỗi quota (429) hay 5xx:
+    chỉ lỗi này mới cần tạo lại cache. Gemini trả NotFound, hoặc PermissionDenied kèm
+    "CachedContent not found (or permission denied)".
+    """
+    if type(error).__name__ == "NotFound":
+        return True
+    message = str(error).lower()
+    return "cache" in message and any(word in message for word in ("not found", "expired", "does not exist"))
+
+
+def min_cache_tokens(model_name: str) -> int:
+    """Số token tối thiểu của cached content mà Gemini chấp nhận cho model."""
+    name = model_name.lower()
+    if "1.5" in name:
+        return 32768
+    if "pro" in name:
+        return 4096
+    return 1024
+
+
+class _CachedInstruction:
+    __slots__ = ("model", "cache", "expires_at")
+
+    def __init__(self, model, cache=None, expires_at: Optional[float] = None):
+        self.model = model
+        self.cache = cache  # CachedContent hoặc None (fallback system_instruction)
+        self.expires_at = expires_at
+
+
+class SystemInstructionCache:
+    """Giữ 1 GenerativeModel cho mỗi system instruction, ưu tiên qua cached content."""
+
+    def __init__(
+        self,
+        enabled: bool = GEMINI_CONTEXT_CACHE,
+        ttl: int = GEMINI_CONTEXT_CACHE_TTL,
+        min_tokens: int = GEMINI_CONTEXT_CACHE_MIN_TOKENS,
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self._entries: Dict[str, _CachedInstruction] = {}
+        self._lock = Lock()  # chỉ giữ khi đọc/ghi _entries, không giữ lúc gọi mạng
+        # Tạo cached content (1 round-trip mạng) ngoài lock, mỗi instruction chỉ 1 thread tạo
+        self._creating = SingleFlight(name="gemini_instruction_cache")
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.too_short = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    @staticmethod
+    def _key(model_name: str, system_instruction: str) -> str:
+        digest = hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()[:16]
+        return f"{model_name}:{digest}"
+
+    def get_model(self, model_name: str, system_instruction: str):
+        """Model đã gắn system instruction (qua cached content nếu được)."""
+        key = self._key(model_name, system_instruction)
+        with self._lock:
+            entry = self._entries.get(key)
+            if self._fresh(entry):
+                self.hits += 1
+                return entry.model
+            self.misses += 1
+        return self._creating.do(key, lambda: self._refresh(model_name, system_instruction, key)).model
+
+    @staticmethod
+    def _fresh(entry: Optional[_CachedInstruction]) -> bool:
+        return entry is not None and (entry.expires_at is None or entry.expires_at - _REFRESH_MARGIN > time.time())
+
+    def _refresh(self, model_name: str, system_instruction: str, key: str) -> _CachedInstruction:
+        with self._lock:
+            entry = self._entries.get(key)
+            if self._fresh(entry):
+                return entry  # thread khác vừa tạo xong
+        # Cache cũ sắp hết hạn (còn < _REFRESH_MARGIN) thì để tự hết hạn: request đang chạy có thể vẫn dùng nó
+        entry = self._create(model_name, system_instruction, key)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def _cacheable(self, model_name: str, system_instruction: str) -> bool:
+        if not self.enabled:
+            return False
+        minimum = self.min_tokens or min_cache_tokens(model_name)
+        if estimate_tokens(system_instruction) >= minimum:
+            return True
+        with self._lock:
+            self.too_short += 1
+        return False
+
+    def _create(self, model_name: str, system_instruction: str, key: str) -> _CachedInstruction:
+        if self._cacheable(model_name, system_instruction):
+            try:
+                cache = genai.caching.CachedContent.create(
+                    model=model_name if model_name.startswith("models/") else f"models/{model_name}",
+                    display_name=f"system-{key.split(':')[-1]}",
+                    system_instruction=system_instruction,
+                    ttl=datetime.timedelta(seconds=self.ttl),
+                )
+                print(f"✅ Đã cache system instruction trên Gemini: {cache.name} (ttl={self.ttl}s)")
+                return _CachedInstruction(
+                    genai.GenerativeModel.from_cached_content(cached_content=cache),
+                    cache=cache,
+                    expires_at=time.time() + self.ttl,
+                )
+            except Exception as e:
+                self.fallbacks += 1
+                print(f"⚠️ Không tạo được cached content ({e}), dùng system_instruction thường")
+        # Fallback: không hết hạn, tạo 1 lần cho mỗi instruction
+        return _CachedInstruction(genai.GenerativeModel(model_name, system_instruction=system_instruction))
+
+    def invalidate(self, model_name: str, system_instruction: str, model: Any = None) -> None:
+        """
+        Bỏ entry (cached content bị xóa/hết hạn phía server) để lần sau tạo lại, và xóa cached content
+        cũ trên server (nếu còn) để không bị tính phí lưu trữ tới hết TTL.
+
+        model: model vừa gọi lỗi; entry đã được thread khác thay bằng bản mới thì giữ nguyên.
+        """
+        key = self._key(model_name, system_instruction)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (model is not None and entry.model is not model):
+                return
+            del self._entries[key]
+        if entry.cache is not None:
+            try:
+                entry.cache.delete()
+            except Exception as e:
+                print(f"⚠️ Không xóa được cached content {getattr(entry.cache, 'name', '?')}: {e}")
+
+    def record_usage(self, response: Any) -> None:
+        """Cộng dồn số input token và số token đọc từ cache theo usage_metadata của response."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        with self._lock:
+            self.prompt_tokens += getattr(usage, "prompt_token_count", 0) or 0
+            self.cached_tokens += getattr(usage, "cached_content_token_count", 0) or 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "fallbacks": self.fallbacks,
+                "too_short": self.too_short,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+            }
@@ -0,0 +1,237 @@
+"""
+Kiểm tra JSON theo schema ngay trong lúc Gemini đang stream.
+
+Schema là tập con của JSON Schema / OpenAPI mà Gemini nhận làm response_schema:
+    {"type": "object", "properties": {...}, "required": [...]}, "array" + "items",
+    "string" / "number" / "integer" / "boolean".
+
+StreamingJSONValidator.feed() nhận từng đoạn text và báo lỗi ngay khi thấy:
+    - ký tự đầu tiên không phải "{" (model trả lời bằng text thay vì JSON); bỏ qua khoảng trắng
+      và 1 markdown fence ```json ... ``` bao quanh (SDK không có JSON mode hay trả kiểu này)
+    - giá trị sai kiểu (nhìn ký tự đầu của giá trị)
+    - phần tử mảng sai kiểu, thiếu field bắt buộc khi đóng object, text thừa sau JSON
+→ caller ngắt stream sớm, không tốn thêm token cho 1 câu trả lời chắc chắn bị bỏ.
+close() parse toàn bộ và kiểm tra lại đầy đủ. Cả 2 cách kiểm tra đều chấp nhận field ngoài schema
+(normalize_suggestion bỏ qua chúng).
+"""
+
+import json
+from typing import Any, Dict, List, Optional
+
+
+class JSONSchemaError(ValueError):
+    """JSON không khớp schema (hoặc không phải JSON)."""
+
+
+# Ký tự mở đầu giá trị → kiểu JSON
+_VALUE_START = {'"': "string", "{": "object", "[": "array", "t": "boolean", "f": "boolean", "n": "null"}
+_NUMBER_START = set("-0123456789")
+
+
+def _start_type(ch: str) -> Optional[str]:
+    if ch in _NUMBER_START:
+        return "number"
+    return _VALUE_START.get(ch)
+
+
+def _type_matches(schema_type: Optional[str], actual: str) -> bool:
+    if not schema_type:
+        return True
+    if actual == "null":
+        return False
+    if schema_type == "integer":
+        return actual == "number"
+    return schema_type == actual
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> None:
+    """Kiểm tra đầy đủ 1 giá trị đã parse. Sai → JSONSchemaError."""
+    schema_type = schema.get("type")
+    checks = {
+        "object": lambda v: isinstance(v, dict),
+        "array": lambda v: isinstance(v, list),
+        "string": lambda v: isinstance(v, str),
+        "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+        "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+        "boolean": lambda v: isinstance(v, bool),
+    }
+    if schema_type in checks and not checks[schema_type](value):
+        raise JSONSchemaError(f"{path}: cần kiểu {schema_type}, nhận {type(value).__name__}")
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        for name in schema.get("required", []):
+            if name not in value:
+                raise JSONSchemaError(f"{path}: thiếu field '{name}'")
+        for name, item in value.items():
+            if name in properties:
+                validate(item, properties[name], f"{path}.{name}")
+    elif schema_type == "array" and "items" in schema:
+        for i, item in enumerate(value):
+            validate(item, schema["items"], f"{path}[{i}]")
+
+
+class StreamingJSONValidator:
+    """
+    Kiểm tra tăng dần 1 object JSON theo schema (chỉ soi cấu trúc tầng ngoài cùng và phần tử của
+    các mảng tầng 1 — đủ để phát hiện sớm các lỗi hay gặp; phần còn lại kiểm tra ở close()).
+    """
+
+    def __init__(self, schema: Dict[str, Any]):
+        if schema.get("type") != "object":
+            raise ValueError("Schema tầng ngoài cùng phải là object")
+        self.schema = schema
+        self.properties: Dict[str, Dict[str, Any]] = schema.get("properties", {})
+        self._parts: List[str] = []
+        self._pos = 0
+        self._stack: List[str] = []  # các "{" / "[" đang mở
+        self._in_string = False
+        self._escape = False
+        self._key_chars: Optional[List[str]] = None  # đang đọc key tầng 1
+        self._key: Optional[str] = None  # key tầng 1 hiện tại
+        self._expect = "start"  # start | key | colon | value | scalar | comma | done
+        self._item_start = False  # ký tự tiếp theo ở tầng 2 là đầu 1 phần tử mảng
+        self._seen = set()
+        self._fenced = False  # response nằm trong markdown fence ```json
+        self._skip_line = False  # đang bỏ qua phần còn lại của dòng mở fence
+        self._closing_ticks = 0  # số dấu ` của fence đóng đã gặp
+        self._start = 0  # vị trí "{" mở đầu và sau "}" kết thúc JSON trong text
+        self._end = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def _fail(self, message: str) -> None:
+        raise JSONSchemaError(f"vị trí {self._pos}: {message}")
+
+    def feed(self, chunk: str) -> None:
+        self._parts.append(chunk)
+        for ch in chunk:
+            self._pos += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._end_key()
+                    continue
+                if self._key_chars is not None:
+                    self._key_chars.append(ch)
+                continue
+            if self._skip_line:
+                if ch == "\n":
+                    self._skip_line = False
+                    continue
+                if ch != "{":
+                    continue
+                self._skip_line = False
+            if ch.isspace():
+                continue
+            if self._expect == "done":
+                if self._fenced and ch == "`" and self._closing_ticks < 3:
+                    self._closing_ticks += 1
+                    continue
+                self._fail("có text thừa sau JSON")
+            if not self._stack:
+                if ch == "`" and not self._fenced:
+                    # ```json ở đầu response: bỏ qua tới hết dòng
+                    self._fenced = True
+                    self._skip_line = True
+                    continue
+                if ch != "{":
+                    self._fail("response không bắt đầu bằng '{'")
+                self._start = self._pos - 1
+                self._stack.append("{")
+                self._expect = "key"
+            elif len(self._stack) == 1:
+                self._feed_top(ch)
+            else:
+                self._feed_nested(ch)
+
+    def _end_key(self) -> None:
+        key = "".join(self._key_chars)
+        self._key_chars = None
+        self._key = key
+        self._seen.add(key)
+        self._expect = "colon"
+
+    def _feed_top(self, ch: str) -> None:
+        if self._expect == "key":
+            if ch == '"':
+                self._in_string = True
+                self._key_chars = []
+            elif ch == "}":
+                self._close_top()
+            else:
+                self._fail(f"cần key, gặp '{ch}'")
+        elif self._expect == "colon":
+            if ch != ":":
+                self._fail(f"cần ':', gặp '{ch}'")
+            self._expect = "value"
+        elif self._expect == "value":
+            actual = _start_type(ch)
+            if actual is None:
+                self._fail(f"giá trị không hợp lệ cho '{self._key}'")
+            expected = self.properties.get(self._key, {}).get("type")
+            if not _type_matches(expected, actual):
+                self._fail(f"'{self._key}' cần kiểu {expected}, nhận {actual}")
+            if ch == '"':
+                self._in_string = True
+                self._expect = "comma"
+            elif ch in "{[":
+                self._stack.append(ch)
+                self._item_start = ch == "["
+                self._expect = "comma"
+            else:
+                self._expect = "scalar"
+        elif self._expect == "scalar":
+            if ch == ",":
+                self._expect = "key"
+            elif ch == "}":
+                self._close_top()
+        elif ch == ",":  # expect == "comma"
+            self._expect = "key"
+        elif ch == "}":
+            self._close_top()
+        else:
+            self._fail(f"cần ',' hoặc '}}', gặp '{ch}'")
+
+    def _feed_nested(self, ch: str) -> None:
+        if self._item_start and len(self._stack) == 2 and ch != "]":
+            self._item_start = False
+            items = self.properties.get(self._key, {}).get("items", {})
+            actual = _start_type(ch)
+            if actual is None or not _type_matches(items.get("type"), actual):
+                self._fail(f"phần tử của '{self._key}' cần kiểu {items.get('type')}")
+        if ch == '"':
+            self._in_string = True
+        elif ch in "{[":
+            self._stack.append(ch)
+        elif ch in "}]":
+            opened = self._stack.pop()
+            if (opened == "{") != (ch == "}"):
+                self._fail(f"'{opened}' đóng bằng '{ch}'")
+        elif ch == "," and len(self._stack) == 2 and self._stack[-1] == "[":
+            self._item_start = True
+
+    def _close_top(self) -> None:
+        missing = [name for name in self.schema.get("required", []) if name not in self._seen]
+        if missing:
+            self._fail(f"thiếu field {', '.join(missing)}")
+        self._stack.pop()
+        self._end = self._pos
+        self._expect = "done"
+
+    def close(self) -> Dict[str, Any]:
+        """Kết thúc stream: parse + kiểm tra đầy đủ, trả về object."""
+        if self._expect != "done":
+            raise JSONSchemaError("JSON chưa kết thúc (response bị cắt?)")
+        try:
+            value = json.loads(self.text[self._start:self._end])
+        except json.JSONDecodeError as e:
+            raise JSONSchemaError(f"JSON không hợp lệ: {e}") from e
+        validate(value, self.schema)
+        return value
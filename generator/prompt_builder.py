@@ -0,0 +1,220 @@
+"""
+Ghép prompt cho Gemini theo ngân sách token.
+
+Prompt gồm nhiều phần (system instruction, lịch sử hội thoại, context RAG, câu hỏi, hướng dẫn trả lời).
+Mỗi phần có ngân sách riêng; nếu tổng vẫn vượt PROMPT_MAX_TOKENS thì cắt bớt các phần có
+priority thấp trước (lịch sử → context). Câu hỏi của người dùng và các phần hướng dẫn cố định
+không bao giờ bị cắt vì ảnh hưởng trực tiếp đến độ an toàn của câu trả lời.
+
+Mỗi lần build ghi lại kích thước từng phần theo stage (rag_high_confidence, gemini_fallback, ...)
+để theo dõi prompt size qua get_prompt_stats().
+"""
+
+import os
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.token_counter import estimate_tokens, truncate_to_tokens
+
+# Ngân sách token (ước lượng) cho toàn bộ prompt và cho từng phần có thể cắt
+PROMPT_MAX_TOKENS = int(os.environ.get("PROMPT_MAX_TOKENS", "3500"))
+PROMPT_HISTORY_TOKENS = int(os.environ.get("PROMPT_HISTORY_TOKENS", "700"))
+PROMPT_CONTEXT_TOKENS = int(os.environ.get("PROMPT_CONTEXT_TOKENS", "1200"))
+PROMPT_QUESTION_TOKENS = int(os.environ.get("PROMPT_QUESTION_TOKENS", "400"))
+
+TRUNCATION_MARKER = "…"
+
+
+class PromptSection:
+    """
+    Một phần của prompt.
+
+    - header/footer: khung cố định (tiêu đề, dòng ====), không bị cắt
+    - body: nội dung có thể cắt theo max_tokens
+    - priority: None = không cắt khi vượt tổng ngân sách; số nhỏ hơn bị cắt trước
+    - keep: "head" giữ phần đầu (context: đoạn liên quan nhất đứng trước),
+            "tail" giữ phần cuối (lịch sử: lượt gần nhất đứng sau)
+    - separator: ranh giới ưu tiên khi cắt (bỏ trọn khối thay vì cắt giữa câu)
+    """
+
+    __slots__ = ("name", "body", "header", "footer", "max_tokens", "priority", "keep", "separator")
+
+    def __init__(
+        self,
+        name: str,
+        body: str,
+        header: str = "",
+        footer: str = "",
+        max_tokens: Optional[int] = None,
+        priority: Optional[int] = None,
+        keep: str = "head",
+        separator: str = "\n",
+    ):
+        self.name = name
+        self.body = body or ""
+        self.header = header
+        self.footer = footer
+        self.max_tokens = max_tokens
+        self.priority = priority
+        self.keep = keep
+        self.separator = separator
+
+    def render(self) -> str:
+        # Body rỗng vẫn giữ 1 dòng trống giữa header và footer (giống prompt ghép tay trước đây)
+        parts = ([self.header] if self.header else []) + [self.body] + ([self.footer] if self.footer else [])
+        return "\n".join(parts)
+
+    def tokens(self) -> int:
+        return estimate_tokens(self.render())
+
+
+def _truncate_blocks(text: str, max_tokens: int, keep: str, separator: str) -> str:
+    """Cắt text theo khối (separator) cho vừa max_tokens; khối đầu/cuối quá dài thì cắt theo từ."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    blocks = text.split(separator)
+    if keep == "tail":
+        blocks = blocks[::-1]
+
+    kept: List[str] = []
+    for block in blocks:
+        candidate = kept + [block]
+        if estimate_tokens(separator.join(candidate + [TRUNCATION_MARKER])) > max_tokens:
+            break
+        kept = candidate
+
+    if not kept:
+        # Khối đầu tiên đã vượt ngân sách → cắt theo từ
+        if keep == "tail":
+            return TRUNCATION_MARKER + truncate_to_tokens(blocks[0][::-1], max_tokens, marker="")[::-1]
+        return truncate_to_tokens(blocks[0], max_tokens, marker=" " + TRUNCATION_MARKER)
+
+    if keep == "tail":
+        return separator.join([TRUNCATION_MARKER] + kept[::-1])
+    return separator.join(kept + [TRUNCATION_MARKER])
+
+
+def build_prompt(
+    sections: List[PromptSection],
+    system_instruction: str = "",
+    max_total_tokens: int = PROMPT_MAX_TOKENS,
+    stage: Optional[str] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Ghép các section thành prompt trong ngân sách.
+
+    Returns:
+        (prompt, metrics) với metrics = {
+            "stage", "budget", "total_tokens", "truncated": [tên section bị cắt],
+            "sections": {name: {"tokens": sau khi cắt, "original": trước khi cắt}}
+        }
+    """
+    original = {s.name: s.tokens() for s in sections}
+    truncated = []
+
+    # 1) Ngân sách riêng của từng phần
+    for s in sections:
+        if s.max_tokens is not None and s.body:
+            cut = _truncate_blocks(s.body, s.max_tokens, s.keep, s.separator)
+            if cut != s.body:
+                s.body = cut
+                truncated.append(s.name)
+
+    # 2) Tổng vượt ngân sách → cắt các phần priority thấp trước
+    system_tokens = estimate_tokens(system_instruction)
+    total = system_tokens + sum(s.tokens() for s in sections)
+    for s in sorted((s for s in sections if s.priority is not None), key=lambda s: s.priority):
+        overflow = total - max_total_tokens
+        if overflow <= 0:
+            break
+        body_tokens = estimate_tokens(s.body)
+        if body_tokens == 0:
+            continue
+        cut = _truncate_blocks(s.body, max(0, body_tokens - overflow), s.keep, s.separator)
+        if cut == s.body:
+            continue
+        s.body = cut
+        if s.name not in truncated:
+            truncated.append(s.name)
+        total = system_tokens + sum(s.tokens() for s in sections)
+
+    # Phần bị cắt hết nội dung → bỏ luôn header/footer; phần vốn rỗng (vd context RAG trống) giữ nguyên
+    kept_sections = [s for s in sections if s.body or s.name not in truncated]
+    prompt = "\n".join(s.render() for s in kept_sections)
+
+    metrics = {
+        "stage": stage or "unknown",
+        "budget": max_total_tokens,
+        "total_tokens": system_tokens + estimate_tokens(prompt),
+        "truncated": truncated,
+        "sections": {
+            "system": {"tokens": system_tokens, "original": system_tokens},
+            **{
+                s.name: {"tokens": s.tokens() if s in kept_sections else 0, "original": original[s.name]}
+                for s in sections
+            },
+        },
+    }
+    _prompt_stats.record(metrics)
+    return prompt, metrics
+
+
+class PromptStats:
+    """Thống kê kích thước prompt theo stage (thread-safe)."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, metrics: Dict[str, Any]) -> None:
+        with self._lock:
+            stage = self._stages.setdefault(
+                metrics["stage"],
+                {"count": 0, "total_tokens": 0, "max_tokens": 0, "truncated_count": 0, "section_tokens": {}},
+            )
+            stage["count"] += 1
+            stage["total_tokens"] += metrics["total_tokens"]
+            stage["max_tokens"] = max(stage["max_tokens"], metrics["total_tokens"])
+            if metrics["truncated"]:
+                stage["truncated_count"] += 1
+            for name, sizes in metrics["sections"].items():
+                stage["section_tokens"][name] = stage["section_tokens"].get(name, 0) + sizes["tokens"]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for name, stage in self._stages.items():
+                count = stage["count"] or 1
+                result[name] = {
+                    "count": stage["count"],
+                    "avg_tokens": round(stage["total_tokens"] / count, 1),
+                    "max_tokens": stage["max_tokens"],
+                    "truncated_rate": round(stage["truncated_count"] / count, 4),
+                    "avg_section_tokens": {
+                        section: round(tokens / count, 1) for section, tokens in stage["section_tokens"].items()
+                    },
+                }
+            return result
+
+
+_prompt_stats = PromptStats()
+
+
+def get_prompt_stats() -> Dict[str, Any]:
+    """Kích thước prompt trung bình/lớn nhất theo stage kể từ khi khởi động."""
+    return _prompt_stats.snapshot()
+
+
+def format_prompt_metrics(metrics: Dict[str, Any]) -> str:
+    """Một dòng log tóm tắt kích thước prompt."""
+    sections = ", ".join(
+        f"{name}={sizes['tokens']}" + (f"/{sizes['original']}" if sizes["tokens"] != sizes["original"] else "")
+        for name, sizes in metrics["sections"].items()
+    )
+    truncated = f" | cắt: {', '.join(metrics['truncated'])}" if metrics["truncated"] else ""
+    return (
+        f"📏 Prompt [{metrics['stage']}]: ~{metrics['total_tokens']}/{metrics['budget']} tokens "
+        f"({sections}){truncated}"
+    )
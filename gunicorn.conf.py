@@ -0,0 +1,21 @@
+# gunicorn.conf.py
+# Chạy nhiều worker dùng chung models (Linux):
+#   MODEL_PRELOAD=1 WEB_CONCURRENCY=4 gunicorn api_server:app -c gunicorn.conf.py
+# Master import api_server → load models + FAISS index 1 lần, rồi fork các worker (copy-on-write).
+# Xem bộ nhớ từng worker: python scripts/memory_report.py <pid master>
+
+import os
+
+from app.prefork import MODEL_PRELOAD, WEB_CONCURRENCY, configure_worker
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = WEB_CONCURRENCY
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = MODEL_PRELOAD
+# Load models trong master có thể mất vài phút; worker thì khởi động ngay
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+
+def post_fork(server, worker):
+    threads = configure_worker(workers)
+    server.log.info(f"Worker {worker.pid}: torch {threads} thread")
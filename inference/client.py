@@ -0,0 +1,144 @@
+# inference/client.py
+# Client mỏng cho inference service (inference/server.py), cùng interface với models chạy trong process:
+#   RemoteIntentClassifier.predict_topk(text, k)  ~ IntentClassifier.predict_topk
+#   RemoteEncoder.encode(sentences, ...)           ~ SentenceTransformer.encode (truyền vào Retriever(embedder=...))
+# Mỗi thread giữ 1 kết nối riêng (request/response tuần tự trên 1 kết nối); service restart → tự kết nối lại.
+
+import json
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from inference.protocol import HEADER_SIZE, decode_array, pack, parse_address, unpack_length
+
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", "10"))
+# Thời gian tối đa chờ service sẵn sàng khi API server khởi động (service có thể đang load models)
+INFERENCE_WAIT_SECONDS = float(os.environ.get("INFERENCE_WAIT_SECONDS", "300"))
+
+
+class InferenceError(RuntimeError):
+    """Inference service không trả lời được (mất kết nối, timeout, lỗi model)."""
+
+
+class InferenceClient:
+    def __init__(self, address: str, timeout: float = INFERENCE_TIMEOUT):
+        self.address = address
+        self.family, self._addr = parse_address(address)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.reconnects = 0
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self._addr)
+        except OSError:
+            sock.close()
+            raise
+        if self.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _close(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+        chunks = []
+        while size:
+            chunk = sock.recv(min(size, 1 << 20))
+            if not chunk:
+                raise ConnectionError("Inference service đóng kết nối")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def call(self, request: Dict[str, Any]) -> Any:
+        with self._stats_lock:
+            self.calls += 1
+        # Các op đều không có side effect → gửi lại an toàn 1 lần sau khi kết nối lại
+        for attempt in range(2):
+            sock = getattr(self._local, "sock", None)
+            try:
+                if sock is None:
+                    if attempt:
+                        with self._stats_lock:
+                            self.reconnects += 1
+                    sock = self._local.sock = self._connect()
+                sock.sendall(pack(request))
+                length = unpack_length(self._recv_exactly(sock, HEADER_SIZE))
+                response = json.loads(self._recv_exactly(sock, length))
+                break
+            except (OSError, ValueError) as e:
+                # Timeout/lỗi giữa chừng → stream lệch, bỏ kết nối này
+                self._close()
+                if attempt:
+                    raise InferenceError(f"Không gọi được inference service {self.address}: {e}") from e
+        if not response.get("ok"):
+            raise InferenceError(response.get("error") or "Inference service lỗi")
+        return response["result"]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"address": self.address, "calls": self.calls, "reconnects": self.reconnects}
+
+    def ping(self) -> Dict[str, Any]:
+        return self.call({"op": "ping"})
+
+    def wait_until_ready(self, timeout: float = INFERENCE_WAIT_SECONDS, interval: float = 1.0) -> Dict[str, Any]:
+        """Ping tới khi service trả lời (hoặc hết timeout → InferenceError)."""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return self.ping()
+            except InferenceError:
+                if time.time() >= deadline:
+                    raise
+                time.sleep(interval)
+
+
+_clients: Dict[str, InferenceClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(address: str) -> InferenceClient:
+    """Client dùng chung theo địa chỉ (classifier và encoder cùng dùng kết nối của thread)."""
+    with _clients_lock:
+        client = _clients.get(address)
+        if client is None:
+            client = _clients[address] = InferenceClient(address)
+        return client
+
+
+class RemoteIntentClassifier:
+    def __init__(self, address: str):
+        self.client = get_client(address)
+
+    def predict_topk(self, text, k=2) -> List[Tuple[str, float]]:
+        result = self.client.call({"op": "intent", "text": text, "k": k})
+        return [(label, conf) for label, conf in result]
+
+
+class RemoteEncoder:
+    def __init__(self, address: str):
+        self.client = get_client(address)
+
+    def encode(self, sentences, normalize_embeddings=False, **kwargs):
+        """Tương thích SentenceTransformer.encode (list câu → ndarray [n, dim]; 1 câu → [dim])."""
+        single = isinstance(sentences, str)
+        embs = decode_array(self.client.call({
+            "op": "encode",
+            "sentences": [sentences] if single else list(sentences),
+            "normalize": bool(normalize_embeddings),
+        }))
+        return embs[0] if single else embs
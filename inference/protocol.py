@@ -0,0 +1,61 @@
+# inference/protocol.py
+# Giao thức giữa chatbot (client) và inference service: mỗi message = 4 byte độ dài (big-endian) + JSON UTF-8.
+#   request:  {"op": "intent", "text": ..., "k": 2}
+#             {"op": "encode", "sentences": [...], "normalize": false}
+#             {"op": "ping"}
+#   response: {"ok": true, "result": ...} | {"ok": false, "error": "..."}
+# Embedding gửi dạng base64 của mảng float32 (nhỏ và nhanh hơn list số JSON).
+
+import base64
+import json
+import os
+import socket
+import struct
+from typing import Any, Dict, Tuple, Union
+
+import numpy as np
+
+_HEADER = struct.Struct(">I")
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+# "unix:/đường/dẫn.sock" hoặc "host:port"; rỗng = chạy models trong process như cũ
+INFERENCE_ADDRESS = os.environ.get("INFERENCE_ADDRESS", "").strip()
+
+Address = Union[str, Tuple[str, int]]
+
+
+def parse_address(address: str) -> Tuple[int, Address]:
+    """→ (socket family, address cho connect/bind)."""
+    if address.startswith("unix:"):
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Hệ điều hành không hỗ trợ Unix socket, dùng host:port")
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"INFERENCE_ADDRESS không hợp lệ: {address!r} (cần unix:/path hoặc host:port)")
+    return socket.AF_INET, (host, int(port))
+
+
+def pack(message: Dict[str, Any]) -> bytes:
+    body = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    return _HEADER.pack(len(body)) + body
+
+
+def unpack_length(header: bytes) -> int:
+    (length,) = _HEADER.unpack(header)
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Message quá lớn: {length} byte")
+    return length
+
+
+HEADER_SIZE = _HEADER.size
+
+
+def encode_array(array: np.ndarray) -> Dict[str, Any]:
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def decode_array(payload: Dict[str, Any]) -> np.ndarray:
+    data = base64.b64decode(payload["data"])
+    return np.frombuffer(data, dtype=np.float32).reshape(payload["shape"]).copy()
@@ -0,0 +1,265 @@
+"""
+Inference service: chạy IntentClassifier + SBERT encoder ở 1 process riêng, API server gọi qua
+Unix socket / localhost (inference/client.py) → scale API worker và model worker độc lập.
+
+Request của mọi API worker được gộp thành batch (micro-batching): batch đầu tiên chạy ngay,
+các request đến trong lúc model đang bận (hoặc trong INFERENCE_BATCH_WAIT_MS) vào batch sau,
+tối đa INFERENCE_MAX_BATCH câu / lần forward.
+
+Chạy:
+    python -m inference.server --address unix:/tmp/healthyai-inference.sock
+rồi đặt INFERENCE_ADDRESS=unix:/tmp/healthyai-inference.sock cho API server.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from inference.protocol import (
+    HEADER_SIZE,
+    INFERENCE_ADDRESS,
+    encode_array,
+    pack,
+    parse_address,
+    unpack_length,
+)
+
+INFERENCE_MAX_BATCH = int(os.environ.get("INFERENCE_MAX_BATCH", "32"))
+INFERENCE_BATCH_WAIT_MS = float(os.environ.get("INFERENCE_BATCH_WAIT_MS", "2"))
+# Số thread torch của service; 0 = mặc định của torch (số core)
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "0"))
+DEFAULT_ADDRESS = "unix:/tmp/healthyai-inference.sock"
+
+EncodeFn = Callable[[List[str], bool], np.ndarray]
+
+
+class MicroBatcher:
+    """Gom các item submit() đồng thời thành 1 lần gọi run_batch(items) trên thread model."""
+
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], executor, max_batch: int, wait_ms: float):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch = max(1, max_batch)
+        self.wait = max(0.0, wait_ms) / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self.batches = 0
+        self.items = 0
+
+    def _get_queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def submit(self, item: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        await self._get_queue().put((item, future))
+        return await future
+
+    async def run(self) -> None:
+        self._get_queue()
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.wait
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await loop.run_in_executor(self.executor, self.run_batch, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+class InferenceServer:
+    def __init__(
+        self,
+        classifier,
+        encode: EncodeFn,
+        max_batch: int = INFERENCE_MAX_BATCH,
+        wait_ms: float = INFERENCE_BATCH_WAIT_MS,
+    ):
+        self.classifier = classifier
+        self.encode_fn = encode
+        # 1 thread chạy model: intent và encode không tranh nhau core (torch tự dùng nhiều thread bên trong)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference-model")
+        self.intent = MicroBatcher(self._run_intent, self._executor, max_batch, wait_ms)
+        self.encode = MicroBatcher(self._run_encode, self._executor, max_batch, wait_ms)
+        self._connections = set()  # task xử lý từng kết nối, hủy khi dừng service
+        self.started_at = time.time()
+        self.requests = 0
+        self.errors = 0
+
+    # ========================
+    # BATCH
+    # ========================
+    def _run_intent(self, items: List[Tuple[str, int]]) -> List[List[Tuple[str, float]]]:
+        k = max(k for _, k in items)
+        results = self.classifier.predict_topk_batch([text for text, _ in items], k=k)
+        return [result[:item_k] for result, (_, item_k) in zip(results, items)]
+
+    def _run_encode(self, items: List[Tuple[List[str], bool]]) -> List[np.ndarray]:
+        outputs: List[Optional[np.ndarray]] = [None] * len(items)
+        for normalize in (False, True):
+            group = [i for i, (_, norm) in enumerate(items) if norm == normalize]
+            if not group:
+                continue
+            sentences = [s for i in group for s in items[i][0]]
+            embs = np.asarray(self.encode_fn(sentences, normalize), dtype=np.float32)
+            start = 0
+            for i in group:
+                count = len(items[i][0])
+                outputs[i] = embs[start:start + count]
+                start += count
+        return outputs
+
+    # ========================
+    # KẾT NỐI
+    # ========================
+    async def _dispatch(self, request: Dict[str, Any]) -> Any:
+        op = request.get("op")
+        if op == "intent":
+            result = await self.intent.submit((str(request["text"]), int(request.get("k", 2))))
+            return [[label, float(conf)] for label, conf in result]
+        if op == "encode":
+            sentences = [str(s) for s in request.get("sentences", [])]
+            if not sentences:
+                return encode_array(np.zeros((0, 0), dtype=np.float32))
+            embs = await self.encode.submit((sentences, bool(request.get("normalize", False))))
+            return encode_array(embs)
+        if op == "ping":
+            return {"pid": os.getpid(), "stats": self.stats()}
+        raise ValueError(f"op không hỗ trợ: {op!r}")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(HEADER_SIZE)
+                except asyncio.IncompleteReadError:
+                    return  # client đóng kết nối
+                request = json.loads(await reader.readexactly(unpack_length(header)))
+                self.requests += 1
+                try:
+                    response = {"ok": True, "result": await self._dispatch(request)}
+                except Exception as e:
+                    self.errors += 1
+                    response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                writer.write(pack(response))
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            print(f"⚠️ [inference] Đóng kết nối lỗi: {e}")
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def serve(self, address: str, ready: Optional[asyncio.Event] = None) -> None:
+        family, addr = parse_address(address)
+        tasks = [asyncio.create_task(self.intent.run()), asyncio.create_task(self.encode.run())]
+        if family == getattr(socket, "AF_UNIX", None):
+            if os.path.exists(addr):
+                os.unlink(addr)  # socket cũ của lần chạy trước
+            server = await asyncio.start_unix_server(self.handle, path=addr)
+        else:
+            server = await asyncio.start_server(self.handle, host=addr[0], port=addr[1])
+        print(f"✅ Inference service đang nghe tại {address} (batch ≤ {self.intent.max_batch})")
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # Server đóng không tự đóng các kết nối đang mở → hủy handler + batcher rồi chờ chúng thoát
+            tasks += list(self._connections)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if isinstance(addr, str) and os.path.exists(addr):
+                os.unlink(addr)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "uptime": round(time.time() - self.started_at, 1),
+            "requests": self.requests,
+            "errors": self.errors,
+            "intent": self.intent.stats(),
+            "encode": self.encode.stats(),
+        }
+
+
+def load_models() -> Tuple[Any, EncodeFn]:
+    """Load intent classifier + encoder theo INTENT_BACKEND (giống chatbot khi chạy models trong process)."""
+    from chatbot import INTENT_BACKEND, create_local_intent_classifier
+
+    classifier = create_local_intent_classifier()
+    if INTENT_BACKEND == "shared_sbert":
+        # Encoder dùng chung với intent head, có cache theo câu: RAG của cùng 1 lượt không encode lại
+        return classifier, lambda sentences, normalize: classifier.embed_batch(sentences)
+
+    from sentence_transformers import SentenceTransformer
+    from app.settings import EMBEDDING_MODEL
+
+    print(f"🔄 Đang load model embedding {EMBEDDING_MODEL}...")
+    model = SentenceTransformer(EMBEDDING_MODEL)
+
+    def encode(sentences: List[str], normalize: bool) -> np.ndarray:
+        return model.encode(
+            sentences, batch_size=len(sentences), convert_to_numpy=True, normalize_embeddings=normalize
+        )
+
+    return classifier, encode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference service (intent + SBERT) cho chatbot")
+    parser.add_argument("--address", default=INFERENCE_ADDRESS or DEFAULT_ADDRESS)
+    parser.add_argument("--max-batch", type=int, default=INFERENCE_MAX_BATCH)
+    parser.add_argument("--wait-ms", type=float, default=INFERENCE_BATCH_WAIT_MS)
+    parser.add_argument("--threads", type=int, default=INFERENCE_THREADS, help="số thread torch (0 = mặc định)")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        import torch
+        torch.set_num_threads(args.threads)
+
+    classifier, encode = load_models()
+    server = InferenceServer(classifier, encode, args.max_batch, args.wait_ms)
+    try:
+        asyncio.run(server.serve(args.address))
+    except KeyboardInterrupt:
+        print("👋 Inference service đã dừng")
+
+
+if __name__ == "__main__":
+    main()
@@ -140,3 +140,23 @@ class IntentClassifier:
             result.append((label, conf))
         
         return result
+
+    def predict_topk_batch(self, texts, k=2):
+        """
+        Như predict_topk nhưng cho nhiều câu trong 1 forward pass (padding theo câu dài nhất).
+        Dùng trong inference service (inference/server.py) để gộp request của nhiều API worker.
+
+        Returns:
+            list: mỗi câu 1 list [(intent_label, confidence), ...]
+        """
+        inputs = self.tokenizer(texts, return_tensors="pt", truncation=True, padding=True).to(self.model.device)
+        with torch.no_grad():
+            probs = F.softmax(self.model(**inputs).logits, dim=1)
+        top_confs, top_ids = torch.topk(probs, k=min(k, len(self.model.config.id2label)), dim=1)
+        return [
+            [
+                (self.model.config.id2label.get(pred_id, "unknown"), conf)
+                for pred_id, conf in zip(ids, confs)
+            ]
+            for ids, confs in zip(top_ids.tolist(), top_confs.tolist())
+        ]
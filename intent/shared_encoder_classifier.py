@@ -0,0 +1,176 @@
+from collections import OrderedDict
+from threading import Event, Lock
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from sentence_transformers import SentenceTransformer
+
+"""
+Module này chứa SharedEncoderIntentClassifier: phân loại intent bằng chính encoder SBERT
+mà Retriever dùng cho FAISS, cộng thêm một "intent head" nhỏ (Linear) phía trên.
+
+So với kiến trúc 2 model (PhoBERT cho intent + vietnamese-sbert cho RAG):
+- Mỗi lượt chỉ chạy 1 forward pass transformer: embedding câu dùng cho cả intent lẫn FAISS
+- Mỗi worker chỉ giữ 1 transformer trong RAM
+- Không gian vector của RAG không đổi (vẫn là vietnamese-sbert) → index FAISS cũ dùng lại được
+
+Head được train bằng train/train.py với TRAIN_MODE=shared_sbert.
+"""
+
+DEFAULT_SHARED_ENCODER = "keepitreal/vietnamese-sbert"
+
+
+def build_intent_head(dim, num_labels, hidden_dim=0, dropout=0.1):
+    """
+    Tạo intent head nhẹ đặt trên sentence embedding (đã chuẩn hoá L2).
+
+    hidden_dim = 0 → 1 lớp Linear (logistic regression)
+    hidden_dim > 0 → Linear → GELU → Linear
+    """
+    if hidden_dim and hidden_dim > 0:
+        return torch.nn.Sequential(
+            torch.nn.Dropout(dropout),
+            torch.nn.Linear(dim, hidden_dim),
+            torch.nn.GELU(),
+            torch.nn.Dropout(dropout),
+            torch.nn.Linear(hidden_dim, num_labels),
+        )
+    return torch.nn.Sequential(
+        torch.nn.Dropout(dropout),
+        torch.nn.Linear(dim, num_labels),
+    )
+
+
+class SharedEncoderIntentClassifier:
+    """
+    Phân loại intent + cung cấp embedding cho Retriever từ cùng 1 encoder.
+
+    - predict_topk(text, k): cùng interface với IntentClassifier
+    - encode(sentences, ...): cùng interface với SentenceTransformer.encode để truyền
+      thẳng vào Retriever(embedder=...)
+
+    Embedding của các câu gần nhất được cache (và chống tính trùng khi 2 thread cùng hỏi
+    1 câu, ví dụ speculative retrieval chạy song song với predict_topk) → intent và RAG
+    của cùng 1 lượt chỉ tốn 1 forward pass.
+    """
+
+    def __init__(self, head_path, encoder=None, cache_size=64):
+        """
+        Args:
+            head_path (str): File .pt do train/train.py (TRAIN_MODE=shared_sbert) lưu, gồm:
+                             state_dict, id2label, encoder, dim, hidden_dim
+            encoder (SentenceTransformer | str, optional): encoder đã load sẵn hoặc tên/đường dẫn.
+                             Mặc định dùng encoder ghi trong file head.
+            cache_size (int): số câu giữ embedding trong cache
+        """
+        print("🔄 Loading shared encoder intent head...")
+        checkpoint = torch.load(head_path, map_location="cpu")
+
+        encoder = encoder or checkpoint.get("encoder") or DEFAULT_SHARED_ENCODER
+        if isinstance(encoder, str):
+            print(f"🔄 Đang load shared encoder: {encoder}")
+            encoder = SentenceTransformer(encoder)
+        self.encoder = encoder
+
+        # id2label lưu dạng {id: label}; key có thể bị đổi sang str khi serialize
+        self.id2label = {int(i): label for i, label in checkpoint["id2label"].items()}
+        self.head = build_intent_head(
+            checkpoint["dim"],
+            len(self.id2label),
+            hidden_dim=checkpoint.get("hidden_dim", 0),
+        )
+        self.head.load_state_dict(checkpoint["state_dict"])
+        self.head.eval()
+
+        self._cache_size = cache_size
+        self._cache = OrderedDict()  # text -> embedding (float32, đã chuẩn hoá L2)
+        self._inflight = {}  # text -> Event, câu đang được encode ở thread khác
+        self._lock = Lock()
+        print(f"📋 Intent classes từ shared head: {self.id2label}")
+
+    # ========================
+    # Embedding (dùng chung cho intent + RAG)
+    # ========================
+    def _embed_one(self, text):
+        """Embedding đã chuẩn hoá của 1 câu, có cache + single-flight."""
+        while True:
+            with self._lock:
+                if text in self._cache:
+                    self._cache.move_to_end(text)
+                    return self._cache[text]
+                waiter = self._inflight.get(text)
+                if waiter is None:
+                    waiter = self._inflight[text] = Event()
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                # Thread khác đang encode đúng câu này → chờ rồi đọc cache
+                waiter.wait()
+                continue
+            try:
+                emb = self.encoder.encode(
+                    [text], convert_to_numpy=True, normalize_embeddings=True
+                )[0].astype("float32")
+                with self._lock:
+                    self._cache[text] = emb
+                    if len(self._cache) > self._cache_size:
+                        self._cache.popitem(last=False)
+                return emb
+            finally:
+                with self._lock:
+                    self._inflight.pop(text, None)
+                waiter.set()
+
+    def embed_batch(self, texts):
+        """Embedding (đã chuẩn hoá) của nhiều câu: các câu chưa có trong cache được encode chung 1 batch."""
+        with self._lock:
+            cached = {t: self._cache[t] for t in texts if t in self._cache}
+        missing = list(dict.fromkeys(t for t in texts if t not in cached))
+        if missing:
+            embs = self.encoder.encode(missing, convert_to_numpy=True, normalize_embeddings=True).astype("float32")
+            with self._lock:
+                for text, emb in zip(missing, embs):
+                    cached[text] = self._cache[text] = emb
+                    if len(self._cache) > self._cache_size:
+                        self._cache.popitem(last=False)
+        return np.stack([cached[t] for t in texts])
+
+    def encode(self, sentences, **kwargs):
+        """Tương thích SentenceTransformer.encode (list câu → ndarray [n, dim])."""
+        if isinstance(sentences, str):
+            return self._embed_one(sentences).copy()
+        return np.stack([self._embed_one(s) for s in sentences]).copy()
+
+    # ========================
+    # Dự đoán Top-K intent
+    # ========================
+    def predict_topk(self, text, k=2):
+        """
+        Dự đoán K intent có xác suất cao nhất (cùng format với IntentClassifier.predict_topk).
+
+        Returns:
+            list: [(intent_label, confidence), ...] sắp xếp theo confidence giảm dần
+        """
+        emb = torch.from_numpy(self._embed_one(text)).unsqueeze(0)
+        with torch.no_grad():
+            probs = F.softmax(self.head(emb), dim=1)
+        top_confs, top_ids = torch.topk(probs, k=min(k, len(self.id2label)), dim=1)
+
+        result = []
+        for i in range(top_confs.shape[1]):
+            label = self.id2label.get(top_ids[0, i].item(), "unknown")
+            result.append((label, top_confs[0, i].item()))
+        return result
+
+    def predict_topk_batch(self, texts, k=2):
+        """predict_topk cho nhiều câu: 1 lần encode các câu chưa có trong cache + 1 lần chạy head."""
+        embs = torch.from_numpy(self.embed_batch(texts))
+        with torch.no_grad():
+            probs = F.softmax(self.head(embs), dim=1)
+        top_confs, top_ids = torch.topk(probs, k=min(k, len(self.id2label)), dim=1)
+        return [
+            [(self.id2label.get(pred_id, "unknown"), conf) for pred_id, conf in zip(ids, confs)]
+            for ids, confs in zip(top_ids.tolist(), top_confs.tolist())
+        ]
@@ -1,5 +1,7 @@
 import os
 
+from app.settings import DATA_DIR
+
 def load_documents(folder):
     """
     Đọc toàn bộ file .txt trong thư mục data và trả về danh sách các đoạn văn.
@@ -21,6 +23,6 @@ def load_documents(folder):
 
 
 if __name__ == "__main__":
-    folder = r"D:\CHAT BOT TTCS\data"
+    folder = DATA_DIR
     docs = load_documents(folder)
     print("Tổng số đoạn tìm thấy:", len(docs))
@@ -2,6 +2,11 @@
 Scheduled task để kiểm tra và gửi thông báo nhắc nhở uống thuốc
 Chạy định kỳ mỗi phút: python medicine_reminder_scheduler.py
 Hoặc dùng cron/scheduler để chạy tự động
+
+Lưu ý: mặc định API server đã tự chạy scheduler trong process (REMINDER_SCHEDULER=inprocess,
+xem reminders/scheduler.py). Script này chỉ cần khi đặt REMINDER_SCHEDULER=external;
+nếu vẫn gọi khi scheduler trong process đang chạy, /check đọc các reminder đã đến hạn trong Firestore
+(kể cả reminder web app tạo thẳng) và gửi qua cùng scheduler đó.
 """
 
 import requests
@@ -0,0 +1,91 @@
+import numpy as np # Thư viện xử lý mảng số học
+from app.token_counter import estimate_tokens # ước lượng token cho ngân sách context
+
+"""
+Chọn đoạn RAG đưa vào prompt theo MMR (Maximal Marginal Relevance).
+
+Dữ liệu trong data/*.txt có nhiều đoạn gần như diễn đạt lại nhau, nên top-k theo cosine
+thường chứa nội dung trùng lặp. MMR chọn lần lượt đoạn có điểm
+    λ * liên_quan(câu hỏi) - (1 - λ) * giống_nhất(các đoạn đã chọn)
+và bỏ hẳn các đoạn gần trùng (cosine giữa 2 đoạn >= dedup_threshold), trong giới hạn
+số đoạn và ngân sách token → cùng ngân sách nhưng nhiều thông tin khác nhau hơn.
+"""
+
+
+def select_context(
+    docs,
+    vectors=None,
+    max_docs=5,
+    token_budget=None,
+    mmr_lambda=0.7,
+    dedup_threshold=0.95,
+):
+    """
+    Chọn tối đa max_docs đoạn từ docs (đã sắp theo độ liên quan giảm dần).
+
+    Args:
+        docs (list[dict]): kết quả Retriever, mỗi dict có "text" và "cosine"
+        vectors (np.ndarray | None): vector đã chuẩn hoá của từng doc (cùng thứ tự).
+                                     None → chỉ lọc trùng text tuyệt đối + ngân sách token
+        max_docs (int): số đoạn tối đa
+        token_budget (int | None): tổng token tối đa của các đoạn được chọn
+        mmr_lambda (float): 1.0 = chỉ xét liên quan, 0.0 = chỉ xét đa dạng
+        dedup_threshold (float): cosine giữa 2 đoạn >= ngưỡng này coi như trùng
+
+    Returns:
+        list[dict]: các doc được chọn, theo thứ tự được chọn
+    """
+    if not docs or max_docs <= 0:
+        return []
+
+    relevance = np.array([d.get("cosine", 0.0) for d in docs], dtype="float32")
+    similarity = None
+    if vectors is not None and len(vectors) == len(docs):
+        vectors = np.asarray(vectors, dtype="float32")
+        similarity = vectors @ vectors.T
+
+    remaining = list(range(len(docs)))
+    selected = []
+    seen_texts = set()
+    used_tokens = 0
+
+    while remaining and len(selected) < max_docs:
+        # Điểm MMR của các ứng viên còn lại
+        if similarity is not None and selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining), dtype="float32")
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+
+        picked = None
+        for pos in np.argsort(-scores, kind="stable"):
+            idx = remaining[pos]
+            text = docs[idx].get("text", "")
+            # Gần trùng với đoạn đã chọn → bỏ hẳn
+            if text in seen_texts or (selected and redundancy[pos] >= dedup_threshold):
+                remaining.remove(idx)
+                break
+            # Vượt ngân sách token → thử đoạn khác (đoạn đầu tiên luôn được giữ)
+            tokens = estimate_tokens(text)
+            if token_budget is not None and selected and used_tokens + tokens > token_budget:
+                continue
+            picked = idx
+            used_tokens += tokens
+            break
+        else:
+            # Không còn đoạn nào vừa ngân sách
+            break
+
+        if picked is not None:
+            selected.append(picked)
+            seen_texts.add(docs[picked].get("text", ""))
+            remaining.remove(picked)
+
+    return [docs[i] for i in selected]
+
+
+def format_context(docs):
+    """Ghép các đoạn đã chọn thành context cho prompt."""
+    return "\n\n".join(
+        f"[ĐOẠN {i}]\n" + d.get("text", "") for i, d in enumerate(docs, start=1)
+    )
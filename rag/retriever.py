@@ -1,22 +1,55 @@
-import faiss  # Thư viện FAISS để xử lý vector search
 import pickle # Để load các document đã được lưu trữ
 import numpy as np # Thư viện xử lý mảng số học
 import os  
-from sentence_transformers import SentenceTransformer # Mô hình embedding câu
+from threading import Lock # tránh 2 thread cùng lazy-load 1 index
+from app.settings import EMBEDDING_MODEL, EMBEDDINGS_DIR # đường dẫn index + model embedding dùng chung
+from app.ttl_cache import TTLCache # cache kết quả search cho các câu hỏi lặp lại
+# faiss và sentence_transformers import khi cần (load index / load model): import module này không kéo theo torch
+
+# Cache kết quả search theo (intent, câu truy vấn đã chuẩn hoá, k). 0 = tắt cache
+RAG_RESULT_CACHE_SIZE = int(os.environ.get("RAG_RESULT_CACHE_SIZE", "1024"))
+RAG_RESULT_CACHE_TTL = float(os.environ.get("RAG_RESULT_CACHE_TTL", "600"))  # giây
+# Đọc FAISS index bằng mmap: trang index là trang của file → mọi process (worker) dùng chung
+RAG_INDEX_MMAP = os.environ.get("RAG_INDEX_MMAP", "1") == "1"
+
+
+def _read_index(index_path):
+    import faiss  # Thư viện FAISS để xử lý vector search
+
+    if RAG_INDEX_MMAP:
+        # IO_FLAG_MMAP_IFC (faiss >= 1.8): mmap cả vector của IndexFlat; bản cũ chỉ có IO_FLAG_MMAP
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) or faiss.IO_FLAG_MMAP
+        try:
+            return faiss.read_index(index_path, flags | faiss.IO_FLAG_READ_ONLY)
+        except Exception as e:
+            print(f"⚠️ Không mmap được {index_path} ({e}), đọc vào RAM")
+    return faiss.read_index(index_path)
 
 class Retriever:
-    def __init__(self, rag_path):
+    def __init__(self, rag_path, embedder=None, embeddings_dir=None):
         # ======================
         # ĐƯỜNG DẪN
         # ======================
-        self.embeddings_dir = r"D:\CHAT BOT TTCS\embeddings"
+        self.embeddings_dir = embeddings_dir or EMBEDDINGS_DIR
         
-        print("🔄 Đang load model embedding...")
-        self.embedder = SentenceTransformer("keepitreal/vietnamese-sbert")  # Dùng chung một encoder cho mọi intent để tránh lệch không gian vector
+        if embedder is not None:
+            # Encoder dùng chung với intent classifier (SharedEncoderIntentClassifier) → không load model thứ 2
+            print("♻️ Dùng shared encoder cho embedding RAG")
+            self.embedder = embedder
+        else:
+            from sentence_transformers import SentenceTransformer # Mô hình embedding câu
+            print("🔄 Đang load model embedding...")
+            self.embedder = SentenceTransformer(EMBEDDING_MODEL)
         
         # Cache cho các intent indexes (lazy load)
         self._intent_indexes = {}  # Lưu FAISS index đã load cho từng intent 
         self._intent_documents = {}  # Map intent -> danh sách đoạn văn tương ứng index
+        self._load_lock = Lock()  # search có thể chạy song song (speculative retrieval) → load index thread-safe
+        
+        # Cache kết quả search. Key có kèm _index_generation: mỗi lần reload index (sau khi build lại)
+        # generation tăng → entry cũ không bao giờ được dùng lại (tự hết hạn theo LRU/TTL)
+        self._index_generation = 0
+        self._result_cache = TTLCache(RAG_RESULT_CACHE_SIZE, RAG_RESULT_CACHE_TTL, name="rag_results")
         
         # Danh sách các intent có sẵn (từ các file index có trong thư mục)
         self.available_intents = [
@@ -37,6 +70,151 @@ class Retriever:
     def normalize(self, v):
         return v / np.linalg.norm(v, axis=1, keepdims=True)
 
+    # ======================
+    # LAZY LOAD INDEX THEO INTENT
+    # ======================
+    def _load_intent(self, intent: str) -> bool:
+        """Load FAISS index + documents của intent nếu chưa có. Trả về False nếu intent chưa build index."""
+        if intent in self._intent_indexes:
+            return True
+        with self._load_lock:
+            if intent in self._intent_indexes:  # Double check
+                return True
+            # đường dẫn tới file index và documents theo intent
+            index_path = os.path.join(self.embeddings_dir, f"{intent}_index.faiss")
+            docs_path = os.path.join(self.embeddings_dir, f"{intent}_docs.pkl")
+            if not os.path.exists(index_path) or not os.path.exists(docs_path):
+                return False
+            print(f"🔄 Đang load index cho intent: {intent}")
+            with open(docs_path, "rb") as f:
+                # Đọc văn bản thô tương ứng từng vector, phục vụ trả kết quả RAG
+                self._intent_documents[intent] = pickle.load(f)
+            # Gán index sau cùng: thread khác thấy index thì documents cũng đã sẵn sàng
+            self._intent_indexes[intent] = _read_index(index_path)
+        return True
+
+    def preload_all(self):
+        """Load index của mọi intent ngay (trước khi fork worker), thay vì lazy-load ở lần search đầu."""
+        return [intent for intent in self.available_intents if self._load_intent(intent)]
+
+    def reload_indexes(self):
+        """Bỏ các index đã load (ví dụ sau khi chạy lại build_faiss.py) và vô hiệu cache kết quả."""
+        with self._load_lock:
+            self._intent_indexes = {}
+            self._intent_documents = {}
+            self._index_generation += 1
+        self._result_cache.clear()
+        print("🔄 Đã reset intent indexes, sẽ load lại khi search")
+
+    # ======================
+    # CACHE KẾT QUẢ SEARCH
+    # ======================
+    @staticmethod
+    def _normalize_query(query):
+        return " ".join((query or "").lower().split())
+
+    def _cache_key(self, intent, query, k):
+        return (self._index_generation, intent, self._normalize_query(query), k)
+
+    def _cache_get(self, key):
+        cached = self._result_cache.get(key)
+        if cached is None:
+            return None
+        # Trả bản sao: caller có thể sửa dict (vd r.pop("intent")) mà không làm hỏng cache
+        return [dict(r) for r in cached]
+
+    def _cache_set(self, key, results):
+        self._result_cache.set(key, tuple(dict(r) for r in results))
+
+    def cache_stats(self):
+        """Thống kê hit/miss của cache kết quả search."""
+        stats = self._result_cache.stats()
+        stats["index_generation"] = self._index_generation
+        return stats
+
+    # ======================
+    # EMBEDDING CÂU TRUY VẤN
+    # ======================
+    def encode_query(self, query):
+        """Vector hóa + chuẩn hoá câu truy vấn. Không phụ thuộc intent nên có thể chạy trước (speculative)."""
+        query_emb = self.embedder.encode([query]).astype("float32")
+        return self.normalize(query_emb)
+
+    def prefetch(self, query, k=0):
+        """
+        Chuẩn bị trước cho search (chạy song song với phân loại intent).
+
+        - k == 0: chỉ encode câu truy vấn
+        - k > 0: encode + search top-k trong tất cả intent indexes (chưa tạo dict kết quả)
+
+        Kết quả truyền lại vào search_by_intent()/search_all_intents() qua tham số `prefetched`.
+        """
+        query_emb = self.encode_query(query)
+        raw = self._search_raw(query_emb, k) if k > 0 else {}
+        return {"query": query, "query_emb": query_emb, "k": k, "raw": raw}
+
+    def _prefetched_emb(self, query, prefetched):
+        if prefetched is not None and prefetched.get("query") == query:
+            return prefetched["query_emb"]
+        return self.encode_query(query)
+
+    def _prefetched_raw(self, query, intent, k, prefetched):
+        """Lấy (scores, indices) đã search sẵn cho intent nếu đủ k, ngược lại trả None."""
+        if prefetched is None or prefetched.get("query") != query or prefetched.get("k", 0) < k:
+            return None
+        raw = prefetched["raw"].get(intent)
+        if raw is None:
+            return None
+        scores, indices = raw
+        return scores[:, :k], indices[:, :k]
+
+    def _search_raw(self, query_emb, k, intents=None):
+        """Search top-k trong từng intent index, trả về {intent: (scores, indices)} (chưa lấy text)."""
+        raw = {}
+        for intent in (intents or self.available_intents):
+            try:
+                if not self._load_intent(intent):
+                    continue  # Bỏ qua intent không có index
+                raw[intent] = self._intent_indexes[intent].search(query_emb, k)
+            except Exception as e:
+                print(f"⚠️ Lỗi khi search trong intent '{intent}': {e}")
+                continue
+        return raw
+
+    # ======================
+    # TẠO KẾT QUẢ TRẢ VỀ
+    # ======================
+    def _make_result(self, intent, idx, score):
+        """Tạo dict kết quả cho 1 đoạn văn bản (chỉ gọi cho các kết quả cuối cùng)."""
+        cosine = float(score)
+        return {
+            #lấy ra đoạn văn bản tương ứng với index
+            "text": self._intent_documents[intent][idx],
+            #tính điểm cosine và confidence
+            "cosine": cosine,  # -1→1
+            "confidence": (cosine + 1) / 2,  # convert -1→1 thành 0→1
+            # vị trí vector trong index → lấy lại vector khi chọn context (doc_vectors)
+            "intent": intent,
+            "doc_index": idx,
+        }
+
+    def doc_vectors(self, results):
+        """
+        Vector (đã chuẩn hoá lúc build index) của các kết quả search, cùng thứ tự với results.
+
+        Lấy trực tiếp từ FAISS (reconstruct) nên không phải encode lại văn bản.
+        Trả về None nếu có kết quả không xác định được vector.
+        """
+        vectors = []
+        for r in results:
+            index = self._intent_indexes.get(r.get("intent"))
+            if index is None or r.get("doc_index") is None:
+                return None
+            vectors.append(index.reconstruct(int(r["doc_index"])))
+        if not vectors:
+            return None
+        return np.vstack(vectors).astype("float32")
+
     # ======================
     # HÀM TRUY XUẤT TOP-K (search trong tất cả intent indexes)
     # ======================
@@ -50,73 +228,66 @@ class Retriever:
     # Vì vậy search_all_intents() duyệt qua từng index riêng, gom kết quả rồi lấy top-k chung.
 
     #tìm ra các tài liệu liên quan nhất từ tất cả các intent indexes
-    def search_all_intents(self, query, k=3):
+    def search_all_intents(self, query, k=3, prefetched=None):
         """
         Search trong tất cả các intent indexes và trả về kết quả tốt nhất
+
+        prefetched: kết quả của prefetch() cho cùng query (nếu có) → không encode/search lại
         
         Trả về danh sách:
         [
-            { "text": ..., "cosine": ..., "confidence": ... },
+            { "text": ..., "cosine": ..., "confidence": ..., "intent": ..., "doc_index": ... },
             ...
         ]
         """
-        # vector hóa câu truy vấn
-        query_emb = self.embedder.encode([query]).astype("float32")
-        query_emb = self.normalize(query_emb)
+        cache_key = self._cache_key("*", query, k)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
         
-        # Search trong tất cả các intent indexes
-        # Gom tất cả kết quả vào một danh sách
-        all_results = []
-        # Duyệt qua tất cả inent có trong danh sách available_intents
+        # Lấy kết quả search theo từng intent (dùng lại phần đã prefetch nếu đủ k)
+        raw = {}
+        missing = []
         for intent in self.available_intents:
-            try:
-                # Lazy load index nếu chưa có
-                if intent not in self._intent_indexes:
-                    # đường dẫn tới file index và documents theo intent
-                    index_path = os.path.join(self.embeddings_dir, f"{intent}_index.faiss")
-                    docs_path = os.path.join(self.embeddings_dir, f"{intent}_docs.pkl")
-                    #nếu file tồn tại thì load index và documents
-                    if os.path.exists(index_path) and os.path.exists(docs_path):
-                        # đọc các vector index từ file
-                        self._intent_indexes[intent] = faiss.read_index(index_path)
-                        with open(docs_path, "rb") as f:
-                            # Đọc văn bản thô tương ứng từng vector, phục vụ trả kết quả RAG
-                            self._intent_documents[intent] = pickle.load(f)
-                    else:
-                        continue  # Bỏ qua intent không có index
- 
-                # Lấy index và documents đã load
-                intent_index = self._intent_indexes[intent]
-                # trả về list các đoạn văn bản tương ứng với index
-                intent_docs = self._intent_documents[intent]
-                
-                # Trả về điểm và vị trí index của các đoạn văn bản tương tự nhất
-                scores, indices = intent_index.search(query_emb, k)
-                
-                # Thêm kết quả vào danh sách
-                for score, idx in zip(scores[0], indices[0]):
-                    cosine = float(score)
-                    confidence = (cosine + 1) / 2
-                    all_results.append({
-                        #lấy ra đoạn văn bản tương ứng với index
-                        "text": intent_docs[idx],
-                        #tính điểm cosine và confidence
-                        "cosine": cosine, # -1→1
-                        "confidence": confidence,   #0→1
-                        "intent": intent  # Lưu intent để debug
-                    })
-            except Exception as e:
-                print(f"⚠️ Lỗi khi search trong intent '{intent}': {e}")
-                continue
+            cached = self._prefetched_raw(query, intent, k, prefetched)
+            if cached is not None:
+                raw[intent] = cached
+            else:
+                missing.append(intent)
+        if missing:
+            # vector hóa câu truy vấn (hoặc dùng vector đã encode sẵn)
+            query_emb = self._prefetched_emb(query, prefetched)
+            raw.update(self._search_raw(query_emb, k, intents=missing))
         
-        # Sắp xếp theo confidence (cao nhất trước) và lấy top k
-        all_results.sort(key=lambda x: x["confidence"], reverse=True)
-        results = all_results[:k]
+        # Gộp top-k trên mảng NumPy: nối điểm + (intent, idx) của mọi intent, chọn top-k bằng
+        # argpartition, chỉ tạo dict/lấy text cho k kết quả cuối → số dict tạo ra không tăng theo số intent
+        searched = [intent for intent in self.available_intents if intent in raw]
+        if not searched:
+            return []
+        all_scores = np.concatenate([raw[intent][0][0] for intent in searched])
+        all_indices = np.concatenate([raw[intent][1][0] for intent in searched])
+        owners = np.repeat(np.arange(len(searched)), [len(raw[intent][1][0]) for intent in searched])
         
-        # Bỏ field "intent" trong kết quả cuối cùng (chỉ dùng để debug)
-        for r in results:
-            r.pop("intent", None)
+        # FAISS trả idx = -1 khi index có ít hơn k vector → bỏ, không được index thẳng vào docs
+        valid = all_indices >= 0
+        all_scores, all_indices, owners = all_scores[valid], all_indices[valid], owners[valid]
+        
+        top_n = min(k, len(all_scores))
+        if top_n <= 0:
+            return []
+        if top_n < len(all_scores):
+            top = np.argpartition(-all_scores, top_n - 1)[:top_n]
+        else:
+            top = np.arange(len(all_scores))
+        # Sắp xếp theo điểm (cao nhất trước)
+        top = top[np.argsort(-all_scores[top], kind="stable")]
         
+        results = [
+            self._make_result(searched[owners[i]], int(all_indices[i]), all_scores[i])
+            for i in top
+        ]
+        
+        self._cache_set(cache_key, results)
         # Trả về kết quả là danh sách các đoạn văn bản tương tự nhất
         return results
     
@@ -124,47 +295,41 @@ class Retriever:
     # HÀM TRUY XUẤT THEO INTENT
     # ======================
     #truy xuất theo intent cụ thể
-    def search_by_intent(self, intent: str, query: str, k=3):
+    def search_by_intent(self, intent: str, query: str, k=3, prefetched=None):
 
         actual_intent = intent
         
+        cache_key = self._cache_key(actual_intent, query, k)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         # Lazy load index nếu chưa có
-        if actual_intent not in self._intent_indexes:
-            # Chỉ load index/documents khi lần đầu gặp intent nhằm giảm thời gian khởi động
-            index_path = os.path.join(self.embeddings_dir, f"{actual_intent}_index.faiss")
-            docs_path = os.path.join(self.embeddings_dir, f"{actual_intent}_docs.pkl")
-            
-            if not os.path.exists(index_path) or not os.path.exists(docs_path):
-                # Một số intent mới hoặc intent hiếm có thể chưa build index riêng.
-                # Fallback gọi search_all_intents() để scan toàn bộ corpus thay vì trả về rỗng.
-                print(f"⚠️ Không tìm thấy index riêng cho intent '{actual_intent}', dùng search thông thường")
-                return self.search_all_intents(query, k)
-            
-            print(f"🔄 Đang load index cho intent: {actual_intent}")
-            self._intent_indexes[actual_intent] = faiss.read_index(index_path)
-            with open(docs_path, "rb") as f:
-                # Đọc văn bản thô tương ứng từng vector, phục vụ trả kết quả RAG
-                self._intent_documents[actual_intent] = pickle.load(f)
-        # Lấy index và documents đã load
+        # Chỉ load index/documents khi lần đầu gặp intent nhằm giảm thời gian khởi động
+        if not self._load_intent(actual_intent):
+            # Một số intent mới hoặc intent hiếm có thể chưa build index riêng.
+            # Fallback gọi search_all_intents() để scan toàn bộ corpus thay vì trả về rỗng.
+            print(f"⚠️ Không tìm thấy index riêng cho intent '{actual_intent}', dùng search thông thường")
+            return self.search_all_intents(query, k, prefetched=prefetched)
+        # Lấy index đã load
         intent_index = self._intent_indexes[actual_intent]
-        intent_docs = self._intent_documents[actual_intent]
         
-        # embedding câu của user 
-        query_emb = self.embedder.encode([query]).astype("float32")  # Embed câu hỏi hiện tại
-        query_emb = self.normalize(query_emb)
-        
-        # tìm index của đoạn văn bản tương tự nhất với inent được chỉ định
-        scores, indices = intent_index.search(query_emb, k)  # Lấy top-k vector gần nhất trong intent này
-        
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            cosine = float(score)
-            confidence = (cosine + 1) / 2   # convert -1→1 thành 0→1
+        # Dùng kết quả đã search sẵn (speculative) nếu có
+        cached = self._prefetched_raw(query, actual_intent, k, prefetched)
+        if cached is not None:
+            scores, indices = cached
+        else:
+            # embedding câu của user (hoặc dùng vector đã encode sẵn)
+            query_emb = self._prefetched_emb(query, prefetched)  # Embed câu hỏi hiện tại
             
-            results.append({
-                "text": intent_docs[idx],
-                "cosine": cosine,
-                "confidence": confidence
-            })
+            # tìm index của đoạn văn bản tương tự nhất với inent được chỉ định
+            scores, indices = intent_index.search(query_emb, k)  # Lấy top-k vector gần nhất trong intent này
+        
+        results = [
+            self._make_result(actual_intent, int(idx), score)
+            for score, idx in zip(scores[0], indices[0])
+            if idx >= 0  # FAISS padding khi index có ít hơn k vector
+        ]
         
+        self._cache_set(cache_key, results)
         return results
@@ -0,0 +1,117 @@
+"""
+Gửi thông báo nhắc uống thuốc (Firebase Function sendMedicineReminder) theo lô.
+
+Trước đây mỗi reminder được gửi tuần tự bằng requests.post (timeout 10s) ngay trong vòng lặp async
+→ vài trăm reminder lúc 08:00 mất nhiều phút và chặn event loop. Dispatcher:
+    - dùng chung 1 requests.Session (connection pool, keep-alive)
+    - gửi song song trong threadpool riêng, giới hạn bởi asyncio.Semaphore(concurrency)
+    - retry lỗi mạng / HTTP 429 / 5xx với exponential backoff + jitter
+"""
+
+import asyncio
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+REMINDER_NOTIFY_URL = os.environ.get(
+    "REMINDER_NOTIFY_URL",
+    "https://us-central1-giadienweb.cloudfunctions.net/sendMedicineReminder",
+)
+REMINDER_DISPATCH_CONCURRENCY = int(os.environ.get("REMINDER_DISPATCH_CONCURRENCY", "16"))
+REMINDER_DISPATCH_RETRIES = int(os.environ.get("REMINDER_DISPATCH_RETRIES", "3"))
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def build_reminder_message(reminder: Dict[str, Any]) -> str:
+    message = f"🔔 Nhắc nhở: Đã đến giờ uống thuốc {reminder['medicine_name']} ({reminder['time']})"
+    if reminder.get("notes"):
+        message += f"\nGhi chú: {reminder['notes']}"
+    return message
+
+
+class ReminderDispatcher:
+    """Gửi thông báo nhắc nhở song song có giới hạn, có retry."""
+
+    def __init__(
+        self,
+        url: str = REMINDER_NOTIFY_URL,
+        concurrency: int = REMINDER_DISPATCH_CONCURRENCY,
+        retries: int = REMINDER_DISPATCH_RETRIES,
+        timeout: float = 10.0,
+        backoff: float = 0.5,
+    ):
+        self.url = url
+        self.concurrency = max(1, concurrency)
+        self.retries = max(0, retries)
+        self.timeout = timeout
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Thread riêng cho HTTP blocking: executor mặc định của asyncio nhỏ (≈ số CPU + 4)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="reminder-dispatch")
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def _post(self, payload: Dict[str, Any]) -> int:
+        """1 lần POST (chạy trong thread). Trả về HTTP status."""
+        return self.session.post(self.url, json=payload, timeout=self.timeout).status_code
+
+    async def send(self, reminder: Dict[str, Any], semaphore: Optional[asyncio.Semaphore] = None) -> bool:
+        """Gửi 1 thông báo, retry với backoff. Trả về True nếu gửi thành công."""
+        payload = {
+            "email": reminder.get("user_email"),
+            "medicine_name": reminder.get("medicine_name"),
+            "time": reminder.get("time"),
+            "message": build_reminder_message(reminder),
+        }
+        semaphore = semaphore or asyncio.Semaphore(1)
+        for attempt in range(self.retries + 1):
+            error = None
+            try:
+                async with semaphore:
+                    status = await asyncio.get_running_loop().run_in_executor(self._executor, self._post, payload)
+                if status < 400:
+                    self.sent += 1
+                    return True
+                error = f"HTTP {status}"
+                if status not in _RETRY_STATUS:
+                    break
+            except requests.RequestException as e:
+                error = str(e)
+            if attempt < self.retries:
+                self.retried += 1
+                # Exponential backoff + jitter (ngủ ngoài semaphore để nhường slot cho request khác)
+                await asyncio.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+        self.failed += 1
+        print(f"⚠️ Gửi nhắc nhở thất bại ({reminder.get('id')}): {error}")
+        return False
+
+    async def send_many(self, reminders: List[Dict[str, Any]]) -> List[bool]:
+        """Gửi 1 lô thông báo song song (tối đa `concurrency` request cùng lúc)."""
+        if not reminders:
+            return []
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return list(await asyncio.gather(*(self.send(r, semaphore) for r in reminders)))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "concurrency": self.concurrency,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
@@ -0,0 +1,97 @@
+"""
+Tính các thời điểm nhắc uống thuốc theo cấu hình của reminder.
+
+Reminder (snake_case, như MedicineReminderRequest):
+    - time: "HH:MM" hoặc "HH:MM:SS" (giờ local của server)
+    - repeat_type: "daily" | "weekly" | "once"
+    - weekday: 0-6 cho weekly (0=Monday); bỏ trống → thứ của start_date (hoặc hôm nay)
+    - start_date / end_date: ISO date/datetime, tính theo ngày (cả 2 đầu đều tính)
+
+Mọi phép tính đều O(1) theo số lần nhắc đã bỏ lỡ: lần nhắc kế tiếp được tính thẳng từ ngày
+đích (không cộng dồn từng ngày/tuần), nên reminder bị bỏ lỡ lâu (server tắt nhiều ngày) vẫn
+được dời đúng sang lần kế tiếp.
+"""
+
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Any, Dict, List, Optional
+
+
+def parse_time(value: str) -> dtime:
+    """Giờ nhắc "HH:MM" / "HH:MM:SS" → time. Sai định dạng (vd "8h", "25:00") → ValueError."""
+    try:
+        parts = [int(p) for p in str(value).split(":")]
+        if len(parts) > 3:
+            raise ValueError
+        return dtime(parts[0], parts[1] if len(parts) > 1 else 0, parts[2] if len(parts) > 2 else 0)
+    except ValueError:
+        raise ValueError(f"Giờ nhắc không hợp lệ: {value!r} (cần HH:MM hoặc HH:MM:SS)") from None
+
+
+def parse_date(value) -> Optional[date]:
+    """ISO date/datetime string | date | datetime (kể cả Timestamp Firestore) → date; None nếu trống/sai."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.fromisoformat(str(value)).date()
+    except ValueError:
+        return None
+
+
+def next_fire_time(reminder: Dict[str, Any], after: datetime) -> Optional[datetime]:
+    """Lần nhắc đầu tiên sau `after` (naive, giờ local); None nếu không còn lần nhắc nào."""
+    at = parse_time(reminder.get("time") or "00:00")
+    repeat_type = reminder.get("repeat_type") or "daily"
+    start = parse_date(reminder.get("start_date"))
+    end = parse_date(reminder.get("end_date"))
+
+    # Ngày sớm nhất có thể nhắc: không trước start_date, không trước ngày của `after`,
+    # và nếu giờ nhắc hôm đó đã qua thì sang ngày hôm sau
+    day = after.date()
+    if datetime.combine(day, at) <= after:
+        day += timedelta(days=1)
+    if start is not None and start > day:
+        day = start
+
+    if repeat_type == "once":
+        # Chỉ 1 lần: đúng ngày start_date (nếu có), nếu đã qua thì hết
+        if start is not None and day != start:
+            return None
+    elif repeat_type == "weekly":
+        weekday = reminder.get("weekday")
+        if weekday is None:
+            weekday = (start or after.date()).weekday()
+        day += timedelta(days=(int(weekday) - day.weekday()) % 7)
+
+    if end is not None and day > end:
+        return None
+    return datetime.combine(day, at)
+
+
+def upcoming_fire_times(reminder: Dict[str, Any], after: datetime, count: int) -> List[datetime]:
+    """`count` lần nhắc tiếp theo sau `after` (ít hơn nếu reminder kết thúc sớm)."""
+    times = []
+    current = after
+    while len(times) < count:
+        fire = next_fire_time(reminder, current)
+        if fire is None:
+            break
+        times.append(fire)
+        if (reminder.get("repeat_type") or "daily") == "once":
+            break
+        current = fire
+    return times
+
+
+def next_fire_after(reminder: Dict[str, Any], fire_ts: float, now: float) -> Optional[float]:
+    """
+    Lần nhắc kế tiếp (epoch giây) sau lần nhắc fire_ts, bỏ qua các lần đã lỡ (≤ now).
+    None nếu reminder không lặp lại hoặc đã hết hạn (end_date).
+    """
+    if (reminder.get("repeat_type") or "daily") == "once":
+        return None
+    fire = next_fire_time(reminder, datetime.fromtimestamp(max(fire_ts, now)))
+    return fire.timestamp() if fire is not None else None
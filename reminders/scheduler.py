@@ -0,0 +1,301 @@
+"""
+Scheduler nhắc uống thuốc chạy trong process của API server.
+
+Thay cho vòng lặp cũ (medicine_reminder_scheduler.py POST /check mỗi 60s → đọc toàn bộ
+medicineReminders và so từng nextReminderTime): scheduler đọc reminder active 1 lần khi khởi động,
+giữ thời điểm nhắc tiếp theo trong min-heap và được cập nhật khi tạo/xóa reminder qua API.
+Web app ghi reminder thẳng vào Firestore (không qua API) → mỗi REMINDER_SYNC_SECONDS scheduler đọc
+các reminder sắp đến hạn bằng range query (store.load_due) và gộp vào heap.
+Task nền chỉ thức dậy khi reminder sớm nhất đến hạn rồi xử lý theo lô các reminder đến hạn
+(gửi song song qua ReminderDispatcher, ghi Firestore bằng WriteBatch)
+→ chi phí mỗi lần chạy tỉ lệ với số reminder đến hạn, không phải tổng số reminder.
+
+Nhiều worker uvicorn / nhiều replica có thể cùng chạy scheduler (hoặc cùng gọi /check): mỗi lô
+được claim trước khi gửi (store.claim_many: dời nextReminderTime có điều kiện trong transaction),
+chỉ worker claim thành công mới gửi → không gửi trùng. Đánh đổi: worker chết giữa claim và gửi
+thì lần nhắc đó bị mất (at-most-once).
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from reminders.recurrence import next_fire_after
+
+# Cửa sổ trễ tối đa vẫn gửi nhắc (giống khoảng 5 phút của /check cũ)
+FIRE_WINDOW_SECONDS = 300
+# Thời gian ngủ tối đa giữa 2 lần kiểm tra (phòng khi đồng hồ hệ thống bị chỉnh)
+MAX_SLEEP_SECONDS = 300
+# Chờ trước khi thử lại khi Firestore lỗi (claim thất bại)
+ERROR_RETRY_SECONDS = 30
+# Chu kỳ đồng bộ heap với store (reminder tạo/sửa ngoài API); mỗi lần đọc các reminder đến hạn
+# trong 2 chu kỳ tới để reminder mới kịp vào heap trước giờ nhắc
+SYNC_INTERVAL_SECONDS = float(os.environ.get("REMINDER_SYNC_SECONDS", "60"))
+
+
+class ReminderScheduler:
+    """
+    Min-heap các thời điểm nhắc tiếp theo.
+
+    - store: FirestoreReminderStore | MemoryReminderStore (load_active, load_due, claim_many, mark_sent)
+    - dispatcher: ReminderDispatcher (send_many: gửi song song cả lô)
+    - batch_size: số reminder đến hạn xử lý mỗi lô
+    """
+
+    def __init__(self, store, dispatcher, batch_size: int = 200, sync_interval: float = SYNC_INTERVAL_SECONDS):
+        self.store = store
+        self.dispatcher = dispatcher
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+
+        self._heap: List[Tuple[float, int, str]] = []  # (next_fire_ts, seq, reminder_id)
+        self._entries: Dict[str, Tuple[float, Dict[str, Any]]] = {}  # id -> (next_fire_ts, reminder)
+        self._seq = itertools.count()
+        self._lock = Lock()
+        self._run_lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_sync = 0.0
+
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.conflicts = 0
+        self.invalid = 0
+        self.synced = 0
+
+    # ========================
+    # CẬP NHẬT LỊCH
+    # ========================
+    def load(self) -> int:
+        """Đọc reminder active từ store và đưa vào heap. Trả về số reminder đã lên lịch."""
+        count = 0
+        self._last_sync = time.time()
+        for reminder in self.store.load_active():
+            if self.schedule(reminder):
+                count += 1
+        return count
+
+    async def sync(self, now: Optional[float] = None, lookahead: Optional[float] = None) -> int:
+        """
+        Gộp vào heap các reminder trong store đến hạn trước now + lookahead (mặc định 2 chu kỳ sync)
+        mà heap chưa có hoặc đang giữ thời điểm khác (reminder tạo/sửa thẳng trên Firestore).
+        Trả về số reminder mới được lên lịch.
+        """
+        if self._run_lock is None:
+            self._run_lock = asyncio.Lock()
+        now = time.time() if now is None else now
+        lookahead = 2 * self.sync_interval if lookahead is None else lookahead
+        # Chạy xen kẽ run_due có thể đọc lại reminder đang claim dở với nextReminderTime cũ → chờ lô đang chạy
+        async with self._run_lock:
+            due = await asyncio.to_thread(self.store.load_due, None, now + lookahead)
+            self._last_sync = now
+            count = 0
+            for reminder in due:
+                with self._lock:
+                    entry = self._entries.get(reminder["id"])
+                if entry is not None and entry[0] == reminder["next_fire_ts"]:
+                    continue
+                if self.schedule(reminder):
+                    count += 1
+            self.synced += count
+            return count
+
+    def schedule(self, reminder: Dict[str, Any]) -> bool:
+        """Thêm/cập nhật 1 reminder (dict có "id" và "next_fire_ts")."""
+        reminder_id = reminder.get("id")
+        fire_ts = reminder.get("next_fire_ts")
+        if not reminder_id or fire_ts is None or not reminder.get("is_active", True):
+            self.unschedule(reminder_id)
+            return False
+        with self._lock:
+            # Entry cũ trong heap không bị xóa ngay, sẽ bị bỏ qua khi pop (khác next_fire_ts)
+            self._entries[reminder_id] = (fire_ts, reminder)
+            is_earliest = not self._heap or fire_ts < self._heap[0][0]
+            heapq.heappush(self._heap, (fire_ts, next(self._seq), reminder_id))
+        if is_earliest:
+            self._wake()
+        return True
+
+    def unschedule(self, reminder_id: Optional[str]) -> None:
+        if not reminder_id:
+            return
+        with self._lock:
+            self._entries.pop(reminder_id, None)
+
+    def next_fire_ts(self) -> Optional[float]:
+        """Thời điểm nhắc sớm nhất còn hiệu lực."""
+        with self._lock:
+            self._drop_stale_head()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_stale_head(self) -> None:
+        while self._heap:
+            fire_ts, _, reminder_id = self._heap[0]
+            entry = self._entries.get(reminder_id)
+            if entry is not None and entry[0] == fire_ts:
+                return
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now: float) -> List[Tuple[float, Dict[str, Any]]]:
+        """Lấy tối đa batch_size reminder đã đến hạn ra khỏi lịch."""
+        due = []
+        with self._lock:
+            while len(due) < self.batch_size:
+                self._drop_stale_head()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                fire_ts, _, reminder_id = heapq.heappop(self._heap)
+                _, reminder = self._entries.pop(reminder_id)
+                due.append((fire_ts, reminder))
+        return due
+
+    # ========================
+    # XỬ LÝ REMINDER ĐẾN HẠN
+    # ========================
+    async def run_due(self, now: Optional[float] = None) -> int:
+        """Gửi các reminder đã đến hạn theo lô. Trả về số thông báo đã gửi."""
+        if self._run_lock is None:
+            self._run_lock = asyncio.Lock()
+        async with self._run_lock:
+            now = time.time() if now is None else now
+            sent = 0
+            while True:
+                batch = self._pop_due(now)
+                if not batch:
+                    break
+                sent += await self._fire_batch(batch, now)
+            return sent
+
+    async def _fire_batch(self, batch: List[Tuple[float, Dict[str, Any]]], now: float) -> int:
+        """Claim cả lô (dời lần nhắc tiếp theo có điều kiện) rồi mới gửi các reminder đã claim được."""
+        valid = []
+        claims = []
+        for fire_ts, reminder in batch:
+            try:
+                next_ts = next_fire_after(reminder, fire_ts, now)
+            except (TypeError, ValueError) as e:
+                # Reminder sai cấu hình (vd time "8h"): bỏ khỏi lịch, không chặn các reminder khác trong lô
+                self.invalid += 1
+                print(f"⚠️ Bỏ qua reminder {reminder.get('id')} cấu hình sai: {e}")
+                continue
+            valid.append((fire_ts, reminder))
+            claims.append((reminder["id"], fire_ts, next_ts))
+        batch = valid
+        if not batch:
+            return 0
+        try:
+            claimed = await asyncio.to_thread(self.store.claim_many, claims)
+        except Exception as e:
+            # Không claim được thì không gửi (thà trễ còn hơn gửi trùng); trả lại lịch cũ để lần sau thử lại
+            for fire_ts, reminder in batch:
+                self.schedule({**reminder, "next_fire_ts": fire_ts})
+            raise RuntimeError(f"Không claim được {len(claims)} reminder: {e}") from e
+
+        # Worker/replica khác đã claim trước (hoặc reminder đã bị sửa/xóa) → bỏ qua lần nhắc này
+        self.conflicts += len(batch) - len(claimed)
+        # Trễ quá cửa sổ (server tắt lúc đến giờ) → không gửi nữa, chỉ dời sang lần kế tiếp
+        to_send = [
+            reminder for fire_ts, reminder in batch
+            if reminder["id"] in claimed and now - fire_ts <= FIRE_WINDOW_SECONDS
+        ]
+        results = await self.dispatcher.send_many(to_send)
+        # Gửi lỗi sau khi đã retry vẫn dời sang lần kế tiếp (không gửi dồn lại)
+        delivered = [reminder["id"] for reminder, ok in zip(to_send, results) if ok]
+        if delivered:
+            try:
+                await asyncio.to_thread(self.store.mark_sent, delivered)
+            except Exception as e:
+                print(f"⚠️ Không ghi được lastSent cho {len(delivered)} reminder: {e}")
+
+        for (fire_ts, reminder), (_, _, next_ts) in zip(batch, claims):
+            if next_ts is not None:
+                self.schedule({**reminder, "next_fire_ts": next_ts})
+
+        self.sent += len(delivered)
+        self.failed += len(to_send) - len(delivered)
+        self.skipped += len(claimed) - len(to_send)
+        return len(delivered)
+
+    # ========================
+    # TASK NỀN
+    # ========================
+    def _wake(self) -> None:
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run_forever(self) -> None:
+        while True:
+            now = time.time()
+            if now - self._last_sync >= self.sync_interval:
+                try:
+                    synced = await self.sync(now)
+                    if synced:
+                        print(f"⏰ Đồng bộ store: thêm {synced} reminder mới vào lịch")
+                except Exception as e:
+                    self._last_sync = now
+                    print(f"⚠️ Không đồng bộ được reminder từ store: {e}")
+            next_ts = self.next_fire_ts()
+            delay = MAX_SLEEP_SECONDS if next_ts is None else max(0.0, next_ts - time.time())
+            until_sync = max(0.0, self._last_sync + self.sync_interval - time.time())
+            self._wakeup.clear()
+            if delay > 0:
+                try:
+                    # Ngủ đến khi reminder sớm nhất đến hạn, khi có reminder mới sớm hơn, hoặc đến lần sync tiếp theo
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), timeout=min(delay, until_sync, MAX_SLEEP_SECONDS)
+                    )
+                    continue
+                except asyncio.TimeoutError:
+                    if until_sync < delay:
+                        continue
+            try:
+                sent = await self.run_due()
+                if sent:
+                    print(f"✅ Đã gửi {sent} thông báo nhắc nhở")
+            except Exception as e:
+                print(f"❌ Lỗi khi xử lý reminders đến hạn: {e}")
+                await asyncio.sleep(ERROR_RETRY_SECONDS)
+
+    def start(self) -> None:
+        """Chạy task nền trên event loop hiện tại."""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            scheduled = len(self._entries)
+        return {
+            "running": self.running,
+            "scheduled": scheduled,
+            "next_fire_ts": self.next_fire_ts(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "conflicts": self.conflicts,
+            "invalid": self.invalid,
+            "synced": self.synced,
+            "dispatcher": self.dispatcher.stats(),
+        }
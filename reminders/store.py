@@ -0,0 +1,241 @@
+"""
+Nơi lưu lịch nhắc uống thuốc cho scheduler: Firestore (collection medicineReminders) hoặc
+bộ nhớ (app.state.medicine_reminders khi chưa cấu hình Firestore).
+
+Mọi reminder trả về đều ở dạng snake_case như MedicineReminderRequest, kèm:
+    - "id": id document
+    - "next_fire_ts": thời điểm nhắc tiếp theo (epoch giây) hoặc None
+"""
+
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Firestore (camelCase) → snake_case
+_FIRESTORE_FIELDS = {
+    "userId": "user_id",
+    "userEmail": "user_email",
+    "medicineName": "medicine_name",
+    "time": "time",
+    "repeatType": "repeat_type",
+    "weekday": "weekday",
+    "startDate": "start_date",
+    "endDate": "end_date",
+    "notes": "notes",
+}
+
+
+def _timestamp_to_ts(value) -> Optional[float]:
+    """Firestore Timestamp / datetime / ISO string → epoch giây."""
+    if value is None:
+        return None
+    if hasattr(value, "timestamp"):
+        return value.timestamp()
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def reminder_from_firestore(doc_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Chuyển document Firestore sang dict snake_case dùng trong scheduler."""
+    reminder = {snake: data.get(camel) for camel, snake in _FIRESTORE_FIELDS.items()}
+    reminder["id"] = doc_id
+    reminder["is_active"] = data.get("isActive", True)
+    reminder["next_fire_ts"] = _timestamp_to_ts(data.get("nextReminderTime"))
+    return reminder
+
+
+def _same_ts(value, ts: float) -> bool:
+    """nextReminderTime đang lưu có đúng là lần nhắc ts không (Firestore lưu tới micro giây)."""
+    current = _timestamp_to_ts(value)
+    return current is not None and abs(current - ts) < 1e-3
+
+
+def _firestore_module(db):
+    """Module cung cấp transactional/SERVER_TIMESTAMP cho client db (firebase_admin hoặc firestore_memory)."""
+    module = getattr(db, "firestore_module", None)
+    if module is not None:
+        return module
+    from firebase_admin import firestore as firestore_admin
+    return firestore_admin
+
+
+def _ts_to_firestore(ts: float) -> datetime:
+    """Epoch giây → datetime có timezone (client Firestore tự chuyển sang Timestamp)."""
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
+
+
+class FirestoreReminderStore:
+    """Đọc/ghi reminder trong collection medicineReminders."""
+
+    collection = "medicineReminders"
+    # Chỉ các field cần để gửi nhắc + tính lần nhắc tiếp theo (projection, giảm dữ liệu đọc)
+    due_fields = [
+        "userId", "userEmail", "medicineName", "time", "notes",
+        "repeatType", "weekday", "startDate", "endDate", "nextReminderTime",
+    ]
+
+    max_batch_writes = 500  # giới hạn của Firestore WriteBatch
+
+    def __init__(self, db, page_size: int = 200):
+        self.db = db
+        self.page_size = page_size
+
+    def load_active(self) -> List[Dict[str, Any]]:
+        """Đọc 1 lần toàn bộ reminder đang active (lúc khởi động scheduler)."""
+        query = self.db.collection(self.collection).where("isActive", "==", True)
+        return [reminder_from_firestore(doc.id, doc.to_dict()) for doc in query.stream()]
+
+    def load_due(self, start_ts: Optional[float], end_ts: float) -> List[Dict[str, Any]]:
+        """
+        Reminder active có nextReminderTime trong [start_ts, end_ts] (start_ts None → mọi reminder ≤ end_ts).
+
+        Range query trên nextReminderTime (composite index isActive + nextReminderTime trong
+        AI-Web/firestore.indexes.json), phân trang bằng cursor → số document đọc bằng số
+        reminder đến hạn, không phải tổng số reminder.
+        """
+        base = (
+            self.db.collection(self.collection)
+            .where("isActive", "==", True)
+            .where("nextReminderTime", "<=", _ts_to_firestore(end_ts))
+        )
+        if start_ts is not None:
+            base = base.where("nextReminderTime", ">=", _ts_to_firestore(start_ts))
+        base = base.order_by("nextReminderTime").select(self.due_fields)
+        due = []
+        last_doc = None
+        while True:
+            page = base.limit(self.page_size)
+            if last_doc is not None:
+                page = page.start_after(last_doc)
+            docs = list(page.stream())
+            for doc in docs:
+                reminder = reminder_from_firestore(doc.id, doc.to_dict())
+                reminder["is_active"] = True
+                due.append(reminder)
+            if len(docs) < self.page_size:
+                return due
+            last_doc = docs[-1]
+
+    def _next_update(self, next_fire_ts: Optional[float], sent: bool) -> Dict[str, Any]:
+        firestore_admin = _firestore_module(self.db)
+
+        update: Dict[str, Any] = {}
+        if next_fire_ts is None:
+            update["isActive"] = False
+        else:
+            update["nextReminderTime"] = _ts_to_firestore(next_fire_ts)
+        if sent:
+            update["lastSent"] = firestore_admin.SERVER_TIMESTAMP
+        return update
+
+    def update_next(self, reminder_id: str, next_fire_ts: Optional[float], sent: bool) -> None:
+        """Ghi thời điểm nhắc tiếp theo (None → tắt reminder), cập nhật lastSent nếu đã gửi."""
+        self.db.collection(self.collection).document(reminder_id).update(
+            self._next_update(next_fire_ts, sent)
+        )
+
+    def claim_many(self, claims: List[Tuple[str, float, Optional[float]]]) -> Set[str]:
+        """
+        Nhận (claim) quyền gửi các lần nhắc trước khi gửi: trong 1 transaction, chỉ dời
+        nextReminderTime từ fire_ts → next_fire_ts (None → tắt reminder) nếu document vẫn
+        active và nextReminderTime vẫn bằng fire_ts. Worker/replica khác chạy cùng lúc sẽ
+        thấy giá trị đã đổi (transaction bị retry) → không claim được → không gửi trùng.
+
+        claims: [(reminder_id, fire_ts, next_fire_ts)]. Trả về tập id đã claim thành công.
+        """
+        firestore_admin = _firestore_module(self.db)
+        collection = self.db.collection(self.collection)
+
+        @firestore_admin.transactional
+        def claim_chunk(transaction, chunk):
+            refs = {reminder_id: collection.document(reminder_id) for reminder_id, _, _ in chunk}
+            current = {snap.id: snap for snap in transaction.get_all(list(refs.values()))}
+            claimed = set()
+            for reminder_id, fire_ts, next_fire_ts in chunk:
+                snap = current.get(reminder_id)
+                if snap is None or not snap.exists:
+                    continue
+                data = snap.to_dict()
+                if not data.get("isActive", True) or not _same_ts(data.get("nextReminderTime"), fire_ts):
+                    continue
+                transaction.update(refs[reminder_id], self._next_update(next_fire_ts, sent=False))
+                claimed.add(reminder_id)
+            return claimed
+
+        claimed: Set[str] = set()
+        for start in range(0, len(claims), self.max_batch_writes):
+            claimed |= claim_chunk(self.db.transaction(), claims[start:start + self.max_batch_writes])
+        return claimed
+
+    def mark_sent(self, reminder_ids: List[str]) -> None:
+        """Ghi lastSent cho các reminder đã gửi bằng WriteBatch (mỗi batch tối đa 500 thao tác)."""
+        firestore_admin = _firestore_module(self.db)
+        collection = self.db.collection(self.collection)
+        for start in range(0, len(reminder_ids), self.max_batch_writes):
+            batch = self.db.batch()
+            for reminder_id in reminder_ids[start:start + self.max_batch_writes]:
+                batch.update(collection.document(reminder_id), {"lastSent": firestore_admin.SERVER_TIMESTAMP})
+            batch.commit()
+
+
+class MemoryReminderStore:
+    """Reminder lưu trong dict {id: reminder} (fallback khi không có Firestore)."""
+
+    def __init__(self, reminders: Dict[str, Dict[str, Any]]):
+        self.reminders = reminders
+        self._lock = Lock()
+
+    def load_active(self) -> List[Dict[str, Any]]:
+        result = []
+        for reminder_id, r in self.reminders.items():
+            if not r.get("is_active", True):
+                continue
+            reminder = dict(r)
+            reminder["id"] = reminder_id
+            reminder["next_fire_ts"] = _timestamp_to_ts(r.get("next_reminder_time"))
+            result.append(reminder)
+        return result
+
+    def load_due(self, start_ts: Optional[float], end_ts: float) -> List[Dict[str, Any]]:
+        return [
+            r for r in self.load_active()
+            if r["next_fire_ts"] is not None
+            and (start_ts is None or start_ts <= r["next_fire_ts"])
+            and r["next_fire_ts"] <= end_ts
+        ]
+
+    def update_next(self, reminder_id: str, next_fire_ts: Optional[float], sent: bool) -> None:
+        reminder = self.reminders.get(reminder_id)
+        if reminder is None:
+            return
+        if next_fire_ts is None:
+            reminder["is_active"] = False
+        else:
+            reminder["next_reminder_time"] = datetime.fromtimestamp(next_fire_ts).isoformat()
+        if sent:
+            reminder["last_sent"] = datetime.now().isoformat()
+
+    def claim_many(self, claims: List[Tuple[str, float, Optional[float]]]) -> Set[str]:
+        """Như FirestoreReminderStore.claim_many, compare-and-set dưới 1 lock của process."""
+        claimed = set()
+        with self._lock:
+            for reminder_id, fire_ts, next_fire_ts in claims:
+                reminder = self.reminders.get(reminder_id)
+                if reminder is None or not reminder.get("is_active", True):
+                    continue
+                if not _same_ts(reminder.get("next_reminder_time"), fire_ts):
+                    continue
+                self.update_next(reminder_id, next_fire_ts, sent=False)
+                claimed.add(reminder_id)
+        return claimed
+
+    def mark_sent(self, reminder_ids: List[str]) -> None:
+        now = datetime.now().isoformat()
+        for reminder_id in reminder_ids:
+            reminder = self.reminders.get(reminder_id)
+            if reminder is not None:
+                reminder["last_sent"] = now
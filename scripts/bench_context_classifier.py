@@ -0,0 +1,65 @@
+"""Micro-benchmark: ContextClassifier (regex gộp, biên dịch sẵn) vs cách cũ (re.search từng pattern).
+
+Chạy: python scripts/bench_context_classifier.py
+"""
+from pathlib import Path
+import re
+import sys
+import timeit
+
+HERE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(HERE))
+
+from app.response_layer import (  # noqa: E402
+    FOLLOW_UP_PATTERNS,
+    SWITCH_CONFIRM_PATTERNS,
+    SWITCH_REJECT_PATTERNS,
+    TOPIC_SHIFT_PATTERNS,
+    classify_context,
+)
+
+SAMPLES = [
+    "Tôi bị đau đầu ở thái dương 2 ngày nay",
+    "hôm nay vẫn còn bị sốt 38 độ",
+    "cho mình hỏi nên ăn gì để tăng cơ",
+    "tập xong thì thấy mệt và chóng mặt",
+    "chuyển",
+    "không, giữ chủ đề cũ",
+    "Ăn uống không ngon, ngủ không yên, chắc stress quá.",
+    "Nên ăn gì buổi tối để giảm cân vậy?",
+]
+
+
+def legacy_flags(text: str) -> dict:
+    """Cách cũ: mỗi hàm lowercase lại và gọi re.search cho từng pattern."""
+    follow_up = any(re.search(p, text.lower().strip()) for p in FOLLOW_UP_PATTERNS)
+    topic_shift = any(re.search(p, text.lower().strip()) for p in TOPIC_SHIFT_PATTERNS)
+    text_lower = text.lower().strip()
+    confirm = None
+    if any(re.search(p, text_lower) for p in SWITCH_CONFIRM_PATTERNS):
+        confirm = True
+    elif any(re.search(p, text_lower) for p in SWITCH_REJECT_PATTERNS):
+        confirm = False
+    return {"follow_up": follow_up, "topic_shift": topic_shift, "switch_confirm": confirm}
+
+
+def main(number: int = 2000):
+    # Kiểm tra 2 cách cho cùng kết quả trước khi đo
+    for text in SAMPLES:
+        new_flags = classify_context(text)
+        old_flags = legacy_flags(text)
+        for key, value in old_flags.items():
+            assert new_flags[key] == value, (text, key, new_flags[key], value)
+
+    legacy = timeit.timeit(lambda: [legacy_flags(t) for t in SAMPLES], number=number)
+    compiled = timeit.timeit(lambda: [classify_context(t) for t in SAMPLES], number=number)
+    calls = number * len(SAMPLES)
+
+    print(f"📊 {calls} lượt phân loại ({len(SAMPLES)} câu mẫu x {number})")
+    print(f"   legacy (re.search từng pattern): {legacy / calls * 1e6:8.2f} µs/câu")
+    print(f"   ContextClassifier:               {compiled / calls * 1e6:8.2f} µs/câu")
+    print(f"   speedup:                         {legacy / compiled:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Đo các đường đọc/ghi Firestore trên Firestore giả lập (firestore_memory.py), không cần mạng.
+
+So sánh:
+    - lịch sử chat: load_chat_history (order_by + limit) vs đọc toàn bộ session như cũ
+    - reminder đến hạn: load_due (range query) vs load_active (quét toàn bộ)
+    - ghi chat: set từng message (đồng bộ) vs hàng đợi write-behind
+
+Chạy: python scripts/bench_firestore_paths.py [--latency-ms 20] [--per-doc-ms 0.05] [--messages 2000]
+"""
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import argparse
+import os
+import sys
+import time
+
+HERE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(HERE))
+os.environ.setdefault("FIRESTORE_BACKEND", "memory")
+
+import firestore_service  # noqa: E402
+from app.write_behind import FirestoreWriteBehind  # noqa: E402
+from firestore_memory import MemoryFirestore  # noqa: E402
+from reminders.store import FirestoreReminderStore  # noqa: E402
+
+
+def seed(db: MemoryFirestore, messages: int, reminders: int) -> float:
+    t0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    latency = db.latency_ms, db.per_doc_ms
+    db.latency_ms = db.per_doc_ms = 0  # nạp dữ liệu không tính độ trễ
+    batch = db.batch()
+    for i in range(messages):
+        batch.set(db.collection("messages").document(), {
+            "sessionId": "long", "userId": "u1", "role": "user" if i % 2 == 0 else "assistant",
+            "text": f"message {i}", "timestamp": t0 + timedelta(seconds=i),
+        })
+    now = time.time()
+    for i in range(reminders):
+        # 1% reminder đến hạn trong 5 phút vừa qua, còn lại rải trong 24h tới
+        fire_ts = now - 60 if i % 100 == 0 else now + (i % 1440) * 60
+        batch.set(db.collection("medicineReminders").document(f"r{i}"), {
+            "userId": f"u{i}", "userEmail": f"u{i}@example.com", "medicineName": "Paracetamol",
+            "time": "08:00", "repeatType": "daily", "isActive": True,
+            "nextReminderTime": datetime.fromtimestamp(fire_ts, tz=timezone.utc),
+        })
+    batch.commit()
+    db.latency_ms, db.per_doc_ms = latency
+    db.reset_stats()
+    return now
+
+
+def timed(db: MemoryFirestore, fn, repeat: int = 5):
+    db.reset_stats()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    stats = db.stats()
+    return elapsed, stats["reads"] // repeat, stats["rpcs"] // repeat, result
+
+
+def report(name: str, old, new) -> None:
+    print(f"{name}")
+    print(f"  cũ:  {old[0]:8.1f} ms | {old[1]:6d} doc đọc | {old[2]:3d} RPC")
+    print(f"  mới: {new[0]:8.1f} ms | {new[1]:6d} doc đọc | {new[2]:3d} RPC | nhanh hơn {old[0] / max(new[0], 1e-6):.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="độ trễ mỗi RPC")
+    parser.add_argument("--per-doc-ms", type=float, default=0.05, help="độ trễ thêm cho mỗi document đọc/ghi")
+    parser.add_argument("--messages", type=int, default=2000, help="số message trong 1 session dài")
+    parser.add_argument("--reminders", type=int, default=5000)
+    parser.add_argument("--writes", type=int, default=200, help="số message ghi ở phần write-behind")
+    args = parser.parse_args()
+
+    db = MemoryFirestore(latency_ms=args.latency_ms, per_doc_ms=args.per_doc_ms)
+    firestore_service.set_db(db)
+    now = seed(db, args.messages, args.reminders)
+    print(f"RPC {args.latency_ms} ms + {args.per_doc_ms} ms/doc | {args.messages} message | {args.reminders} reminder")
+
+    session = db.collection("messages").where("sessionId", "==", "long").where("userId", "==", "u1")
+    report(
+        "lịch sử chat (2 cặp gần nhất)",
+        timed(db, lambda: firestore_service._pair_messages(firestore_service._load_history_legacy(session))[-2:]),
+        timed(db, lambda: firestore_service.load_chat_history("u1", "long", limit=2)),
+    )
+
+    store = FirestoreReminderStore(db)
+    report(
+        "reminder đến hạn",
+        timed(db, lambda: [r for r in store.load_active() if now - 300 <= (r["next_fire_ts"] or 0) <= now]),
+        timed(db, lambda: store.load_due(now - 300, now)),
+    )
+
+    def write_sync():
+        for i in range(args.writes):
+            db.collection("messages").add({"sessionId": "w", "text": f"m{i}"})
+
+    writer = FirestoreWriteBehind(lambda: db)
+    writer.start()
+
+    def write_behind():
+        start = time.perf_counter()
+        for i in range(args.writes):
+            writer.enqueue_message({"sessionId": "w", "text": f"m{i}"})
+        enqueue_ms = (time.perf_counter() - start) * 1000
+        writer.flush()
+        return enqueue_ms
+
+    old = timed(db, write_sync, repeat=1)
+    new = timed(db, write_behind, repeat=1)
+    writer.stop()
+    print(f"ghi {args.writes} message")
+    print(f"  cũ:  {old[0]:8.1f} ms chặn caller | {old[2]:3d} RPC")
+    print(f"  mới: {new[3]:8.1f} ms chặn caller | {new[2]:3d} RPC (commit nền {new[0]:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
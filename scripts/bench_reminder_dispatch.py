@@ -0,0 +1,116 @@
+"""Đo throughput gửi nhắc nhở: tuần tự (như cũ) vs ReminderDispatcher (song song + retry).
+
+Chạy mock endpoint thay cho Firebase Function sendMedicineReminder ngay trong process
+(độ trễ + tỉ lệ lỗi 503 cấu hình được), không gửi email thật.
+
+Chạy: python scripts/bench_reminder_dispatch.py [--reminders 300] [--latency 0.2] [--fail-rate 0.05]
+Chỉ chạy mock endpoint (để trỏ REMINDER_NOTIFY_URL vào khi test API server):
+      python scripts/bench_reminder_dispatch.py --serve --port 8765
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import argparse
+import asyncio
+import random
+import sys
+import threading
+import time
+
+import requests
+
+HERE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(HERE))
+
+from reminders.dispatcher import ReminderDispatcher  # noqa: E402
+
+
+def make_handler(latency: float, fail_rate: float, counter: dict):
+    class MockReminderHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            with counter["lock"]:
+                counter["requests"] += 1
+            status = 503 if random.random() < fail_rate else 200
+            self.send_response(status)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    return MockReminderHandler
+
+
+def start_mock(port: int, latency: float, fail_rate: float):
+    counter = {"requests": 0, "lock": threading.Lock()}
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency, fail_rate, counter))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, counter
+
+
+def fake_reminders(n: int):
+    return [
+        {"id": f"r{i}", "user_email": f"user{i}@example.com", "medicine_name": "Paracetamol", "time": "08:00"}
+        for i in range(n)
+    ]
+
+
+def run_sequential(url: str, reminders) -> float:
+    """Cách cũ: requests.post từng reminder, không retry, không dùng lại kết nối."""
+    start = time.perf_counter()
+    for r in reminders:
+        try:
+            requests.post(url, json={"email": r["user_email"], "medicine_name": r["medicine_name"]}, timeout=10)
+        except Exception:
+            pass
+    return time.perf_counter() - start
+
+
+def run_dispatcher(url: str, reminders, concurrency: int):
+    dispatcher = ReminderDispatcher(url=url, concurrency=concurrency, backoff=0.05)
+    start = time.perf_counter()
+    results = asyncio.run(dispatcher.send_many(reminders))
+    elapsed = time.perf_counter() - start
+    dispatcher.close()
+    return elapsed, sum(results), dispatcher.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reminders", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.2, help="độ trễ mỗi request của mock (giây)")
+    parser.add_argument("--fail-rate", type=float, default=0.05, help="tỉ lệ mock trả 503")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", action="store_true", help="chỉ chạy mock endpoint")
+    args = parser.parse_args()
+
+    server, counter = start_mock(args.port, args.latency, args.fail_rate)
+    url = f"http://127.0.0.1:{args.port}/sendMedicineReminder"
+    if args.serve:
+        print(f"🧪 Mock endpoint: {url} (latency={args.latency}s, fail_rate={args.fail_rate})")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    reminders = fake_reminders(args.reminders)
+    print(f"{args.reminders} reminder | latency {args.latency}s | fail {args.fail_rate:.0%}")
+
+    seq = run_sequential(url, reminders)
+    print(f"tuần tự:     {seq:7.2f}s  ({args.reminders / seq:7.1f} req/s)")
+
+    elapsed, ok, stats = run_dispatcher(url, reminders, args.concurrency)
+    print(
+        f"dispatcher:  {elapsed:7.2f}s  ({args.reminders / elapsed:7.1f} req/s)  "
+        f"thành công {ok}/{args.reminders}, retry {stats['retried']}, concurrency {args.concurrency}"
+    )
+    print(f"speedup:     {seq / elapsed:.1f}x | mock nhận {counter['requests']} request")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,11 @@ This file simply imports and runs the existing script to keep root tidy.
 """
 from pathlib import Path
 import runpy
+import sys
 
 
 HERE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(HERE))  # script ở root import app.settings
 SCRIPT = HERE / "build_faiss.py"
 
 if __name__ == "__main__":
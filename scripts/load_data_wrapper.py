@@ -2,9 +2,11 @@
 """
 from pathlib import Path
 import runpy
+import sys
 
 
 HERE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(HERE))  # script ở root import app.settings
 SCRIPT = HERE / "load_data.py"
 
 if __name__ == "__main__":
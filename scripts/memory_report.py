@@ -0,0 +1,61 @@
+"""Báo cáo bộ nhớ master gunicorn + từng worker (Linux, đọc /proc/<pid>/smaps_rollup).
+
+So sánh preload (models load trong master rồi fork) với mỗi worker tự load:
+    MODEL_PRELOAD=1 WEB_CONCURRENCY=4 gunicorn api_server:app -c gunicorn.conf.py
+    MODEL_PRELOAD=0 WEB_CONCURRENCY=4 gunicorn api_server:app -c gunicorn.conf.py
+rồi chạy (sau khi /ready báo ready): python scripts/memory_report.py <pid master>
+
+Tổng PSS = RAM thật cả nhóm process dùng; tổng RSS đếm trang dùng chung nhiều lần
+(≈ RAM cần nếu mỗi worker giữ 1 bản models riêng).
+"""
+from pathlib import Path
+import argparse
+import os
+import sys
+
+HERE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(HERE))
+
+from app.prefork import process_memory  # noqa: E402
+
+
+def children(pid: int):
+    result = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # "pid (comm) state ppid ..." — comm có thể chứa dấu cách nên tách sau dấu ")" cuối
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid and int(entry) != os.getpid():
+            result.append(int(entry))
+    return sorted(result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pid", type=int, help="pid master gunicorn")
+    args = parser.parse_args()
+
+    rows = [("master", process_memory(args.pid))]
+    rows += [(f"worker {i + 1}", process_memory(pid)) for i, pid in enumerate(children(args.pid))]
+    if "rss" not in rows[0][1]:
+        sys.exit(f"Không đọc được /proc/{args.pid}/smaps_rollup (cần Linux >= 4.14 và quyền đọc process)")
+
+    print(f"{'process':<10} {'pid':>7} {'RSS MB':>9} {'PSS MB':>9} {'chung MB':>9} {'riêng MB':>9}")
+    for name, mem in rows:
+        print(f"{name:<10} {mem['pid']:>7} {mem.get('rss', 0):>9.1f} {mem.get('pss', 0):>9.1f} "
+              f"{mem.get('shared', 0):>9.1f} {mem.get('private', 0):>9.1f}")
+    total_rss = sum(mem.get("rss", 0) for _, mem in rows)
+    total_pss = sum(mem.get("pss", 0) for _, mem in rows)
+    print(f"\nTổng PSS (RAM thật): {total_pss:.1f} MB")
+    print(f"Tổng RSS (nếu không chia sẻ trang): {total_rss:.1f} MB")
+    if total_pss:
+        print(f"Tiết kiệm nhờ chia sẻ: {total_rss - total_pss:.1f} MB ({(1 - total_pss / total_rss) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Sinh trước gợi ý tập luyện cho mọi nhóm profile (nhóm tuổi × giới tính × mức vận động × nhóm BMI).
+
+API server nạp file này khi khởi động (EXERCISE_SUGGESTIONS_FILE) → request gợi ý tập luyện
+trả về ngay từ cache, chỉ gọi Gemini cho nhóm chưa có / đã quá hạn.
+
+Chạy: python scripts/pregenerate_exercise_suggestions.py --output data/exercise_suggestions.json [--workers 4] [--all]
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import argparse
+import sys
+import time
+
+HERE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(HERE))
+
+from generator.exercise_suggestion import (  # noqa: E402
+    EXERCISE_SUGGESTIONS_FILE,
+    ExerciseSuggestionCache,
+    all_profile_keys,
+    key_to_str,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default=EXERCISE_SUGGESTIONS_FILE or "data/exercise_suggestions.json")
+    parser.add_argument("--workers", type=int, default=4, help="số request Gemini song song")
+    parser.add_argument("--all", action="store_true", help="sinh lại cả nhóm còn hạn")
+    args = parser.parse_args()
+
+    cache = ExerciseSuggestionCache()
+    loaded = cache.load(args.output)
+    keys = [key for key in all_profile_keys() if args.all or cache.needs_generation(key)]
+    print(f"{len(all_profile_keys())} nhóm | đã có {loaded} | cần sinh {len(keys)}")
+
+    start = time.perf_counter()
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(cache.refresh, key): key for key in keys}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                done += 1
+            except Exception as e:
+                failed += 1
+                print(f"⚠️ {key_to_str(futures[future])}: {e}")
+            if (done + failed) % 20 == 0:
+                cache.save(args.output)  # lưu dần, chạy lại sẽ bỏ qua nhóm đã có
+    cache.save(args.output)
+    print(f"✅ Sinh {done} nhóm, lỗi {failed}, {time.perf_counter() - start:.0f}s → {args.output}")
+
+
+if __name__ == "__main__":
+    main()
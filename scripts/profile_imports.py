@@ -0,0 +1,66 @@
+"""Đo thời gian import các entry point bằng `python -X importtime` (mỗi module 1 process mới).
+
+Chạy: python scripts/profile_imports.py [module ...] [--top 10]
+Mặc định đo chatbot, api_server, scheduler nhắc thuốc và app.settings; in tổng thời gian import,
+các module import chậm nhất và module nặng (torch, faiss, ...) nào bị kéo theo lúc import.
+"""
+from pathlib import Path
+import argparse
+import re
+import subprocess
+import sys
+
+HERE = Path(__file__).resolve().parent.parent
+
+DEFAULT_MODULES = ["app.settings", "chatbot", "api_server", "reminders.scheduler", "medicine_reminder_scheduler"]
+# Chỉ nên được import khi load models / gọi Gemini, không phải lúc import module
+HEAVY_MODULES = ["torch", "transformers", "faiss", "sentence_transformers", "google.generativeai"]
+
+# "import time: self [us] | cumulative | imported package"
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile(module: str):
+    code = (
+        f"import {module}, sys; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=str(HERE), capture_output=True, text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            # Độ thụt = độ sâu trong cây import; 1 dấu cách = module được import trực tiếp
+            rows.append((match.group(4), int(match.group(2)) / 1000, len(match.group(3))))
+    if proc.returncode != 0:
+        error = (proc.stderr.strip().splitlines() or ["?"])[-1]
+        return {"module": module, "error": error, "rows": rows}
+    heavy = [m for m in proc.stdout.strip().split(",") if m]
+    total = sum(ms for _, ms, depth in rows if depth == 1)
+    return {"module": module, "total_ms": total, "rows": rows, "heavy": heavy}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=8, help="số module import chậm nhất hiển thị")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        result = profile(module)
+        print(f"\n=== {module} ===")
+        if "error" in result:
+            print(f"❌ Import lỗi: {result['error']}")
+            continue
+        print(f"Tổng thời gian import: {result['total_ms']:.1f} ms")
+        print(f"Module nặng đã import: {', '.join(result['heavy']) or 'không có'}")
+        slowest = sorted(result["rows"], key=lambda row: row[1], reverse=True)[:args.top]
+        for name, ms, _ in slowest:
+            print(f"   {ms:>9.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
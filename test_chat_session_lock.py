@@ -0,0 +1,51 @@
+"""
+Kiểm tra run_chat_pipeline chạy tuần tự các lượt của cùng 1 session (API gọi pipeline trong
+threadpool) nhưng vẫn song song giữa các session khác nhau. Thân pipeline được thay bằng hàm giả
+(không cần models).
+
+Chạy: python -m pytest test_chat_session_lock.py
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import chatbot
+
+
+def _run_turns(monkeypatch, session_ids):
+    active = {}
+    peak = {"same_session": 0, "total": 0}
+    lock = threading.Lock()
+
+    def fake_turn(user_input, session_id, user_id, state):
+        with lock:
+            active[session_id] = active.get(session_id, 0) + 1
+            peak["same_session"] = max(peak["same_session"], active[session_id])
+            peak["total"] = max(peak["total"], sum(active.values()))
+        time.sleep(0.02)
+        state["conversation_history"].append((user_input, "ok"))
+        with lock:
+            active[session_id] -= 1
+        return {"session_id": session_id}
+
+    monkeypatch.setattr(chatbot, "_run_chat_turn", fake_turn)
+    with ThreadPoolExecutor(max_workers=len(session_ids)) as pool:
+        list(pool.map(lambda sid: chatbot.run_chat_pipeline("xin chào", session_id=sid), session_ids))
+    return peak
+
+
+def test_same_session_turns_are_serialized(monkeypatch):
+    peak = _run_turns(monkeypatch, ["lock-s1"] * 6)
+    assert peak["same_session"] == 1
+    assert len(chatbot.conversation_states["lock-s1"]["conversation_history"]) == 6
+    chatbot.reset_conversation("lock-s1")
+
+
+def test_different_sessions_run_in_parallel(monkeypatch):
+    sessions = [f"lock-p{i}" for i in range(4)]
+    peak = _run_turns(monkeypatch, sessions)
+    assert peak["same_session"] == 1
+    assert peak["total"] > 1
+    for session_id in sessions:
+        chatbot.reset_conversation(session_id)
@@ -0,0 +1,98 @@
+"""
+Kiểm tra FirestoreReminderStore (load_due, claim_many).
+
+Mặc định chạy trên Firestore giả lập trong bộ nhớ (firestore_memory.py). Để chạy trên emulator:
+    firebase emulators:start --only firestore   (trong thư mục AI-Web)
+    set FIRESTORE_EMULATOR_HOST=localhost:8080
+    python -m pytest test_due_reminders.py
+"""
+
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from firestore_memory import MemoryFirestore
+from reminders.store import FirestoreReminderStore
+
+
+def _client():
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        from google.cloud import firestore
+        return firestore.Client(project="demo-reminders")
+    return MemoryFirestore()
+
+
+@pytest.fixture
+def store():
+    db = _client()
+    collection = f"medicineReminders_{uuid.uuid4().hex[:8]}"
+    store = FirestoreReminderStore(db, page_size=3)  # page nhỏ để đi qua nhiều cursor
+    store.collection = collection
+    yield store
+    for doc in db.collection(collection).stream():
+        doc.reference.delete()
+
+
+def _add(store, reminder_id, fire_ts, active=True):
+    store.db.collection(store.collection).document(reminder_id).set({
+        "userId": "u1",
+        "userEmail": "u1@example.com",
+        "medicineName": f"thuoc {reminder_id}",
+        "time": "08:00",
+        "repeatType": "daily",
+        "isActive": active,
+        "notes": "uống sau ăn",
+        "createdAt": datetime.now(timezone.utc),  # không nằm trong projection
+        "nextReminderTime": datetime.fromtimestamp(fire_ts, tz=timezone.utc),
+    })
+
+
+def test_load_due_returns_only_window(store):
+    now = time.time()
+    due_ids = [f"due{i}" for i in range(7)]  # > page_size → phải phân trang
+    for i, reminder_id in enumerate(due_ids):
+        _add(store, reminder_id, now - 10 - i * 30)
+    _add(store, "too_old", now - 3600)
+    _add(store, "future", now + 600)
+    _add(store, "inactive", now - 20, active=False)
+
+    due = store.load_due(now - 300, now)
+
+    assert sorted(r["id"] for r in due) == sorted(due_ids)
+    # Sắp theo nextReminderTime tăng dần, không trùng giữa các trang
+    times = [r["next_fire_ts"] for r in due]
+    assert times == sorted(times)
+    assert abs(times[-1] - (now - 10)) < 1e-3
+    assert due[0]["medicine_name"].startswith("thuoc")
+    assert due[0]["user_email"] == "u1@example.com"
+    assert due[0]["notes"] == "uống sau ăn"
+
+
+def test_update_next_moves_reminder_out_of_window(store):
+    now = time.time()
+    _add(store, "r1", now - 5)
+    store.update_next("r1", now + 24 * 3600, sent=True)
+    assert store.load_due(now - 300, now) == []
+    store.update_next("r1", None, sent=False)
+    doc = store.db.collection(store.collection).document("r1").get().to_dict()
+    assert doc["isActive"] is False
+
+
+def test_claim_many_only_one_worker_wins(store):
+    from concurrent.futures import ThreadPoolExecutor
+
+    now = time.time()
+    for i in range(5):
+        _add(store, f"c{i}", now - 10 - i)
+    claims = [(f"c{i}", now - 10 - i, now - 10 - i + 24 * 3600) for i in range(5)]
+
+    # 4 "worker" claim cùng lúc: mỗi reminder chỉ được đúng 1 worker claim
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: store.claim_many(claims), range(4)))
+
+    claimed = [reminder_id for result in results for reminder_id in result]
+    assert sorted(claimed) == sorted(reminder_id for reminder_id, _, _ in claims)
+    assert store.load_due(now - 300, now) == []
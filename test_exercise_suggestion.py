@@ -0,0 +1,89 @@
+"""
+Kiểm tra cache gợi ý tập luyện (generator/exercise_suggestion.py) với hàm generate giả (không gọi Gemini):
+hit, quá hạn mềm (trả bản cũ + làm mới nền), quá hạn cứng khi Gemini lỗi (trả bản cũ), và nạp/lưu file
+sinh trước (bỏ qua file theo prompt cũ).
+
+Chạy: python -m pytest test_exercise_suggestion.py
+"""
+
+import json
+import threading
+import time
+
+import pytest
+
+from generator.exercise_suggestion import PROMPT_VERSION, ExerciseSuggestionCache, quantize_profile
+
+KEY = quantize_profile(25, "nam", "vua", 22.0)
+
+
+class FakeGenerate:
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.called = threading.Event()
+
+    def __call__(self, key):
+        self.calls += 1
+        self.called.set()
+        if self.fail:
+            raise RuntimeError("Gemini lỗi")
+        return {"title": f"Kế hoạch {self.calls}", "exercises": ["Đi bộ"]}
+
+
+def _cache(generate, age=None):
+    cache = ExerciseSuggestionCache(generate, ttl=100, refresh_after=10)
+    if age is not None:
+        cache._entries[KEY] = (time.time() - age, {"title": "Bản cũ", "exercises": ["Yoga"]})
+    return cache
+
+
+def test_hit_does_not_call_generate():
+    generate = FakeGenerate()
+    cache = _cache(generate)
+    first = cache.get(KEY)
+    first["title"] = "đã sửa"  # trả bản sao, không sửa được cache
+    assert cache.get(KEY)["title"] == "Kế hoạch 1"
+    assert generate.calls == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_stale_hit_returns_old_entry_and_refreshes_in_background():
+    generate = FakeGenerate()
+    cache = _cache(generate, age=50)
+    assert cache.get(KEY)["title"] == "Bản cũ"
+    assert generate.called.wait(2)
+    deadline = time.time() + 2
+    while cache.refreshes == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert cache.get(KEY)["title"] == "Kế hoạch 1"
+    assert cache.stats()["stale_hits"] == 1 and cache.refreshes == 1
+
+
+def test_expired_entry_is_served_when_generate_fails():
+    generate = FakeGenerate()
+    generate.fail = True
+    cache = _cache(generate, age=500)
+    assert cache.get(KEY)["title"] == "Bản cũ"
+    assert generate.calls == 1 and cache.errors == 1
+
+    # Chưa có bản nào → lỗi được ném ra
+    with pytest.raises(RuntimeError):
+        _cache(generate).get(KEY)
+
+
+def test_load_save_round_trip_and_prompt_version(tmp_path):
+    path = tmp_path / "suggestions.json"
+    cache = _cache(FakeGenerate())
+    cache.get(KEY)
+    cache.save(str(path))
+
+    restored = _cache(FakeGenerate())
+    assert restored.load(str(path)) == 1
+    assert restored.get(KEY)["title"] == "Kế hoạch 1"
+    assert restored.generate.calls == 0
+
+    data = json.loads(path.read_text(encoding="utf-8"))
+    data["prompt_version"] = PROMPT_VERSION - 1
+    path.write_text(json.dumps(data), encoding="utf-8")
+    assert _cache(FakeGenerate()).load(str(path)) == 0
@@ -0,0 +1,189 @@
+"""
+Kiểm tra Firestore giả lập (firestore_memory.py) và các đường đọc/ghi của firestore_service chạy trên nó.
+
+Chạy: python -m pytest test_firestore_memory.py
+"""
+
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+os.environ.setdefault("FIRESTORE_BACKEND", "memory")
+
+import firestore_memory  # noqa: E402
+import firestore_service  # noqa: E402
+from firestore_memory import Aborted, MemoryFirestore, NotFound, Query  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    client = MemoryFirestore()
+    firestore_service.set_db(client)
+    yield client
+    firestore_service.set_db(None)
+
+
+def _seed_messages(db, session_id, pairs):
+    t0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    batch = db.batch()
+    for i in range(pairs):
+        batch.set(db.collection("messages").document(), {
+            "sessionId": session_id, "userId": "u1", "role": "user", "text": f"q{i}",
+            "timestamp": t0 + timedelta(minutes=2 * i),
+        })
+        batch.set(db.collection("messages").document(), {
+            "sessionId": session_id, "userId": "u1", "role": "assistant", "text": f"a{i}", "aiResponse": f"a{i}",
+            "timestamp": t0 + timedelta(minutes=2 * i + 1),
+        })
+    batch.commit()
+
+
+def test_query_where_order_limit_select_cursor(db):
+    for i in range(10):
+        db.collection("items").document(f"d{i}").set({"n": i, "even": i % 2 == 0, "extra": "x"})
+    db.collection("items").document("no_n").set({"even": True})
+
+    query = db.collection("items").where("even", "==", True).order_by("n", direction=Query.DESCENDING)
+    first = query.limit(2).select(["n"]).get()
+    assert [doc.to_dict() for doc in first] == [{"n": 8}, {"n": 6}]
+    rest = query.start_after(first[-1]).get()
+    assert [doc.id for doc in rest] == ["d4", "d2", "d0"]  # thiếu field order_by → bị loại
+    assert [doc.id for doc in db.collection("items").where("n", "in", [1, 3]).stream()] == ["d1", "d3"]
+
+
+def test_batch_is_atomic_and_server_timestamp(db):
+    ref = db.collection("items").document("a")
+    batch = db.batch()
+    batch.set(ref, {"v": 1, "at": firestore_memory.SERVER_TIMESTAMP})
+    batch.update(db.collection("items").document("missing"), {"v": 2})
+    with pytest.raises(NotFound):
+        batch.commit()
+    assert not ref.get().exists
+
+    ref.set({"v": 1, "at": firestore_memory.SERVER_TIMESTAMP})
+    ref.set({"w": 2}, merge=True)
+    data = ref.get().to_dict()
+    assert data["v"] == 1 and data["w"] == 2 and isinstance(data["at"], datetime)
+
+
+def test_transaction_conflict_is_retried(db):
+    ref = db.collection("counters").document("c")
+    ref.set({"n": 0})
+
+    @firestore_memory.transactional
+    def increment(transaction):
+        snapshot = transaction.get(ref)
+        transaction.update(ref, {"n": snapshot.get("n") + 1})
+
+    threads = [threading.Thread(target=lambda: increment(db.transaction())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ref.get().get("n") == 8
+
+    stale = db.transaction()
+    stale.get(ref)
+    ref.update({"n": 100})
+    stale.update(ref, {"n": 0})
+    with pytest.raises(Aborted):
+        stale.commit()
+
+
+def test_collection_group_and_snapshot_listener(db):
+    profile = db.collection("users").document("u1").collection("healthProfile").document("profile")
+    profile.set({"tuoi": 30})
+    changed = []
+    watch = db.collection_group("healthProfile").on_snapshot(
+        lambda docs, changes, _: changed.extend(c.document.reference.parent.parent.id for c in changes)
+    )
+    assert changed == ["u1"]  # snapshot đầu tiên
+    profile.update({"tuoi": 31})
+    assert changed == ["u1", "u1"]
+    watch.unsubscribe()
+    profile.update({"tuoi": 32})
+    assert len(changed) == 2
+
+
+def test_load_chat_history_reads_only_recent_messages(db):
+    _seed_messages(db, "s1", 200)
+    db.reset_stats()
+    history = firestore_service.load_chat_history("u1", "s1", limit=2)
+    assert history == [("q198", "a198"), ("q199", "a199")]
+    assert db.stats()["reads"] <= 6
+
+    # Document cũ không có timestamp → fallback đọc toàn bộ (giữ thứ tự mặc định của Firestore: theo id)
+    db.collection("messages").document("legacy-1").set({"sessionId": "legacy", "text": "q"})
+    db.collection("messages").document("legacy-2").set({"sessionId": "legacy", "aiResponse": "a"})
+    assert firestore_service.load_chat_history(None, "legacy", limit=2) == [("q", "a")]
+
+
+def test_saved_user_assistant_pairs_reload_in_order(db):
+    # Câu hỏi và câu trả lời vào cùng 1 WriteBatch của write-behind → phải khác timestamp
+    for i in range(20):
+        firestore_service.save_chat_message("u1", "u1@example.com", f"pair{i}", f"q{i}", "user")
+        firestore_service.save_chat_message("u1", "u1@example.com", f"pair{i}", f"a{i}", "assistant")
+    assert firestore_service.get_chat_writer().flush()
+    for i in range(20):
+        assert firestore_service.load_chat_history("u1", f"pair{i}") == [(f"q{i}", f"a{i}")]
+
+
+def test_load_chat_history_breaks_timestamp_ties(db):
+    same = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    # Id document ngược thứ tự hội thoại: Firestore trả các message cùng timestamp theo id
+    rows = {
+        "z-q0": {"role": "user", "text": "q0"},
+        "y-a0": {"role": "assistant", "text": "a0", "aiResponse": "a0"},
+        "x-q1": {"role": "user", "text": "q1", "seq": 1},
+        "w-a1": {"role": "assistant", "text": "a1", "aiResponse": "a1", "seq": 2},
+    }
+    for doc_id, data in rows.items():
+        ts = same if "seq" not in data else same + timedelta(minutes=1)
+        db.collection("messages").document(doc_id).set({"sessionId": "tie", "userId": "u1", "timestamp": ts, **data})
+    assert firestore_service.load_chat_history("u1", "tie", limit=2) == [("q0", "a0"), ("q1", "a1")]
+
+    # Cùng timestamp, có seq → xếp theo seq
+    db.collection("messages").document("v-q2").set(
+        {"sessionId": "tie", "userId": "u1", "timestamp": same + timedelta(minutes=2), "role": "user", "text": "q2", "seq": 3}
+    )
+    db.collection("messages").document("u-a2").set(
+        {"sessionId": "tie", "userId": "u1", "timestamp": same + timedelta(minutes=2), "role": "assistant",
+         "text": "a2", "aiResponse": "a2", "seq": 4}
+    )
+    assert firestore_service.load_chat_history("u1", "tie", limit=1) == [("q2", "a2")]
+
+
+def test_health_profile_is_cached_until_invalidated(db):
+    ref = db.collection("users").document("u1").collection("healthProfile").document("profile")
+    ref.set({"tuoi": 30, "chieuCao": 170, "canNang": 65, "mucVanDong": "vua"})
+    db.reset_stats()
+    assert firestore_service.get_health_profile("u1")["tuoi"] == 30
+    ref.update({"tuoi": 31})
+    assert firestore_service.get_health_profile("u1")["tuoi"] == 30  # từ cache
+    assert db.stats()["reads"] == 1
+    firestore_service.invalidate_health_profile("u1")
+    assert firestore_service.get_health_profile("u1")["tuoi"] == 31
+
+
+def test_cache_listeners_drop_entries_written_by_frontend(db):
+    assert firestore_service.start_cache_listeners()
+    try:
+        ref = db.collection("users").document("u2").collection("healthProfile").document("profile")
+        ref.set({"tuoi": 40})
+        db.collection("medicineReminders").document("r1").set(
+            {"userId": "u2", "medicineName": "A", "time": "08:00", "repeatType": "daily", "isActive": True}
+        )
+        assert firestore_service.get_health_profile("u2")["tuoi"] == 40
+        assert len(firestore_service.get_medicine_reminders("u2")) == 1
+
+        # Frontend ghi thẳng vào Firestore (không qua invalidate của backend)
+        ref.update({"tuoi": 41})
+        db.collection("medicineReminders").document("r2").set(
+            {"userId": "u2", "medicineName": "B", "time": "20:00", "repeatType": "daily", "isActive": True}
+        )
+        assert firestore_service.get_health_profile("u2")["tuoi"] == 41
+        assert len(firestore_service.get_medicine_reminders("u2")) == 2
+    finally:
+        firestore_service.stop_cache_listeners()
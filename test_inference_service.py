@@ -0,0 +1,114 @@
+"""
+Kiểm tra inference service (inference/server.py + client.py) với model giả: đúng kết quả,
+request đồng thời của nhiều thread được gộp batch, client tự kết nối lại khi service restart.
+
+Chạy: python -m pytest test_inference_service.py
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from inference.client import InferenceClient, InferenceError, RemoteEncoder, RemoteIntentClassifier
+from inference.server import InferenceServer
+
+
+class FakeClassifier:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict_topk_batch(self, texts, k=2):
+        self.batch_sizes.append(len(texts))
+        time.sleep(0.01)  # giả lập 1 forward pass
+        return [[(f"intent_{len(t)}", 0.9), ("khac", 0.1)][:k] for t in texts]
+
+
+def fake_encode(sentences, normalize):
+    embs = np.array([[len(s), 1.0, 0.0] for s in sentences], dtype=np.float32)
+    if normalize:
+        embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    return embs
+
+
+class RunningServer:
+    def __init__(self, address):
+        self.address = address
+        self.classifier = FakeClassifier()
+        self.server = InferenceServer(self.classifier, fake_encode, max_batch=16, wait_ms=5)
+        self.loop = asyncio.new_event_loop()
+        self._task = None
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            started = asyncio.Event()
+            self._task = self.loop.create_task(self.server.serve(address, started))
+            self.loop.run_until_complete(started.wait())
+            ready.set()
+            try:
+                self.loop.run_until_complete(self._task)
+            except asyncio.CancelledError:
+                pass
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        assert ready.wait(5)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._task.cancel)
+        self.thread.join(5)
+
+
+@pytest.fixture
+def address(tmp_path):
+    return f"unix:{tmp_path / 'inference.sock'}"
+
+
+@pytest.fixture
+def service(address):
+    running = RunningServer(address)
+    yield running
+    running.stop()
+
+
+def test_intent_and_encode_match_local_interface(service, address):
+    classifier = RemoteIntentClassifier(address)
+    assert classifier.predict_topk("xin chào", k=2) == [("intent_8", 0.9), ("khac", 0.1)]
+    assert classifier.predict_topk("ho", k=1) == [("intent_2", 0.9)]
+
+    encoder = RemoteEncoder(address)
+    embs = encoder.encode(["ab", "abcd"])
+    assert embs.shape == (2, 3) and embs.dtype == np.float32
+    np.testing.assert_allclose(embs, fake_encode(["ab", "abcd"], False))
+    single = encoder.encode("ab", normalize_embeddings=True)
+    assert single.shape == (3,)
+    assert np.isclose(np.linalg.norm(single), 1.0)
+
+
+def test_concurrent_requests_are_batched(service, address):
+    classifier = RemoteIntentClassifier(address)
+    texts = [f"câu {'x' * i}" for i in range(40)]
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        results = list(pool.map(lambda t: classifier.predict_topk(t, k=1), texts))
+    assert results == [[(f"intent_{len(t)}", 0.9)] for t in texts]
+    assert sum(service.classifier.batch_sizes) == len(texts)
+    assert max(service.classifier.batch_sizes) > 1
+    assert len(service.classifier.batch_sizes) < len(texts)
+
+
+def test_client_reconnects_after_restart(address):
+    client = InferenceClient(address, timeout=2)
+    first = RunningServer(address)
+    assert "pid" in client.ping()
+    first.stop()
+    with pytest.raises(InferenceError):
+        client.ping()
+    second = RunningServer(address)
+    try:
+        assert "pid" in client.ping()
+    finally:
+        second.stop()
@@ -0,0 +1,118 @@
+"""
+Kiểm tra SystemInstructionCache (generator/instruction_cache.py) với SDK Gemini giả:
+tạo cached content ngoài lock (1 lần cho mỗi instruction), invalidate xóa cache cũ trên server,
+chỉ lỗi "cache không còn" mới làm tạo lại cache, và instruction dưới mức token tối thiểu không tạo cache.
+
+Chạy: python -m pytest test_instruction_cache.py
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import generator.instruction_cache as instruction_cache
+from generator.instruction_cache import SystemInstructionCache, is_cache_unavailable, min_cache_tokens
+
+
+class FakeCache:
+    def __init__(self, name):
+        self.name = name
+        self.deleted = False
+
+    def delete(self):
+        self.deleted = True
+
+
+class FakeGenai:
+    def __init__(self, create_delay=0.0):
+        self.created = []
+        self.create_delay = create_delay
+        self.slow_instructions = set()
+
+        def create(model, display_name, system_instruction, ttl):
+            if system_instruction in self.slow_instructions:
+                time.sleep(self.create_delay)
+            cache = FakeCache(f"cachedContents/{len(self.created)}")
+            self.created.append(cache)
+            return cache
+
+        self.caching = SimpleNamespace(CachedContent=SimpleNamespace(create=create))
+        self.GenerativeModel = lambda model_name, system_instruction=None: object()
+        self.GenerativeModel.from_cached_content = lambda cached_content: object()
+
+
+@pytest.fixture
+def fake_genai(monkeypatch):
+    fake = FakeGenai(create_delay=0.3)
+    monkeypatch.setattr(instruction_cache, "genai", fake)
+    return fake
+
+
+def test_slow_create_does_not_block_other_instructions(fake_genai):
+    cache = SystemInstructionCache(enabled=True, ttl=3600, min_tokens=1)
+    cache.get_model("gemini", "instruction A")
+    fake_genai.slow_instructions.add("instruction B")
+
+    with ThreadPoolExecutor(max_workers=9) as pool:
+        slow = [pool.submit(cache.get_model, "gemini", "instruction B") for _ in range(8)]
+        time.sleep(0.05)  # các thread đang chờ tạo cache cho B
+        started = time.time()
+        cache.get_model("gemini", "instruction A")
+        assert time.time() - started < 0.1
+        models = {id(f.result()) for f in slow}
+
+    assert len(models) == 1  # 8 lời gọi đồng thời dùng chung 1 lần tạo
+    assert len(fake_genai.created) == 2
+
+
+def test_invalidate_deletes_server_cache_once(fake_genai):
+    cache = SystemInstructionCache(enabled=True, ttl=3600, min_tokens=1)
+    old_model = cache.get_model("gemini", "instruction")
+    old_cache = fake_genai.created[0]
+
+    cache.invalidate("gemini", "instruction", old_model)
+    assert old_cache.deleted
+    new_model = cache.get_model("gemini", "instruction")
+    assert new_model is not old_model
+
+    # Thread khác báo lỗi trên model cũ sau khi đã tạo lại → giữ bản mới
+    cache.invalidate("gemini", "instruction", old_model)
+    assert cache.get_model("gemini", "instruction") is new_model
+    assert not fake_genai.created[1].deleted
+
+
+class NotFound(Exception):
+    pass
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class PermissionDenied(Exception):
+    pass
+
+
+def test_only_missing_cache_errors_trigger_recreate():
+    assert is_cache_unavailable(NotFound("404 not found"))
+    assert is_cache_unavailable(PermissionDenied("403 CachedContent not found (or permission denied)"))
+    assert not is_cache_unavailable(ResourceExhausted("429 Resource has been exhausted (e.g. check quota)."))
+    assert not is_cache_unavailable(RuntimeError("500 Internal error"))
+    assert not is_cache_unavailable(threading.ThreadError("timeout"))
+
+
+def test_short_instruction_skips_cached_content(fake_genai):
+    cache = SystemInstructionCache(enabled=True, ttl=3600)
+    assert min_cache_tokens("gemini-2.5-flash") == 1024 and min_cache_tokens("gemini-2.5-pro") == 4096
+    greeting = "Bạn là trợ lý y tế thân thiện, chuyên nghiệp. Trả lời ngắn gọn, tự nhiên."
+    model = cache.get_model("gemini-2.5-flash", greeting)
+    assert cache.get_model("gemini-2.5-flash", greeting) is model  # fallback tạo 1 lần, dùng lại
+    assert fake_genai.created == []
+    assert cache.stats()["too_short"] == 1 and cache.stats()["fallbacks"] == 0
+
+    long_instruction = "Bạn là trợ lý y tế. " * 200  # ~1330 token ước lượng
+    cache.get_model("gemini-2.5-flash", long_instruction)
+    assert len(fake_genai.created) == 1
@@ -0,0 +1,80 @@
+"""
+Kiểm tra StreamingJSONValidator (generator/json_stream.py) với schema gợi ý tập luyện.
+
+Chạy: python -m pytest test_json_stream.py
+"""
+
+import json
+
+import pytest
+
+from generator.exercise_suggestion import EXERCISE_SCHEMA, normalize_suggestion
+from generator.json_stream import JSONSchemaError, StreamingJSONValidator
+
+VALID = {
+    "title": "Kế hoạch {tăng cơ}",
+    "exercises": ["Đi bộ \"nhanh\" 30 phút", "Squat [3x12]", "Đi bộ \"nhanh\" 30 phút"],
+    "frequency": "3-4 lần/tuần",
+    "duration": "30-40 phút/buổi",
+    "notes": "Uống đủ nước, ngủ đủ giấc",
+}
+
+
+def _feed_in_chunks(text, size):
+    validator = StreamingJSONValidator(EXERCISE_SCHEMA)
+    for i in range(0, len(text), size):
+        validator.feed(text[i:i + size])
+    return validator
+
+
+@pytest.mark.parametrize("size", [1, 7, 1000])
+def test_valid_object_any_chunking(size):
+    text = json.dumps(VALID, ensure_ascii=False, indent=2)
+    assert _feed_in_chunks(text, size).close() == VALID
+
+
+@pytest.mark.parametrize("text, stop_at", [
+    ('Đây là kế hoạch: {"title": "x"}', "Đ"),  # text tự do thay vì JSON
+    ('{"title": "x", "exercises": "Đi bộ"}', 'exercises": "'),  # sai kiểu
+    ('{"title": "x", "exercises": ["Đi bộ", {"name": "Bơi"}]}', ", {"),  # phần tử mảng sai kiểu
+])
+def test_fails_early(text, stop_at):
+    validator = StreamingJSONValidator(EXERCISE_SCHEMA)
+    with pytest.raises(JSONSchemaError):
+        for ch in text:
+            validator.feed(ch)
+    # Dừng ngay tại ký tự sai, không cần đọc hết response
+    assert validator.text == text[:text.index(stop_at) + len(stop_at)]
+
+
+def test_unknown_field_accepted_like_full_validate():
+    value = {**VALID, "plan": {"a": [1, "b"]}, "level": 2}
+    assert _feed_in_chunks(json.dumps(value, ensure_ascii=False), 5).close() == value
+
+
+@pytest.mark.parametrize("size", [1, 4, 1000])
+def test_markdown_fence_is_stripped(size):
+    body = json.dumps(VALID, ensure_ascii=False, indent=2)
+    for text in (f"```json\n{body}\n```", f"\n  ```\n{body}```\n", f"```json{body}```"):
+        assert _feed_in_chunks(text, size).close() == VALID
+    # Text thừa sau fence đóng vẫn bị từ chối
+    with pytest.raises(JSONSchemaError):
+        _feed_in_chunks(f"```json\n{body}\n```\nChúc bạn khỏe!", size)
+
+
+def test_missing_required_field_fails_on_close_brace():
+    validator = StreamingJSONValidator(EXERCISE_SCHEMA)
+    with pytest.raises(JSONSchemaError, match="notes"):
+        validator.feed('{"title": "x", "exercises": [], "frequency": "a", "duration": "b"}')
+
+
+def test_truncated_response_fails_on_close():
+    validator = _feed_in_chunks(json.dumps(VALID)[:-10], 16)
+    with pytest.raises(JSONSchemaError):
+        validator.close()
+
+
+def test_normalize_suggestion_dedupes_and_fills_fallback():
+    suggestion = normalize_suggestion(VALID)
+    assert suggestion["exercises"] == ["Đi bộ \"nhanh\" 30 phút", "Squat [3x12]"]
+    assert normalize_suggestion({**VALID, "exercises": []})["exercises"]
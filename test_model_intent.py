@@ -1,9 +1,13 @@
+import os
+
 import torch
 import torch.nn.functional as F
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 
 # ====== ĐƯỜNG DẪN MODEL INTENT ======
-MODEL_PATH = r"D:\CHAT BOT TTCS\model\phobert_intent_model_v5"  
+from app.settings import MODEL_DIR
+
+MODEL_PATH = os.path.join(MODEL_DIR, "phobert_intent_model_v5")
 # ====== Load model ======
 tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH, use_fast=False)
 model = AutoModelForSequenceClassification.from_pretrained(MODEL_PATH)
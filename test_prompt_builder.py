@@ -0,0 +1,73 @@
+"""
+Kiểm tra ghép prompt theo ngân sách token (generator/prompt_builder.py): thứ tự cắt khi vượt
+tổng ngân sách (lịch sử trước, context sau), lịch sử giữ lượt gần nhất, context giữ đoạn đầu
+(liên quan nhất), câu hỏi không bao giờ bị cắt.
+
+Chạy: python -m pytest test_prompt_builder.py
+"""
+
+from generator.prompt_builder import TRUNCATION_MARKER, PromptSection, build_prompt
+
+
+def _sections(history_turns=20, context_docs=20, question="tôi bị ho khan 3 ngày nay, có cần đi khám không?"):
+    history = "\n".join(f"User: câu hỏi số {i}\nBot: câu trả lời số {i}" for i in range(history_turns))
+    context = "\n\n".join(f"[ĐOẠN {i}]\nnội dung đoạn số {i} " + "x" * 60 for i in range(context_docs))
+    return [
+        PromptSection("history", history, header="== LỊCH SỬ ==", footer="==", priority=0, keep="tail"),
+        PromptSection("context", context, header="== KIẾN THỨC ==", footer="==", priority=1,
+                      keep="head", separator="\n\n"),
+        PromptSection("question", question, header="== CÂU HỎI ==", footer="=="),
+        PromptSection("instructions", "Trả lời:"),
+    ]
+
+
+def test_within_budget_unchanged():
+    sections = _sections(history_turns=1, context_docs=1)
+    expected = "\n".join(s.render() for s in sections)
+    prompt, metrics = build_prompt(sections, max_total_tokens=100000)
+    assert prompt == expected
+    assert metrics["truncated"] == []
+
+
+def test_history_cut_first_keeping_latest_turns():
+    sections = _sections()
+    full = sum(s.tokens() for s in sections)
+    history_tokens = sections[0].tokens()
+    # Chỉ thiếu ít hơn phần lịch sử → context không bị đụng tới
+    prompt, metrics = build_prompt(sections, max_total_tokens=full - history_tokens // 2)
+    assert metrics["truncated"] == ["history"]
+    assert "câu trả lời số 19" in prompt and "câu hỏi số 0\n" not in prompt
+    assert "== LỊCH SỬ ==\n" + TRUNCATION_MARKER in prompt
+    assert "[ĐOẠN 19]" in prompt
+    assert metrics["total_tokens"] <= full - history_tokens // 2
+
+
+def test_context_cut_after_history_keeping_first_docs():
+    sections = _sections()
+    question_tokens = sections[2].tokens() + sections[3].tokens()
+    budget = question_tokens + 150
+    prompt, metrics = build_prompt(sections, max_total_tokens=budget)
+    assert metrics["truncated"] == ["history", "context"]
+    # Lịch sử bị bỏ hết → bỏ luôn header/footer
+    assert "== LỊCH SỬ ==" not in prompt
+    assert "[ĐOẠN 0]" in prompt and "[ĐOẠN 19]" not in prompt
+    assert prompt.index("[ĐOẠN 0]") < prompt.index(TRUNCATION_MARKER)
+    assert metrics["total_tokens"] <= budget
+
+
+def test_question_never_cut():
+    question = "tôi bị đau bụng âm ỉ bên phải sau khi ăn, kèm buồn nôn, " * 3
+    sections = _sections(question=question)
+    prompt, metrics = build_prompt(sections, max_total_tokens=10)
+    assert question in prompt
+    assert "question" not in metrics["truncated"]
+    assert prompt.rstrip().endswith("Trả lời:")
+
+
+def test_empty_context_section_keeps_header():
+    sections = [
+        PromptSection("context", "", header="== KIẾN THỨC ==", footer="==", priority=1),
+        PromptSection("question", "ho", header="== CÂU HỎI ==", footer="=="),
+    ]
+    prompt, _ = build_prompt(sections, max_total_tokens=100000)
+    assert prompt == "== KIẾN THỨC ==\n\n==\n== CÂU HỎI ==\nho\n=="
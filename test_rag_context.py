@@ -0,0 +1,121 @@
+"""
+Kiểm tra phần RAG không cần model: chọn context bằng MMR (rag/context_selector.py), gộp top-k
+giữa các intent và cache kết quả search của Retriever (rag/retriever.py) với index/embedder giả.
+
+Chạy: python -m pytest test_rag_context.py
+"""
+
+import numpy as np
+
+import chatbot
+from rag.context_selector import format_context, select_context
+from rag.retriever import Retriever
+
+
+def _unit(*values):
+    v = np.array(values, dtype="float32")
+    return v / np.linalg.norm(v)
+
+
+# ============================
+# MMR
+# ============================
+def test_mmr_skips_near_duplicates_and_prefers_diverse_docs():
+    docs = [
+        {"text": "sốt cao nên uống nhiều nước", "cosine": 0.90},
+        {"text": "sốt cao cần uống nhiều nước", "cosine": 0.89},  # gần trùng đoạn 0
+        {"text": "sốt kéo dài trên 3 ngày cần đi khám", "cosine": 0.80},
+        {"text": "nghỉ ngơi và theo dõi nhiệt độ", "cosine": 0.70},
+    ]
+    vectors = np.stack([_unit(1, 0, 0), _unit(1, 0.01, 0), _unit(0.6, 0.8, 0), _unit(0.5, 0, 0.86)])
+    selected = select_context(docs, vectors, max_docs=3, dedup_threshold=0.95)
+    assert [d["text"] for d in selected] == [docs[0]["text"], docs[2]["text"], docs[3]["text"]]
+
+
+def test_mmr_without_vectors_dedups_exact_text_and_respects_budget():
+    docs = [
+        {"text": "a" * 30, "cosine": 0.9},
+        {"text": "a" * 30, "cosine": 0.8},
+        {"text": "b" * 300, "cosine": 0.7},  # vượt ngân sách → bỏ qua, thử đoạn sau
+        {"text": "c" * 30, "cosine": 0.6},
+    ]
+    selected = select_context(docs, None, max_docs=5, token_budget=30)
+    assert [d["text"][0] for d in selected] == ["a", "c"]
+    # Đoạn đầu luôn được giữ dù vượt ngân sách
+    assert select_context(docs[2:], None, max_docs=5, token_budget=10) == [docs[2]]
+    assert format_context(selected[:1]) == "[ĐOẠN 1]\n" + "a" * 30
+
+
+# ============================
+# RETRIEVER: TOP-K + CACHE
+# ============================
+class FakeIndex:
+    def __init__(self, vectors):
+        self.vectors = np.asarray(vectors, dtype="float32")
+        self.searches = 0
+
+    def search(self, query, k):
+        self.searches += 1
+        scores = query @ self.vectors.T
+        order = np.argsort(-scores[0])[:k]
+        padded_scores = np.full((1, k), -1.0, dtype="float32")
+        padded_ids = np.full((1, k), -1, dtype="int64")
+        padded_scores[0, :len(order)] = scores[0, order]
+        padded_ids[0, :len(order)] = order
+        return padded_scores, padded_ids
+
+    def reconstruct(self, i):
+        return self.vectors[i]
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, sentences):
+        self.calls += 1
+        return np.array([[1.0, 0.2, 0.0] for _ in sentences], dtype="float32")
+
+
+def _retriever():
+    retriever = Retriever("unused", embedder=FakeEmbedder())
+    retriever.available_intents = ["bao_ho", "bao_sot"]
+    data = {
+        "bao_ho": [_unit(1, 0, 0), _unit(0, 1, 0)],
+        "bao_sot": [_unit(1, 0.3, 0)],  # ít hơn k vector → FAISS trả idx -1
+    }
+    for intent, vectors in data.items():
+        retriever._intent_indexes[intent] = FakeIndex(vectors)
+        retriever._intent_documents[intent] = [f"{intent}-{i}" for i in range(len(vectors))]
+    return retriever
+
+
+def test_search_all_intents_merges_top_k_and_drops_padding():
+    retriever = _retriever()
+    results = retriever.search_all_intents("ho có đờm", k=3)
+    assert [r["text"] for r in results] == ["bao_sot-0", "bao_ho-0", "bao_ho-1"]
+    assert all(r["doc_index"] >= 0 for r in results)
+    cosines = [r["cosine"] for r in results]
+    assert cosines == sorted(cosines, reverse=True)
+    vectors = retriever.doc_vectors(results)
+    assert vectors.shape == (3, 3)
+
+    # Field nội bộ (vị trí vector) không lộ ra response["sources"] của /api/chat
+    sources = chatbot._public_sources(results)
+    assert [set(source) for source in sources] == [{"text", "cosine", "confidence"}] * 3
+    assert "doc_index" in results[0]
+
+
+def test_result_cache_hits_and_returns_copies():
+    retriever = _retriever()
+    first = retriever.search_by_intent("bao_ho", "Ho  có đờm", k=2)
+    first[0]["text"] = "đã sửa"
+    second = retriever.search_by_intent("bao_ho", "ho có ĐỜM", k=2)  # cùng câu sau khi chuẩn hoá
+    assert second[0]["text"] == "bao_ho-0"
+    assert retriever.embedder.calls == 1
+    assert retriever._intent_indexes["bao_ho"].searches == 1
+    assert retriever.cache_stats()["hits"] == 1
+
+    # Build lại index → cache cũ không được dùng nữa
+    retriever.reload_indexes()
+    assert retriever.cache_stats()["index_generation"] == 1
@@ -0,0 +1,81 @@
+"""
+Kiểm tra reminders/recurrence.py: lần nhắc kế tiếp của daily/weekly/once, giới hạn
+start_date/end_date và dời đúng lịch khi bỏ lỡ nhiều lần nhắc (server tắt nhiều ngày).
+
+Chạy: python -m pytest test_recurrence.py
+"""
+
+from datetime import datetime
+
+import pytest
+
+from reminders.recurrence import next_fire_after, next_fire_time, parse_time, upcoming_fire_times
+
+# Thứ 4, 15/01/2025 10:00
+NOW = datetime(2025, 1, 15, 10, 0)
+
+
+def test_parse_time():
+    assert parse_time("08:30").hour == 8 and parse_time("08:30").minute == 30
+    assert parse_time("21:05:09").second == 9
+    for bad in ("8h", "25:00", "08:61", "1:2:3:4", ""):
+        with pytest.raises(ValueError):
+            parse_time(bad)
+
+
+def test_daily_today_or_tomorrow():
+    assert next_fire_time({"time": "20:00", "repeat_type": "daily"}, NOW) == datetime(2025, 1, 15, 20, 0)
+    # Giờ nhắc hôm nay đã qua (kể cả đúng bằng now) → ngày mai
+    assert next_fire_time({"time": "08:00", "repeat_type": "daily"}, NOW) == datetime(2025, 1, 16, 8, 0)
+    assert next_fire_time({"time": "10:00", "repeat_type": "daily"}, NOW) == datetime(2025, 1, 16, 10, 0)
+
+
+def test_weekly_uses_weekday_or_start_date():
+    # weekday 0 = thứ 2 → thứ 2 tuần sau
+    reminder = {"time": "09:00", "repeat_type": "weekly", "weekday": 0}
+    assert next_fire_time(reminder, NOW) == datetime(2025, 1, 20, 9, 0)
+    # Cùng thứ, giờ đã qua → tuần sau
+    reminder = {"time": "09:00", "repeat_type": "weekly", "weekday": 2}
+    assert next_fire_time(reminder, NOW) == datetime(2025, 1, 22, 9, 0)
+    # Không có weekday → thứ của start_date (thứ 6)
+    reminder = {"time": "09:00", "repeat_type": "weekly", "start_date": "2025-01-10"}
+    assert next_fire_time(reminder, NOW) == datetime(2025, 1, 17, 9, 0)
+    times = upcoming_fire_times({"time": "09:00", "repeat_type": "weekly", "weekday": 4}, NOW, 3)
+    assert times == [datetime(2025, 1, 17, 9, 0), datetime(2025, 1, 24, 9, 0), datetime(2025, 1, 31, 9, 0)]
+
+
+def test_once_only_on_start_date():
+    reminder = {"time": "12:00", "repeat_type": "once", "start_date": "2025-01-15"}
+    assert next_fire_time(reminder, NOW) == datetime(2025, 1, 15, 12, 0)
+    assert next_fire_time(reminder, datetime(2025, 1, 15, 13, 0)) is None
+    assert upcoming_fire_times(reminder, NOW, 5) == [datetime(2025, 1, 15, 12, 0)]
+    # Không lặp lại → không có lần kế tiếp sau khi đã nhắc
+    assert next_fire_after(reminder, datetime(2025, 1, 15, 12, 0).timestamp(), NOW.timestamp()) is None
+
+
+def test_start_and_end_bounds():
+    reminder = {"time": "08:00", "repeat_type": "daily", "start_date": "2025-02-01", "end_date": "2025-02-03"}
+    assert next_fire_time(reminder, NOW) == datetime(2025, 2, 1, 8, 0)
+    # Cả 2 đầu đều tính
+    assert upcoming_fire_times(reminder, NOW, 10) == [
+        datetime(2025, 2, 1, 8, 0), datetime(2025, 2, 2, 8, 0), datetime(2025, 2, 3, 8, 0)
+    ]
+    assert next_fire_time(reminder, datetime(2025, 2, 3, 9, 0)) is None
+    # end_date dạng datetime ISO vẫn tính theo ngày
+    reminder = {"time": "08:00", "repeat_type": "daily", "end_date": "2025-01-16T00:00:00"}
+    assert next_fire_time(reminder, NOW) == datetime(2025, 1, 16, 8, 0)
+
+
+def test_catch_up_skips_missed_fires():
+    # Lần nhắc 10/01 08:00 bị lỡ (server tắt 5 ngày) → lần kế tiếp sau now, không gửi dồn
+    fire_ts = datetime(2025, 1, 10, 8, 0).timestamp()
+    daily = {"time": "08:00", "repeat_type": "daily"}
+    assert next_fire_after(daily, fire_ts, NOW.timestamp()) == datetime(2025, 1, 16, 8, 0).timestamp()
+    weekly = {"time": "08:00", "repeat_type": "weekly", "weekday": 4}
+    assert next_fire_after(weekly, fire_ts, NOW.timestamp()) == datetime(2025, 1, 17, 8, 0).timestamp()
+    # Hết hạn trong lúc server tắt → không còn lần nhắc
+    ended = {"time": "08:00", "repeat_type": "daily", "end_date": "2025-01-12"}
+    assert next_fire_after(ended, fire_ts, NOW.timestamp()) is None
+    # Không lỡ: lần kế tiếp tính từ lần nhắc vừa rồi
+    on_time = datetime(2025, 1, 15, 8, 0).timestamp()
+    assert next_fire_after(daily, on_time, on_time + 5) == datetime(2025, 1, 16, 8, 0).timestamp()
@@ -0,0 +1,132 @@
+"""
+Kiểm tra claim-then-send: nhiều scheduler (mô phỏng nhiều worker uvicorn / replica) cùng xử lý
+một kho reminder thì mỗi lần nhắc chỉ được gửi đúng 1 lần.
+
+Dùng MemoryReminderStore làm kho chung (không cần Firestore).
+Chạy: python -m pytest test_reminder_claims.py
+"""
+
+import asyncio
+from collections import Counter
+from datetime import datetime
+
+from reminders.scheduler import ReminderScheduler
+from reminders.store import MemoryReminderStore
+
+
+class FakeDispatcher:
+    """Ghi lại các reminder được gửi, nhường event loop để các worker chạy xen kẽ nhau."""
+
+    def __init__(self, sent: Counter):
+        self.sent = sent
+
+    async def send_many(self, reminders):
+        results = []
+        for reminder in reminders:
+            await asyncio.sleep(0)
+            self.sent[reminder["id"]] += 1
+            results.append(True)
+        return results
+
+    def stats(self):
+        return {}
+
+
+def _reminders(now: float, count: int):
+    reminders = {}
+    for i in range(count):
+        reminders[f"r{i}"] = {
+            "user_email": f"user{i}@example.com",
+            "medicine_name": "Paracetamol",
+            "time": "08:00",
+            "repeat_type": "once" if i % 3 == 0 else "daily",
+            "is_active": True,
+            "next_reminder_time": datetime.fromtimestamp(now - 30 - i).isoformat(),
+        }
+    return reminders
+
+
+def test_concurrent_workers_send_each_reminder_once():
+    now = datetime.now().timestamp()
+    store = MemoryReminderStore(_reminders(now, 50))
+    sent = Counter()
+    workers = [ReminderScheduler(store, FakeDispatcher(sent), batch_size=7) for _ in range(4)]
+    for worker in workers:
+        assert worker.load() == 50
+
+    async def run_all():
+        return await asyncio.gather(*(worker.run_due(now) for worker in workers))
+
+    results = asyncio.run(run_all())
+
+    assert sum(results) == 50
+    assert set(sent) == set(store.reminders)
+    assert all(count == 1 for count in sent.values())
+    assert sum(worker.conflicts for worker in workers) == 50 * (len(workers) - 1)
+
+    # Reminder lặp lại đã được dời sang ngày hôm sau, reminder "once" đã tắt
+    for reminder_id, reminder in store.reminders.items():
+        assert reminder["last_sent"]
+        if reminder["repeat_type"] == "once":
+            assert reminder["is_active"] is False
+        else:
+            assert datetime.fromisoformat(reminder["next_reminder_time"]).timestamp() > now
+
+    # Chạy lại với cùng thời điểm: không còn gì để gửi
+    asyncio.run(run_all())
+    assert all(count == 1 for count in sent.values())
+
+
+def test_claim_fails_when_reminder_already_moved():
+    now = datetime.now().timestamp()
+    store = MemoryReminderStore(_reminders(now, 2))
+    fire_ts = now - 30
+    assert store.claim_many([("r0", fire_ts, None), ("r1", fire_ts - 1, fire_ts + 86400)]) == {"r0", "r1"}
+    # Lần claim thứ 2 với cùng fire_ts (worker khác) thất bại
+    assert store.claim_many([("r0", fire_ts, None), ("r1", fire_ts - 1, fire_ts + 86400)]) == set()
+
+
+def test_malformed_reminder_does_not_block_batch():
+    now = datetime.now().timestamp()
+    reminders = _reminders(now, 6)
+    for reminder in reminders.values():
+        reminder["repeat_type"] = "daily"
+    reminders["r5"]["time"] = "8h"
+    store = MemoryReminderStore(reminders)
+    sent = Counter()
+    worker = ReminderScheduler(store, FakeDispatcher(sent), batch_size=10)
+    assert worker.load() == 6
+
+    assert asyncio.run(worker.run_due(now)) == 5
+    assert set(sent) == {f"r{i}" for i in range(5)}
+    assert worker.invalid == 1
+    # 5 reminder hợp lệ vẫn được dời sang lần kế tiếp, reminder sai bị bỏ khỏi lịch
+    stats = worker.stats()
+    assert stats["scheduled"] == 5 and stats["invalid"] == 1
+    assert asyncio.run(worker.run_due(now)) == 0
+
+
+def test_reminder_added_to_store_after_load_is_sent():
+    now = datetime.now().timestamp()
+    reminders = _reminders(now, 2)
+    store = MemoryReminderStore(reminders)
+    sent = Counter()
+    worker = ReminderScheduler(store, FakeDispatcher(sent), sync_interval=60)
+    assert worker.load() == 2
+
+    # Web app ghi thẳng reminder vào store (không qua API create_reminder → không gọi schedule)
+    reminders["web"] = {
+        **reminders["r1"],
+        "repeat_type": "daily",
+        "next_reminder_time": datetime.fromtimestamp(now + 90).isoformat(),
+    }
+
+    async def run():
+        assert await worker.run_due(now) == 2
+        assert await worker.sync(now) == 1  # trong cửa sổ 2 chu kỳ sync → vào heap trước giờ nhắc
+        assert await worker.sync(now) == 0  # đã có trong heap với cùng thời điểm
+        return await worker.run_due(now + 100)
+
+    assert asyncio.run(run()) == 1
+    assert sent["web"] == 1
+    assert worker.stats()["synced"] == 1
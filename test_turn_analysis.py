@@ -0,0 +1,22 @@
+"""
+Kiểm tra cache phân tích lượt chat (app/turn_analysis.py): message giống nhau dùng lại kết quả
+đã cache nhưng mỗi lời gọi nhận bản sao riêng, sửa symptoms/flags không lan sang session khác.
+
+Chạy: python -m pytest test_turn_analysis.py
+"""
+
+from app.turn_analysis import analyze_turn
+
+
+def test_cached_analysis_is_not_shared_between_calls():
+    first = analyze_turn("tôi bị đau bụng dữ dội, sốt cao")
+    second = analyze_turn("Tôi bị đau bụng dữ dội, sốt cao ")
+    assert first.symptoms == second.symptoms and first.flags == second.flags
+    assert first.symptoms is not second.symptoms and first.flags is not second.flags
+
+    expected = dict(second.symptoms)
+    for key, value in first.symptoms.items():
+        if isinstance(value, list):
+            value.append("đã sửa")
+    first.symptoms["them"] = True
+    assert analyze_turn("tôi bị đau bụng dữ dội, sốt cao").symptoms == expected
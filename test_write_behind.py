@@ -0,0 +1,103 @@
+"""
+Kiểm tra hàng đợi ghi chat write-behind (app/write_behind.py) trên Firestore giả lập:
+ghi đồng thời nhiều thread khi commit lỗi ngẫu nhiên, và 1 ghi lỗi (chatSessions đã bị xóa)
+không làm mất các ghi khác trong cùng lô.
+
+Chạy: python -m pytest test_write_behind.py
+"""
+
+import random
+import threading
+
+from app.write_behind import FirestoreWriteBehind
+from firestore_memory import MemoryFirestore
+
+
+class FlakyFirestore(MemoryFirestore):
+    """Commit WriteBatch lỗi ngẫu nhiên với xác suất failure_rate."""
+
+    def __init__(self, failure_rate: float, seed: int = 0):
+        super().__init__(latency_ms=0, jitter_ms=0, per_doc_ms=0)
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.failed = 0
+
+    def batch(self):
+        batch = super().batch()
+        commit = batch.commit
+
+        def flaky_commit():
+            with self._rng_lock:
+                fail = self._rng.random() < self.failure_rate
+            if fail:
+                self.failed += 1
+                batch._writes = []
+                raise RuntimeError("Firestore tạm thời lỗi")
+            commit()
+
+        batch.commit = flaky_commit
+        return batch
+
+
+def _session(title):
+    return {"userId": "u1", "sessionId": "s1", "title": title}
+
+
+def _sessions(db, session_id):
+    return db.collection("chatSessions").where("sessionId", "==", session_id).get()
+
+
+def test_concurrent_writes_survive_failing_commits():
+    db = FlakyFirestore(failure_rate=0.3)
+    writer = FirestoreWriteBehind(lambda: db, flush_interval_ms=5, max_batch=50, retries=50)
+    writer.start()
+
+    def worker(i):
+        for n in range(50):
+            writer.enqueue_message({"sessionId": f"s{i}", "userId": f"u{i}", "text": f"m{n}"})
+            writer.enqueue_session(
+                f"u{i}", f"s{i}", {"userId": f"u{i}", "sessionId": f"s{i}", "lastMessage": f"m{n}"},
+                on_create={"createdAt": n},
+            )
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.stop(timeout=30)
+
+    assert db.failed > 0
+    assert writer.stats()["dropped"] == 0 and writer.pending() == 0
+    assert len(db.collection("messages").get()) == 20 * 50
+    for i in range(20):
+        sessions = _sessions(db, f"s{i}")
+        assert len(sessions) == 1  # không tạo trùng document chatSessions
+        assert sessions[0].to_dict()["lastMessage"] == "m49"
+
+
+def test_deleted_session_does_not_poison_batch():
+    db = MemoryFirestore(latency_ms=0, jitter_ms=0, per_doc_ms=0)
+    writer = FirestoreWriteBehind(lambda: db, max_batch=50, retries=1)
+    writer.enqueue_session("u1", "s1", _session("cũ"), on_create={"createdAt": 1})
+    assert writer.flush()
+    old_id = _sessions(db, "s1")[0].id
+
+    # Document bị xóa (vd user xóa hội thoại) trong khi id vẫn được nhớ trong _session_docs
+    db.collection("chatSessions").document(old_id).delete()
+    for n in range(5):
+        writer.enqueue_message({"sessionId": "s1", "userId": "u1", "text": f"m{n}"})
+    writer.enqueue_session("u1", "s1", _session("mới"), on_create={"createdAt": 2})
+    assert writer.flush()
+
+    assert writer.stats()["dropped"] == 0
+    assert len(db.collection("messages").get()) == 5
+    sessions = _sessions(db, "s1")
+    assert len(sessions) == 1 and sessions[0].id != old_id
+    assert sessions[0].to_dict() == {**_session("mới"), "createdAt": 2}
+
+    # Id mới được nhớ lại: lần cập nhật sau ghi thẳng vào document mới
+    writer.enqueue_session("u1", "s1", _session("sau"))
+    assert writer.flush()
+    assert _sessions(db, "s1")[0].to_dict()["title"] == "sau"
@@ -0,0 +1,103 @@
+"""
+So sánh kiến trúc 2 model (PhoBERT intent + SBERT retriever) với shared encoder
+(SBERT + intent head) trên tập TEST của train/train.py.
+
+Báo cáo:
+- Intent: accuracy, F1-macro, recall-macro
+- RAG: không đo — shared encoder dùng đúng trọng số vietnamese-sbert của retriever hiện tại nên
+  vector truy vấn và kết quả top-k không đổi theo cấu trúc (chỉ so sánh bộ nhớ và thời gian)
+- Bộ nhớ tham số model và thời gian CPU mỗi lượt (intent + embedding truy vấn)
+
+Chạy: python train/compare_shared_encoder.py
+"""
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import accuracy_score, f1_score, recall_score
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.settings import INTENT_MODEL_PATH, RAG_PATH, SHARED_INTENT_HEAD_PATH  # noqa: E402
+from intent.intent_classifier import IntentClassifier  # noqa: E402
+from intent.shared_encoder_classifier import SharedEncoderIntentClassifier  # noqa: E402
+from rag.retriever import Retriever  # noqa: E402
+
+# Cùng cấu hình split với train/train.py để đánh giá đúng tập TEST
+DATA_PATH = os.environ.get("DATA_PATH", r"data/data_dao_moi.csv")
+SEED = 42
+TRAIN_RATIO = 0.70
+VAL_RATIO = 0.15
+TEST_RATIO = 0.15
+
+TIMING_SAMPLES = 50
+
+
+def load_test_split():
+    df = pd.read_csv(DATA_PATH)
+    df["text"] = df["text"].astype(str).apply(lambda s: re.sub(r"\s+", " ", s).strip())
+    df["intent"] = df["intent"].astype(str).str.strip()
+    df = df[df["text"].str.len() > 0].drop_duplicates(subset=["text", "intent"]).reset_index(drop=True)
+    _, temp_df = train_test_split(df, test_size=(1.0 - TRAIN_RATIO), stratify=df["intent"], random_state=SEED)
+    val_size_of_temp = VAL_RATIO / (VAL_RATIO + TEST_RATIO)
+    _, test_df = train_test_split(
+        temp_df, test_size=(1.0 - val_size_of_temp), stratify=temp_df["intent"], random_state=SEED
+    )
+    return test_df
+
+
+def param_megabytes(*modules):
+    total = 0
+    for module in modules:
+        total += sum(p.numel() * p.element_size() for p in module.parameters())
+    return total / (1024 * 1024)
+
+
+def evaluate_intent(name, classifier, test_df):
+    labels = test_df["intent"].tolist()
+    preds = [classifier.predict_topk(text, k=1)[0][0] for text in test_df["text"]]
+    print(f"\n🧠 INTENT - {name}")
+    print(f"   Accuracy:     {accuracy_score(labels, preds):.4f}")
+    print(f"   F1-macro:     {f1_score(labels, preds, average='macro'):.4f}")
+    print(f"   Recall-macro: {recall_score(labels, preds, average='macro'):.4f}")
+
+
+def time_per_turn(classifier, retriever, texts):
+    start = time.perf_counter()
+    for text in texts:
+        classifier.predict_topk(text, k=2)
+        retriever.encode_query(text)
+    return (time.perf_counter() - start) / max(1, len(texts)) * 1000
+
+
+def main():
+    test_df = load_test_split()
+    print(f"📕 Test: {len(test_df)} câu ({DATA_PATH})")
+
+    # Kiến trúc hiện tại: 2 transformer
+    phobert = IntentClassifier(INTENT_MODEL_PATH)
+    baseline_retriever = Retriever(RAG_PATH)
+
+    # Shared encoder: 1 transformer + intent head
+    shared = SharedEncoderIntentClassifier(SHARED_INTENT_HEAD_PATH)
+    shared_retriever = Retriever(RAG_PATH, embedder=shared)
+
+    evaluate_intent("PhoBERT (2 model)", phobert, test_df)
+    evaluate_intent("Shared SBERT + head", shared, test_df)
+
+    # Bộ nhớ tham số và thời gian mỗi lượt
+    baseline_mb = param_megabytes(phobert.model, baseline_retriever.embedder)
+    shared_mb = param_megabytes(shared.encoder, shared.head)
+    sample = test_df["text"].tolist()[:TIMING_SAMPLES]
+    baseline_ms = time_per_turn(phobert, baseline_retriever, sample)
+    shared_ms = time_per_turn(shared, shared_retriever, sample)
+    print("\n📊 TÀI NGUYÊN")
+    print(f"   Tham số model:   {baseline_mb:8.1f} MB → {shared_mb:8.1f} MB")
+    print(f"   CPU mỗi lượt:    {baseline_ms:8.1f} ms → {shared_ms:8.1f} ms (intent + embedding truy vấn)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 import os
 import re
+import sys
 import numpy as np
 import pandas as pd
 import torch
 
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, f1_score, classification_report, confusion_matrix
+from sklearn.metrics import accuracy_score, f1_score, recall_score, classification_report, confusion_matrix
 
 from datasets import Dataset
 from transformers import (
@@ -27,6 +28,16 @@ MAX_LEN = 128
 OUTPUT_DIR = "intent_model"
 SEED = 42
 
+# "phobert": fine-tune PhoBERT (mặc định, như cũ)
+# "shared_sbert": giữ nguyên encoder vietnamese-sbert của RAG, chỉ train intent head nhỏ phía trên
+TRAIN_MODE = os.environ.get("TRAIN_MODE", "phobert")
+SHARED_ENCODER_NAME = "keepitreal/vietnamese-sbert"
+SHARED_HEAD_OUTPUT = "intent_head_shared_sbert.pt"
+SHARED_HEAD_HIDDEN = 0      # 0 = Linear; > 0 = MLP 1 tầng ẩn
+SHARED_HEAD_EPOCHS = 200
+SHARED_HEAD_LR = 1e-3
+SHARED_HEAD_PATIENCE = 15
+
 TRAIN_RATIO = 0.70
 VAL_RATIO = 0.15
 TEST_RATIO = 0.15
@@ -86,6 +97,94 @@ val_df, test_df = train_test_split(
 
 print(f"\n📘 Train: {len(train_df)}    📗 Val: {len(val_df)}    📕 Test: {len(test_df)}")
 
+# =====================================
+# 2b) SHARED ENCODER: SBERT (frozen) + INTENT HEAD
+# =====================================
+# Encoder giống hệt encoder của Retriever → 1 forward pass/lượt cho cả intent và FAISS.
+# Encoder frozen nên chỉ cần encode dữ liệu 1 lần rồi train head trên embedding.
+
+def train_shared_head():
+    from sentence_transformers import SentenceTransformer
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from intent.shared_encoder_classifier import build_intent_head
+
+    torch.manual_seed(SEED)
+    print(f"\n🧠 Encoding với shared encoder: {SHARED_ENCODER_NAME}")
+    encoder = SentenceTransformer(SHARED_ENCODER_NAME)
+
+    def embed(frame):
+        emb = encoder.encode(
+            frame["text"].tolist(),
+            batch_size=64,
+            convert_to_numpy=True,
+            show_progress_bar=True,
+            normalize_embeddings=True  # giống lúc inference
+        )
+        return torch.from_numpy(emb.astype("float32")), torch.tensor(frame["label"].values)
+
+    x_train, y_train = embed(train_df)
+    x_val, y_val = embed(val_df)
+    x_test, y_test = embed(test_df)
+
+    dim = x_train.shape[1]
+    head = build_intent_head(dim, len(intents), hidden_dim=SHARED_HEAD_HIDDEN)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=SHARED_HEAD_LR, weight_decay=0.01)
+    loss_fn = torch.nn.CrossEntropyLoss(label_smoothing=0.05)
+
+    best_f1, best_state, bad_epochs = -1.0, None, 0
+    for epoch in range(SHARED_HEAD_EPOCHS):
+        head.train()
+        perm = torch.randperm(len(x_train))
+        for start in range(0, len(perm), 64):
+            batch = perm[start:start + 64]
+            optimizer.zero_grad()
+            loss = loss_fn(head(x_train[batch]), y_train[batch])
+            loss.backward()
+            optimizer.step()
+
+        head.eval()
+        with torch.no_grad():
+            val_preds = head(x_val).argmax(dim=1).numpy()
+        val_f1 = f1_score(y_val.numpy(), val_preds, average="macro")
+        if val_f1 > best_f1:
+            best_f1, bad_epochs = val_f1, 0
+            best_state = {k: v.clone() for k, v in head.state_dict().items()}
+        else:
+            bad_epochs += 1
+        if epoch % 10 == 0:
+            print(f"   epoch {epoch:3d} | loss={loss.item():.4f} | val_f1_macro={val_f1:.4f}")
+        if bad_epochs >= SHARED_HEAD_PATIENCE:
+            print(f"⏹️ Early stopping ở epoch {epoch} (best val_f1_macro={best_f1:.4f})")
+            break
+
+    head.load_state_dict(best_state)
+    head.eval()
+    with torch.no_grad():
+        test_preds = head(x_test).argmax(dim=1).numpy()
+    test_labels = y_test.numpy()
+
+    print("\n✅ TEST metrics (shared_sbert head):")
+    print("Accuracy:", accuracy_score(test_labels, test_preds))
+    print("F1-macro:", f1_score(test_labels, test_preds, average="macro"))
+    print("Recall-macro:", recall_score(test_labels, test_preds, average="macro"))
+    print("\n📄 Classification report (per intent):")
+    print(classification_report(test_labels, test_preds, target_names=[id2label[i] for i in range(len(intents))], digits=4))
+
+    torch.save({
+        "state_dict": head.state_dict(),
+        "id2label": id2label,
+        "encoder": SHARED_ENCODER_NAME,
+        "dim": dim,
+        "hidden_dim": SHARED_HEAD_HIDDEN,
+    }, SHARED_HEAD_OUTPUT)
+    print("\n🎉 DONE! Shared intent head saved to:", SHARED_HEAD_OUTPUT)
+    print("👉 So sánh với PhoBERT: python train/compare_shared_encoder.py")
+
+
+if TRAIN_MODE == "shared_sbert":
+    train_shared_head()
+    sys.exit(0)
+
 # =====================================
 # 3) TOKENIZER + MODEL
 # =====================================
@@ -204,6 +303,7 @@ print("\n✅ TEST metrics:")
 print("Accuracy:", accuracy_score(test_labels, test_preds))
 print("F1-macro:", f1_score(test_labels, test_preds, average="macro"))
 print("F1-weighted:", f1_score(test_labels, test_preds, average="weighted"))
+print("Recall-macro:", recall_score(test_labels, test_preds, average="macro"))
 
 print("\n📄 Classification report (per intent):")
 print(classification_report(test_labels, test_preds, target_names=[id2label[i] for i in range(len(intents))], digits=4))